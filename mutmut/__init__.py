@@ -3,15 +3,17 @@ from __future__ import annotations
 from concurrent.futures import ThreadPoolExecutor
 import uuid
 import fnmatch
+import hashlib
 import multiprocessing
 import os
+import re
 import shlex
 import subprocess
 import sys
 import toml
 from configparser import ConfigParser
 from copy import copy as copy_obj
-from functools import wraps
+from functools import partial, wraps
 from io import (
     open,
     TextIOBase,
@@ -21,12 +23,9 @@ from shutil import (
     move,
     copy,
 )
-from threading import (
-    Timer,
-    Thread,
-)
+from threading import Thread
 from time import time
-from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
 
 from parso import parse
 
@@ -35,8 +34,10 @@ from .utils import (
     ASTPattern, import_from_star_pattern, array_subscript_pattern, function_call_pattern,
     Context,
     Config,
+    Edit,
     Progress, UNTESTED, SKIPPED, BAD_TIMEOUT, OK_SUSPICIOUS, BAD_SURVIVED, OK_KILLED, MUTANT_STATUSES, print_status,
     SkipException,
+    SelectedTestsNotFoundException,
     MutationCollection
 )
 
@@ -108,19 +109,12 @@ mutations_by_type = {
 # TODO: detect regexes and mutate them in nasty ways? Maybe mutate all strings as if they are regexes
 
 def mutate(context: Context) -> Tuple[str, int]:
-    try:
-        result = parse(context.source, error_recovery=False)
-    except Exception:
-        print('Failed to parse {}. Internal error from parso follows.'.format(context.filename))
-        print('----------------------------------')
-        raise
-    mutation_collection = MutationCollection(result.children)
-    mutation_iterator = mutation_collection.get_iterator()
-    while mutation_iterator.has_next():
-        node = mutation_iterator.current()
-        mutate_node(node, context=context)
-        mutation_iterator.__next__()
-    mutated_source = result.get_code().replace(' not not ', ' ')
+    if context.edit is not None:
+        # listed before, no need to parse the file again
+        context.performed_mutation_ids = [context.mutation_id]
+        mutated_source = context.edit.apply(context.source)
+    else:
+        mutated_source = _mutate_tree(context).get_code().replace(' not not ', ' ')
     if context.remove_newline_at_end:
         assert mutated_source[-1] == '\n'
         mutated_source = mutated_source[:-1]
@@ -135,6 +129,22 @@ def mutate(context: Context) -> Tuple[str, int]:
     return mutated_source, len(context.performed_mutation_ids)
 
 
+def _mutate_tree(context: Context):
+    try:
+        result = parse(context.source, error_recovery=False)
+    except Exception:
+        print('Failed to parse {}. Internal error from parso follows.'.format(context.filename))
+        print('----------------------------------')
+        raise
+    mutation_collection = MutationCollection(result.children)
+    mutation_iterator = mutation_collection.get_iterator()
+    while mutation_iterator.has_next():
+        node = mutation_iterator.current()
+        mutate_node(node, context=context)
+        mutation_iterator.__next__()
+    return result
+
+
 def mutate_node(node, context: Context):
     context.stack.append(node)
     try:
@@ -197,7 +207,10 @@ def mutate_node(node, context: Context):
                     mutmut_config.pre_mutation_ast(context=context)
                 if context.should_mutate(node):
                     context.performed_mutation_ids.append(context.mutation_id_of_current_index)
-                    if hasattr(node, 'value'):
+                    if context.edits is not None:
+                        # listing the mutations: note the edit, but leave the tree as it is
+                        context.edits.append(edit_of(node, new, context))
+                    elif hasattr(node, 'value'):
                         node.value = new
                     else:
                         node.children = new
@@ -229,12 +242,58 @@ def mutate_list_of_nodes(node, context: Context):
             return
 
 
+def edit_of(node, new, context: Context) -> Edit:
+    """The edit of the source that replaces the value or children of ``node`` with ``new``"""
+    if hasattr(node, 'value'):
+        return Edit(context.offset_of(node.start_pos), len(node.value), new)
+    # the new children bring their own prefixes, so the edit starts at the prefix of the node
+    start = context.offset_of(node.get_first_leaf().get_start_pos_of_prefix())
+    return Edit(start, context.offset_of(node.end_pos) - start, ''.join(x.get_code() for x in new))
+
+
 def list_mutations(context: Context):
     assert context.mutation_id == ALL
     mutate(context)
     return context.performed_mutation_ids
 
 
+def catalog_mutations(context: Context) -> Dict[RelativeMutationID, Edit]:
+    """The edit that makes each mutant of the source, found in one walk of the tree
+
+    :func:`list_mutations` leaves every mutation in the tree for the next
+    ones to see, this leaves the tree as it is, so that each edit is the one
+    :func:`mutate` makes for that mutant alone. Setting ``context.edit`` of
+    a mutant from the catalog makes :func:`mutate` splice the source instead
+    of parsing it again.
+    """
+    assert context.mutation_id == ALL
+    context.edits = []
+    _mutate_tree(context)
+    catalog = {}
+    for mutation_id, edit in zip(context.performed_mutation_ids, context.edits):
+        # like mutate, the first node with the mutation id wins
+        catalog.setdefault(mutation_id, edit)
+    return catalog
+
+
+def catalogs_apply() -> bool:
+    """Whether mutants can be spliced from their :func:`catalog_mutations`
+    edits, which skips the walk of the tree the ``pre_mutation_ast`` hook
+    has to see for each of them"""
+    return not hasattr(mutmut_config, 'pre_mutation_ast')
+
+
+def shard_of(filename: str, mutation_id: RelativeMutationID, shard_count: int) -> int:
+    """The shard (counting from 1) a mutant belongs to, out of ``shard_count``
+
+    This only depends on what the mutant is, not on its primary key in the
+    cache, so every ``--shard`` job of a run agrees on it.
+    """
+    key = '\0'.join([filename, mutation_id.line, str(mutation_id.line_number), str(mutation_id.index)])
+    digest = hashlib.sha256(key.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count + 1
+
+
 def mutate_file(backup: bool, context: Context) -> Tuple[str, str]:
     with open(context.filename) as f:
         original = f.read()
@@ -254,20 +313,24 @@ def queue_mutants(
         config: Config,
         mutants_queue,
         mutations_by_file: Dict[str, List[RelativeMutationID]],
-        max_workers: int = 2
+        max_workers: int = 2,
+        schemata_keys: Optional[Dict[Tuple[str, RelativeMutationID], str]] = None,
+        catalogs: Optional[Dict[str, Dict[RelativeMutationID, Edit]]] = None,
 ):
-    from mutmut.cache import get_cached_mutation_statuses
+    from mutmut.cache import get_cached_mutants
 
     try:
         index = 0
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             futures = []
             for filename, mutations in mutations_by_file.items():
-                cached_mutation_statuses = get_cached_mutation_statuses(filename, mutations, config.hash_of_tests)
+                # one query for the file, the workers don't go to the cache
+                cached_mutants = get_cached_mutants(
+                    filename, mutations, {x: hash_of_tests_of_mutant(config, filename, x) for x in mutations})
                 with open(filename) as f:
                     source = f.read()
                 for mutation_id in mutations:
-                    cached_status = cached_mutation_statuses.get(mutation_id)
+                    cached_status, killed_by = cached_mutants[mutation_id]
                     if cached_status != UNTESTED:
                         progress.register(cached_status)
                         continue
@@ -279,6 +342,11 @@ def queue_mutants(
                         source=source,
                         index=index,
                     )
+                    context.killed_by = killed_by
+                    if schemata_keys:
+                        context.schemata_key = schemata_keys.get((filename, mutation_id))
+                    if catalogs:
+                        context.edit = catalogs.get(filename, {}).get(mutation_id)
                     futures.append(executor.submit(mutants_queue.put, ('mutant', context)))
                     index += 1
             for future in futures:
@@ -287,48 +355,50 @@ def queue_mutants(
         mutants_queue.put(('end', None))
 
 
-def check_mutants(mutants_queue, results_queue, cycle_process_after, max_workers):
+def check_mutants(mutants_queue, results_queue, max_workers):
     def feedback(line):
-        results_queue.put(('progress', line, None, None))
+        results_queue.put(('progress', line, None, None, None))
 
-    did_cycle = False
+    def report_status(context, future):
+        results_queue.put(('status', future.result(), context.filename, context.mutation_id, context.killed_by))
 
     try:
-        count = 0
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
             while True:
                 command, context = mutants_queue.get()
                 if command == 'end':
                     break
 
                 future = executor.submit(run_mutation, context, feedback)
-                futures.append((future, context))
-                count += 1
-                if count == cycle_process_after:
-                    results_queue.put(('cycle', None, None, None))
-                    did_cycle = True
-                    break
-
-            for future, context in futures:
-                status = future.result()
-                results_queue.put(('status', status, context.filename, context.mutation_id))
+                future.add_done_callback(partial(report_status, context))
     finally:
-        if not did_cycle:
-            results_queue.put(('end', None, None, None))
+        results_queue.put(('end', None, None, None, None))
 
 
 def run_mutation(context: Context, callback) -> str:
+    """Test a mutant :func:`queue_mutants` found no cached result for
+
+    :return: status of the tested mutant, one of mutant_statuses
     """
-    :return: (computed or cached) status of the tested mutant, one of mutant_statuses
-    """
-    from mutmut.cache import cached_mutation_status
-    cached_status = cached_mutation_status(context.filename, context.mutation_id, context.config.hash_of_tests)
+    look_up_mutant(context)
+    return run_mutation_uncached(context, callback)
 
-    if cached_status != UNTESTED and context.config.total != 1:
-        return cached_status
 
+def look_up_mutant(context: Context):
+    """Fill in what the coverage data tell us about the mutant, before it is
+    tested. What the cache knows, :func:`queue_mutants` filled in already."""
+    context.selected_tests = select_tests_for_mutant(context.config, context)
+
+
+def run_mutation_uncached(context: Context, callback) -> str:
+    """Test the mutant without the cache, e.g. on a :mod:`mutmut.distributed` worker
+
+    :return: status of the tested mutant, one of mutant_statuses
+    """
     config = context.config
+    if context.selected_tests is not None:
+        config.test_command = ' '.join([config.test_command] + [shlex.quote(x) for x in context.selected_tests])
+
     if hasattr(mutmut_config, 'pre_mutation'):
         context.current_line_index = context.mutation_id.line_number
         try:
@@ -338,24 +408,213 @@ def run_mutation(context: Context, callback) -> str:
         if context.skip:
             return SKIPPED
 
+    if config.sandbox:
+        from mutmut.sandbox import get_sandbox_pool
+        with get_sandbox_pool(config.paths_to_mutate, ignore=config.sandbox_ignore).acquire() as sandbox:
+            return _run_mutation(context, callback, sandbox)
+
+    return _run_mutation(context, callback, sandbox=None)
+
+
+def select_tests_for_mutant(config: Config, context: Context) -> Optional[List[str]]:
+    """The tests that cover the mutated line, if ``--select-tests`` is on
+
+    :return: pytest node ids, or :obj:`None` if all tests should run
+    """
+    if not config.select_tests:
+        return None
+    return covering_tests(config, context.filename, context.mutation_id)
+
+
+def covering_tests(config: Config, filename: str, mutation_id: RelativeMutationID) -> Optional[List[str]]:
+    """The tests that cover the mutated line, going by the coverage contexts
+    that pytest-cov records with ``--cov-context=test``
+
+    :return: pytest node ids, or :obj:`None` if any test may cover it
+    """
+    if not config.coverage_data:
+        return None
+    contexts = config.coverage_data.get(os.path.abspath(filename), {}).get(mutation_id.line_number + 1)
+    # contexts look like "tests/test_foo.py::test_foo|run", the empty context is code that ran outside of a test
+    node_ids = {x.rpartition('|')[0] or x for x in contexts or []}
+    if not node_ids or not all('::' in x for x in node_ids):
+        return None
+    return sorted(node_ids)
+
+
+def tests_running_lines(config: Config, lines_by_file: Dict[str, List[int]]) -> Optional[Set[str]]:
+    """The tests that run any of the lines, going by the coverage contexts
+
+    :param lines_by_file: zero based line numbers, by filename
+    :return: pytest node ids, or :obj:`None` if code outside of a test runs
+        one of the lines, so any test may
+    """
+    tests = set()
+    for filename, line_numbers in lines_by_file.items():
+        coverage = config.coverage_data.get(os.path.abspath(filename), {})
+        for line_number in line_numbers:
+            node_ids = {x.rpartition('|')[0] or x for x in coverage.get(line_number + 1) or []}
+            if not all('::' in x for x in node_ids):
+                return None
+            tests |= node_ids
+    return tests
+
+
+def mutants_depending_on_lines(
+        config: Config,
+        mutations_by_file: Dict[str, List[RelativeMutationID]],
+        lines_by_file: Dict[str, List[int]],
+) -> Dict[str, List[RelativeMutationID]]:
+    """The mutants whose covering tests run any of the lines, so their
+    result may be different when the lines change"""
+    tests = tests_running_lines(config, lines_by_file)
+    if tests is not None and not tests:
+        return {}
+    result = {}
+    for filename, mutations in mutations_by_file.items():
+        dependent = []
+        for mutation_id in mutations:
+            covering = covering_tests(config, filename, mutation_id)
+            if tests is None or covering is None or tests.intersection(covering):
+                dependent.append(mutation_id)
+        if dependent:
+            result[filename] = dependent
+    return result
+
+
+def hash_of_tests_of_mutant(config: Config, filename: str, mutation_id: RelativeMutationID) -> str:
+    """The hash of the tests the result of a mutant depends on, which the
+    cache keeps as ``tested_against_hash``
+
+    That's :func:`mutmut.cache.hash_of_tests` of all of them, unless the
+    coverage contexts tell us which tests cover the mutated line. Then only
+    their test files count, and the test helpers that aren't test modules.
+    """
+    from mutmut.cache import NO_TESTS_FOUND, is_test_module
+    if config.hashes_of_test_files is None or config.hash_of_tests == NO_TESTS_FOUND:
+        return config.hash_of_tests
+    tests = covering_tests(config, filename, mutation_id)
+    if tests is None:
+        return config.hash_of_tests
+
+    test_files = {os.path.normpath(x.partition('::')[0]) for x in tests}
+    m = hashlib.sha256()
+    for test_file, hash in sorted(config.hashes_of_test_files.items()):
+        if test_file in test_files or not is_test_module(test_file):
+            m.update('{}\0{}\0'.format(test_file, hash).encode('utf-8'))
+    return m.hexdigest()
+
+
+_ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def failed_test_in(line: str) -> Optional[str]:
+    """The node id in a line of pytest's short test summary like
+    ``FAILED tests/test_foo.py::test_foo - assert 1 == 2``, if it is one"""
+    line = _ANSI_ESCAPE.sub('', line).strip()
+    if not line.startswith('FAILED '):
+        return None
+    node_id = line[len('FAILED '):].partition(' - ')[0]
+    return node_id if '::' in node_id else None
+
+
+def mutant_timeout(config: Config, tests: Optional[List[str]] = None) -> float:
+    """Seconds the tests of a mutant may take before it counts as a timeout
+
+    That's ``timeout_multiplier`` times how long the tests that will run took
+    in the baseline run, plus the time the test command takes to start unless
+    the runner keeps a session alive, but at least ``timeout_floor``. Without
+    per-test durations, the baseline run as a whole is what's expected.
+
+    :param tests: pytest node ids of the tests that will run, :obj:`None` for all of them
+    """
+    durations = config.test_durations
+    if durations:
+        total = sum(durations.values())
+        if tests is not None and all(x in durations for x in tests):
+            expected = sum(durations[x] for x in tests)
+        else:
+            expected = total
+        if config.runner_mode not in IN_MEMORY_RUNNER_MODES:
+            # interpreter startup, imports and collection
+            expected += max(config.baseline_time_elapsed - total, 0.0)
+    else:
+        expected = config.baseline_time_elapsed
+    return max(expected * config.timeout_multiplier, config.timeout_floor)
+
+
+def applied_in_memory(config: Config, context: Context) -> bool:
+    """Whether the runner applies the mutant itself, so it must not be written to disk"""
+    if context.schemata_key is not None or config.runner_mode in IN_MEMORY_RUNNER_MODES:
+        return True
+    # hammett imports the mutant through mutmut.import_hook, but only if all the test commands we may run are hammett
+    test_commands = [config.test_command] + ([config.default_test_command] if config.rerun_all else [])
+    return all(x.startswith(hammett_prefix) for x in test_commands)
+
+
+def _run_mutation(context: Context, callback, sandbox) -> str:
+    config = context.config
+    cwd = sandbox.path if sandbox is not None else None
+    in_memory = applied_in_memory(config, context)
+
     if config.pre_mutation:
-        result = subprocess.check_output(config.pre_mutation, shell=True).decode().strip()
+        result = subprocess.check_output(config.pre_mutation, shell=True, cwd=cwd).decode().strip()
         if result and not config.swallow_output:
             callback(result)
 
     try:
-        mutate_file(
-            backup=True,
-            context=context
-        )
+        if in_memory:
+            # the mutant is applied by tests_pass
+            pass
+        elif sandbox is not None:
+            mutated_source, _ = mutate(context)
+            sandbox.write(context.filename, mutated_source)
+        else:
+            mutate_file(
+                backup=True,
+                context=context
+            )
+
+        def record_killer(line):
+            if context.killed_by is None:
+                context.killed_by = failed_test_in(line)
+            callback(line)
+
         start = time()
         try:
-            survived = tests_pass(config=config, callback=callback)
+            mutant = context if in_memory else None
+            survived = True
+            if context.killed_by is not None and not config.test_command.startswith(hammett_prefix):
+                # the test that killed the mutant last time will most likely kill it again, on its own
+                test_command, selected_tests = config.test_command, context.selected_tests
+                config.test_command = ' '.join([config.default_test_command, shlex.quote(context.killed_by)])
+                context.selected_tests = [context.killed_by]
+                try:
+                    survived = tests_pass(config=config, callback=callback, sandbox=sandbox, context=mutant,
+                                          timeout=mutant_timeout(config, context.selected_tests))
+                except SelectedTestsNotFoundException:
+                    # the test is gone since it killed the mutant
+                    survived = True
+                config.test_command, context.selected_tests = test_command, selected_tests
+            if survived:
+                context.killed_by = None
+                try:
+                    survived = tests_pass(config=config, callback=record_killer, sandbox=sandbox, context=mutant,
+                                          timeout=mutant_timeout(config, context.selected_tests))
+                except SelectedTestsNotFoundException:
+                    # the coverage contexts name tests that are gone since, so they can't tell which to run
+                    config.test_command = config.default_test_command
+                    context.selected_tests = None
+                    survived = tests_pass(config=config, callback=record_killer, sandbox=sandbox, context=mutant,
+                                          timeout=mutant_timeout(config))
             if survived and config.test_command != config.default_test_command and config.rerun_all:
                 # rerun the whole test suite to be sure the mutant can not be killed by other tests
                 config.test_command = config.default_test_command
-                survived = tests_pass(config=config, callback=callback)
+                context.selected_tests = None
+                survived = tests_pass(config=config, callback=record_killer, sandbox=sandbox, context=mutant,
+                                      timeout=mutant_timeout(config))
         except TimeoutError:
+            context.killed_by = None
             return BAD_TIMEOUT
 
         time_elapsed = time() - start
@@ -365,6 +624,7 @@ def run_mutation(context: Context, callback) -> str:
             return OK_SUSPICIOUS
 
         if survived:
+            context.killed_by = None
             return BAD_SURVIVED
         else:
             return OK_KILLED
@@ -372,29 +632,64 @@ def run_mutation(context: Context, callback) -> str:
         return SKIPPED
 
     finally:
-        move(context.backup_filename, context.filename)
+        if not in_memory:
+            if sandbox is not None:
+                sandbox.restore(context.filename)
+            else:
+                move(context.backup_filename, context.filename)
         config.test_command = config.default_test_command  # reset test command to its default in the case it was altered in a hook
 
         if config.post_mutation:
-            result = subprocess.check_output(config.post_mutation, shell=True).decode().strip()
+            result = subprocess.check_output(config.post_mutation, shell=True, cwd=cwd).decode().strip()
             if result and not config.swallow_output:
                 callback(result)
 
 
-def tests_pass(config: Config, callback) -> bool:
+def tests_pass(config: Config, callback, sandbox=None, context: Optional[Context] = None,
+               timeout: Optional[float] = None) -> bool:
     """
+    :param sandbox: if given, run the tests inside this :class:`mutmut.sandbox.Sandbox`
+        instead of the working tree
+    :param context: the mutant under test, if the runner has to apply it (see :func:`applied_in_memory`)
+    :param timeout: seconds before the tests count as timed out, see :func:`mutant_timeout`
+    :raises SelectedTestsNotFoundException: if pytest found none of the tests
+        selected for the mutant, or not all of them
     :return: :obj:`True` if the tests pass, otherwise :obj:`False`
     """
+    if timeout is None:
+        timeout = mutant_timeout(config)
+    cwd = sandbox.path if sandbox is not None else os.curdir
     if config.using_testmon:
-        copy('.testmondata-initial', '.testmondata')
+        testmondata = os.path.join(cwd, '.testmondata')
+        if sandbox is not None and os.path.lexists(testmondata):
+            os.unlink(testmondata)
+        copy(os.path.join(cwd, '.testmondata-initial'), testmondata)
 
     use_special_case = True
 
     # Special case for hammett! We can do in-process test running which is much faster
     if use_special_case and config.test_command.startswith(hammett_prefix):
-        return hammett_tests_pass(config, callback)
-
-    returncode = popen_streaming_output(config.test_command, callback, timeout=config.baseline_time_elapsed * 10)
+        return hammett_tests_pass(config, callback, context, timeout=timeout)
+
+    if config.runner_mode in IN_MEMORY_RUNNER_MODES and context is not None:
+        return in_memory_tests_pass(config, context, timeout=timeout)
+
+    env = sandbox.env() if sandbox is not None else None
+    if context is not None and context.schemata_key is not None:
+        from mutmut.schemata import MUTANT_UNDER_TEST
+        env = dict(os.environ if env is None else env)
+        env[MUTANT_UNDER_TEST] = context.schemata_key
+
+    returncode = popen_streaming_output(
+        config.test_command,
+        callback,
+        timeout=timeout,
+        cwd=sandbox.path if sandbox is not None else None,
+        env=env,
+    )
+    if returncode in (4, 5) and config.test_command != config.default_test_command:
+        # pytest exits with a usage error if it can't find a node id, and 5 if it collected no tests
+        raise SelectedTestsNotFoundException(config.test_command)
     return returncode not in (1, 2)
 
 
@@ -466,81 +761,68 @@ def get_mutations_by_file_from_cache(mutation_pk):
 
 
 def popen_streaming_output(
-        cmd: str, callback: Callable[[Union[str, bytes]], None], timeout: Optional[float] = None
+        cmd: str, callback: Callable[[Union[str, bytes]], None], timeout: Optional[float] = None,
+        cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None,
 ) -> int:
     """Open a subprocess and stream its output without hard-blocking.
 
+    The subprocess is run by the :mod:`mutmut.supervisor` event loop, which
+    also runs those of the other workers.
+
     :param cmd: the command to execute within the subprocess
     :param callback: function that intakes the subprocess' stdout line by line.
         It is called for each line received from the subprocess' stdout stream.
     :param timeout: the timeout time of the subprocess
+    :param cwd: working directory of the subprocess, defaults to the current one
+    :param env: environment of the subprocess, defaults to the current one
     :raises TimeoutError: if the subprocess' execution time exceeds
         the timeout time
     :return: the return code of the executed subprocess
     """
-    if os.name == 'nt':  # pragma: no cover
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            shell=True,
-        )
-        stdout = process.stdout
-    else:
-        master, slave = os.openpty()
-        process = subprocess.Popen(
-            shlex.split(cmd, posix=True),
-            stdout=slave,
-            stderr=slave
-        )
-        stdout = os.fdopen(master)
-        os.close(slave)
-
-    def kill(process_):
-        """Kill the specified process on Timer completion"""
-        try:
-            process_.kill()
-        except OSError:
-            pass
-
-    # python 2-3 agnostic process timer
-    timer = Timer(timeout, kill, [process])
-    timer.daemon = True
-    timer.start()
-
-    while process.poll() is None:
-        try:
-            if os.name == 'nt':  # pragma: no cover
-                line = stdout.readline()
-                # windows gives readline() raw stdout as a b''
-                # need to decode it
-                line = line.decode("utf-8")
-                if line:  # ignore empty strings and None
-                    callback(line)
-            else:
-                while True:
-                    line = stdout.readline()
-                    if not line:
-                        break
-                    callback(line)
-        except OSError:
-            # This seems to happen on some platforms, including TravisCI.
-            # It seems like it's ok to just let this pass here, you just
-            # won't get as nice feedback.
-            pass
-        if not timer.is_alive():
-            raise TimeoutError("subprocess running command '{}' timed out after {} seconds".format(cmd, timeout))
-        process.poll()
+    from mutmut.supervisor import get_supervisor
+    return get_supervisor().run(cmd, callback, timeout=timeout, cwd=cwd, env=env)
+
+
+def mutated_source_of(context: Context) -> str:
+    """Like :func:`mutate`, which can't be called twice on the same context,
+    for runners that may test the mutant more than once"""
+    if context.mutated_source is None:
+        mutate(context)
+    return context.mutated_source
+
+
+def in_memory_tests_pass(config: Config, context: Context, timeout: float) -> bool:
+    """Test the mutant in a pytest session that already imported the
+    project, see :mod:`mutmut.fork_server` and :mod:`mutmut.worker_pool`"""
+    mutated_source = None
+    if context.schemata_key is None:
+        mutated_source = mutated_source_of(context)
+
+    def on_failure(test):
+        context.killed_by = test
+
+    kwargs = dict(
+        mutated_source=mutated_source,
+        mutant_under_test=context.schemata_key,
+        timeout=timeout,
+        tests=context.selected_tests,
+        on_failure=on_failure,
+    )
 
-    # we have returned from the subprocess cancel the timer if it is running
-    timer.cancel()
+    if config.runner_mode == 'fork':
+        from mutmut.fork_server import get_fork_server
+        return get_fork_server(config).tests_pass(context.filename, **kwargs)
 
-    return process.returncode
+    from mutmut.worker_pool import get_worker_pool
+    with get_worker_pool(config).acquire() as worker:
+        return worker.tests_pass(context.filename, **kwargs)
 
 
-def hammett_tests_pass(config: Config, callback) -> bool:
+def hammett_tests_pass(config: Config, callback, context: Optional[Context] = None,
+                       timeout: Optional[float] = None) -> bool:
     # noinspection PyUnresolvedReferences
     from hammett import main_cli
+    from mutmut.import_hook import mutant_imported
     modules_before = set(sys.modules.keys())
 
     # set up timeout
@@ -553,13 +835,13 @@ def hammett_tests_pass(config: Config, callback) -> bool:
 
     timed_out = False
 
-    def timeout():
+    def interrupt():
         _thread.interrupt_main()
         nonlocal timed_out
         timed_out = True
 
     assert current_thread() is main_thread()
-    timer = Timer(config.baseline_time_elapsed * 10, timeout)
+    timer = Timer(timeout if timeout is not None else mutant_timeout(config), interrupt)
     timer.daemon = True
     timer.start()
 
@@ -571,11 +853,17 @@ def hammett_tests_pass(config: Config, callback) -> bool:
                 return len(s)
 
         redirect = StdOutRedirect()
+        stdout, stderr = sys.stdout, sys.stderr
         sys.stdout = redirect
         sys.stderr = redirect
-        returncode = main_cli(shlex.split(config.test_command[len(hammett_prefix):]))
-        sys.stdout = sys.__stdout__
-        sys.stderr = sys.__stderr__
+        try:
+            if context is not None:
+                with mutant_imported(context.filename, mutated_source_of(context)):
+                    returncode = main_cli(shlex.split(config.test_command[len(hammett_prefix):]))
+            else:
+                returncode = main_cli(shlex.split(config.test_command[len(hammett_prefix):]))
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
         timer.cancel()
     except KeyboardInterrupt:
         timer.cancel()
@@ -593,16 +881,38 @@ def hammett_tests_pass(config: Config, callback) -> bool:
     return returncode == 0
 
 
-CYCLE_PROCESS_AFTER = 100
-
-
 def run_mutation_tests(
         config: Config,
         progress: Progress,
         mutations_by_file: Dict[str, List[RelativeMutationID]],
-        max_workers: int
+        max_workers: int,
+        coordinator=None,
+        catalogs: Optional[Dict[str, Dict[RelativeMutationID, Edit]]] = None,
 ):
-    from mutmut.cache import update_mutant_status
+    """
+    :param coordinator: a :class:`mutmut.distributed.Coordinator` to hand the
+        mutants to remote workers, instead of testing them here
+    :param catalogs: the :func:`catalog_mutations` of the files, so the
+        mutants can be made without parsing the files again
+    """
+    from mutmut.cache import results_journal_filename
+    from mutmut.result_journal import ResultJournal
+    from mutmut.sandbox import cleanup_sandboxes, get_sandbox_pool
+
+    schemata = None
+    if config.schemata:
+        from mutmut.schemata import create_schemata
+        schemata = create_schemata(config, mutations_by_file, catalogs)
+        if schemata.files:
+            pool = get_sandbox_pool(config.paths_to_mutate, overrides=schemata.files, ignore=config.sandbox_ignore)
+            with pool.acquire() as sandbox:
+                if not tests_pass(config=config, callback=lambda line: None, sandbox=sandbox):
+                    cleanup_sandboxes()
+                    schemata.cleanup()
+                    raise RuntimeError(
+                        "Tests don't pass with the mutant schemata applied. "
+                        "Run again without --schemata and consider opening an issue."
+                    )
 
     multiprocessing.set_start_method('spawn', force=True)
     mp_ctx = multiprocessing.get_context()
@@ -619,6 +929,8 @@ def run_mutation_tests(
             'mutants_queue': mutants_queue,
             'mutations_by_file': mutations_by_file,
             'max_workers': max_workers,
+            'schemata_keys': schemata.keys if schemata is not None else None,
+            'catalogs': catalogs,
         }
     )
     queue_mutants_thread.start()
@@ -626,33 +938,11 @@ def run_mutation_tests(
     results_queue = mp_ctx.Queue(maxsize=100)
     add_to_active_queues(results_queue)
 
-    def create_worker():
-        t = Thread(
-            target=check_mutants,
-            name='check_mutants',
-            daemon=True,
-            kwargs={
-                'mutants_queue': mutants_queue,
-                'results_queue': results_queue,
-                'cycle_process_after': CYCLE_PROCESS_AFTER,
-                'max_workers': max_workers,
-            }
-        )
-        t.start()
-        return t
-
-    t = create_worker()
-
-    while True:
-        command, status, filename, mutation_id = results_queue.get()
-        if command == 'end':
-            t.join()
-            break
+    # the results are written to the cache in batches, see mutmut.result_journal
+    journal = ResultJournal(results_journal_filename())
 
-        elif command == 'cycle':
-            t = create_worker()
-
-        elif command == 'progress':
+    def handle_result(command, status, filename, mutation_id, killed_by=None):
+        if command == 'progress':
             if not config.swallow_output:
                 print(status, end='', flush=True)
             elif not config.no_progress:
@@ -662,8 +952,62 @@ def run_mutation_tests(
             assert command == 'status'
             progress.register(status)
 
-            update_mutant_status(file_to_mutate=filename, mutation_id=mutation_id, status=status,
-                                 tests_hash=config.hash_of_tests)
+            journal.record(filename=filename, mutation_id=mutation_id, status=status,
+                           tests_hash=hash_of_tests_of_mutant(config, filename, mutation_id),
+                           killed_by=killed_by)
+
+    checker = check_mutants
+    if coordinator is not None:
+        checker = coordinator.check_mutants
+    elif config.worker_processes:
+        from mutmut.process_pool import ProcessPool
+        checker = ProcessPool(mp_ctx, config, recycle_after=config.recycle_after).check_mutants
+
+    try:
+        if config.test_command.startswith(hammett_prefix) and checker is check_mutants:
+            # hammett runs the tests in-process, and needs the main thread to interrupt them on timeout
+            while True:
+                command, context = mutants_queue.get()
+                if command == 'end':
+                    break
+                status = run_mutation(context, lambda line: handle_result('progress', line, None, None))
+                handle_result('status', status, context.filename, context.mutation_id, context.killed_by)
+        else:
+            t = Thread(
+                target=checker,
+                name='check_mutants',
+                daemon=True,
+                kwargs={
+                    'mutants_queue': mutants_queue,
+                    'results_queue': results_queue,
+                    'max_workers': max_workers,
+                }
+            )
+            t.start()
+
+            while True:
+                command, status, filename, mutation_id, killed_by = results_queue.get()
+                if command == 'end':
+                    t.join()
+                    break
+                handle_result(command, status, filename, mutation_id, killed_by)
+    finally:
+        shutdown_runners(config)
+        if schemata is not None:
+            schemata.cleanup()
+        journal.close()
+
+
+def shutdown_runners(config: Config):
+    """Stop the pytest sessions and remove the sandboxes the mutants were tested with"""
+    from mutmut.sandbox import cleanup_sandboxes
+    if config.runner_mode == 'fork':
+        from mutmut.fork_server import shutdown_fork_server
+        shutdown_fork_server()
+    elif config.runner_mode == 'pool':
+        from mutmut.worker_pool import shutdown_worker_pool
+        shutdown_worker_pool()
+    cleanup_sandboxes()
 
 
 def read_coverage_data() -> Dict[str, Dict[int, List[str]]]:
@@ -703,7 +1047,23 @@ def add_mutations_by_file(
         filename: str,
         dict_synonyms: List[str],
         config: Optional[Config],
+        catalog: Optional[Dict[RelativeMutationID, Edit]] = None,
 ):
+    mutations_by_file[filename] = list_mutations_of_file(filename, dict_synonyms, config, catalog)
+    from mutmut.cache import register_mutants
+
+    register_mutants({filename: mutations_by_file[filename]})
+
+
+def list_mutations_of_file(
+        filename: str,
+        dict_synonyms: List[str],
+        config: Optional[Config],
+        catalog: Optional[Dict[RelativeMutationID, Edit]] = None,
+) -> List[RelativeMutationID]:
+    """
+    :param catalog: filled in with the edits of the mutations, if given
+    """
     with open(filename) as f:
         source = f.read()
     context = Context(
@@ -713,11 +1073,26 @@ def add_mutations_by_file(
         dict_synonyms=dict_synonyms,
     )
 
-    try:
-        mutations_by_file[filename] = list_mutations(context)
-        from mutmut.cache import register_mutants
+    from mutmut.catalog_cache import CatalogEntry
+    entry = CatalogEntry(source, filename, dict_synonyms)
+    # the mutations of a source only depend on the mutation types, unless
+    # coverage takes lines out or the pre_mutation_ast hook wants to see them
+    reuse = (config is None or config.covered_lines_by_filename is None) and catalogs_apply()
+    mutation_types = config.mutation_types_to_apply if config is not None else None
 
-        register_mutants(mutations_by_file)
+    try:
+        mutations = entry.mutation_ids(mutation_types) if reuse else None
+        if mutations is None:
+            mutations = list_mutations(context)
+            if reuse:
+                entry.set_mutation_ids(mutation_types, mutations)
+        if config is not None and config.shard is not None:
+            shard, shard_count = config.shard
+            mutations = [x for x in mutations if shard_of(filename, x, shard_count) == shard]
+        if catalog is not None and catalogs_apply():
+            catalog.update(entry.edits_of(mutations))
+        entry.save()
+        return mutations
     except Exception as e:
         raise RuntimeError(
             'Failed while creating mutations for {}, for line "{}"'.format(
@@ -726,6 +1101,50 @@ def add_mutations_by_file(
         ) from e
 
 
+_enumeration_settings = None
+
+
+def _init_enumeration_process(dict_synonyms, config):
+    global _enumeration_settings
+    _enumeration_settings = (dict_synonyms, config)
+
+
+def _list_mutations_in_process(filename):
+    catalog = {}
+    return list_mutations_of_file(filename, *_enumeration_settings, catalog), catalog
+
+
+def list_mutations_of_files(
+        filenames: List[str],
+        dict_synonyms: List[str],
+        config: Optional[Config],
+        max_workers: int = 1,
+) -> Iterator[Tuple[str, List[RelativeMutationID], Dict[RelativeMutationID, Edit]]]:
+    """Yield the filename, mutations and catalog of each file, in order
+
+    Parsing is CPU bound, so with ``max_workers`` > 1 the files are parsed in
+    that many processes. The mutations come back to the caller, which keeps
+    writing to the cache from one process.
+    """
+    if max_workers <= 1 or len(filenames) <= 1:
+        for filename in filenames:
+            catalog = {}
+            yield filename, list_mutations_of_file(filename, dict_synonyms, config, catalog), catalog
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(filenames)),
+        # not forked: this process may have the supervisor thread and sqlite connections already
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_enumeration_process,
+        initargs=(dict_synonyms, config),
+    ) as executor:
+        for filename, (mutations, catalog) in zip(filenames, executor.map(_list_mutations_in_process, filenames)):
+            yield filename, mutations, catalog
+
+
 def python_source_files(
         path: str, tests_dirs: List[str], paths_to_exclude: Optional[List[str]] = None
 ) -> Iterator[str]:
@@ -794,6 +1213,17 @@ def compute_exit_code(
 
 hammett_prefix = 'python -m hammett '
 
+
+def is_pytest_command(test_command: str) -> bool:
+    args = shlex.split(test_command, posix=True)
+    if args and os.path.basename(args[0]) in ('pytest', 'py.test'):
+        return True
+    return args[1:3] == ['-m', 'pytest']
+
+
+# runner modes that apply the mutant in memory instead of writing it to disk
+IN_MEMORY_RUNNER_MODES = ('fork', 'pool')
+
 # List of active multiprocessing queues
 _active_queues = []
 
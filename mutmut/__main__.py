@@ -23,9 +23,14 @@ from mutmut import (
 )
 
 from mutmut.cache import print_result_cache, print_result_ids_cache, hash_of_tests, filename_and_mutation_id_from_pk, \
-    update_line_numbers, print_result_cache_junitxml, get_unified_diff, create_html_report
+    update_line_numbers, print_result_cache_junitxml, get_unified_diff, create_html_report, cached_test_durations, \
+    shard_cache_filename, use_cache_file, merge_caches, hashes_of_test_files, \
+    explain_queries
 from mutmut.mutation_test_runner import MutationTestRunner
 
+# where "mutmut coordinator" leaves its settings for "mutmut run" in the click context
+COORDINATOR_SETTINGS = 'mutmut.coordinator'
+
 
 def do_apply(mutation_pk: str, dict_synonyms: List[str], backup: bool):
     """Apply a specified mutant to the source code
@@ -87,7 +92,23 @@ def version():
 @click.option('--enable-mutation-types', type=click.STRING, help='Only perform given types of mutations.')
 @click.option('--paths-to-exclude', type=click.STRING)
 @click.option('--runner')
+@click.option('--runner-mode', type=click.Choice(['subprocess', 'fork', 'pool']),
+              help='subprocess (default) starts the runner for every mutant. fork starts a pytest runner once and '
+                   'tests every mutant in a fork of it, with the mutant swapped into the imported module. pool keeps '
+                   'one pytest session per worker alive and swaps the mutants in and out of it.')
+@click.option('--recycle-after', type=int,
+              help='With --runner-mode=pool or --worker-processes, replace a pytest session or worker process after '
+                   'it tested this many mutants (default 100)')
+@click.option('--max-worker-rss', type=int,
+              help='With --runner-mode=pool, replace a pytest session once it uses more than this many MB of memory')
+@click.option('--shard', metavar='I/N',
+              help='Only test the mutants in shard I of N (counting from 1), e.g. to split a run over N CI jobs. '
+                   'Each shard keeps its own cache file, "mutmut merge-cache" combines them.')
 @click.option('--use-coverage', is_flag=True, default=False)
+@click.option('--select-tests', is_flag=True, default=False,
+              help='With --use-coverage, only run the tests that covered the mutated line. Needs coverage data '
+                   'recorded with test contexts, e.g. pytest --cov --cov-context=test. Combine with --rerun-all to '
+                   'run the whole test suite for mutants that survive the selected tests.')
 @click.option('--use-patch-file', help='Only mutate lines added/changed in the given patch file')
 @click.option('--rerun-all', is_flag=True, default=False,
               help='If you modified the test_command in the pre_mutation hook, '
@@ -96,6 +117,14 @@ def version():
 @click.option('--tests-dir')
 @click.option('-m', '--test-time-multiplier', default=2.0, type=float)
 @click.option('-b', '--test-time-base', default=0.0, type=float)
+@click.option('--timeout-multiplier', type=float,
+              help='A mutant times out when its tests take this many times as long as they did in the baseline run '
+                   '(default 10). With pytest, that is counted per test, so only the tests the mutant runs count.')
+@click.option('--timeout-floor', type=float,
+              help='Give the tests of a mutant at least this many seconds before it times out (default 1)')
+@click.option('--time-tests', is_flag=True, default=False,
+              help='With pytest, time the tests in test files that changed since they were last timed, even if the '
+                   'baseline run is cached. The baseline run times all tests with this or --select-tests.')
 @click.option('-s', '--swallow-output', help='turn off output capture', is_flag=True)
 @click.option('--dict-synonyms')
 @click.option('--pre-mutation')
@@ -113,12 +142,34 @@ def version():
     pre_mutation=None,
     post_mutation=None,
     use_patch_file=None,
+    runner_mode='subprocess',
+    recycle_after=100,
+    max_worker_rss=None,
+    timeout_multiplier=10.0,
+    timeout_floor=1.0,
+    sandbox_ignore='',
 )
 @click.option('--max-workers', default=2, help='Set the max workers for ThreadPoolExecutor')
-def run(argument, paths_to_mutate, disable_mutation_types, enable_mutation_types, runner,
-        tests_dir, test_time_multiplier, test_time_base, swallow_output, use_coverage,
+@click.option('--sandbox', is_flag=True, default=False,
+              help='Test each mutant in a private copy of the project (one per worker) instead of '
+                   'mutating the working tree. Makes --max-workers > 1 safe.')
+@click.option('--sandbox-ignore',
+              help='Comma separated glob patterns of files and directories not to copy into the sandboxes, on top of '
+                   'version control, caches and node_modules. Virtualenvs are symlinked, not copied.')
+@click.option('--worker-processes', is_flag=True, default=False,
+              help='Test the mutants in --max-workers processes instead of threads, so that mutating the code and '
+                   'in-process runners like hammett use more than one core.')
+@click.option('--schemata', is_flag=True, default=False,
+              help='Compile all mutants of a function into the code once and select the one to test with the '
+                   'MUTANT_UNDER_TEST environment variable, instead of rewriting the file for every mutant. '
+                   'Implies --sandbox.')
+def run(argument, paths_to_mutate, disable_mutation_types, enable_mutation_types, runner, runner_mode, recycle_after,
+        max_worker_rss,
+        tests_dir, test_time_multiplier, test_time_base, timeout_multiplier, timeout_floor, time_tests,
+        swallow_output, use_coverage, select_tests,
         dict_synonyms, pre_mutation, post_mutation, use_patch_file, paths_to_exclude,
-        simple_output, no_progress, ci, rerun_all, max_workers):
+        simple_output, no_progress, ci, rerun_all, max_workers, sandbox, sandbox_ignore, worker_processes, schemata,
+        shard):
     """
     Runs mutmut. You probably want to start with just trying this. If you supply a mutation ID mutmut will check just this mutant.
 
@@ -169,10 +220,28 @@ def run(argument, paths_to_mutate, disable_mutation_types, enable_mutation_types
         mutation_types_to_apply=set(),
         no_progress=no_progress,
         ci=ci,
-        rerun_all=rerun_all
+        rerun_all=rerun_all,
+        sandbox=sandbox or schemata,
+        sandbox_ignore=[x.strip() for x in sandbox_ignore.split(',') if x.strip()],
+        schemata=schemata,
+        runner_mode=runner_mode,
+        recycle_after=int(recycle_after),
+        max_worker_rss=int(max_worker_rss) if max_worker_rss else None,
+        select_tests=select_tests,
+        timeout_multiplier=float(timeout_multiplier),
+        timeout_floor=float(timeout_floor),
+        time_tests=time_tests,
+        shard=MutationTestRunner.parse_shard(shard),
+        worker_processes=worker_processes,
     ))
 
-    mutation_test_runner.validate_arguments(use_coverage, use_patch_file, disable_mutation_types, enable_mutation_types)
+    coordinator_settings = click.get_current_context().meta.get(COORDINATOR_SETTINGS)
+    mutation_test_runner.validate_arguments(use_coverage, use_patch_file, disable_mutation_types, enable_mutation_types,
+                                            sandbox=sandbox or schemata, runner=runner, runner_mode=runner_mode,
+                                            select_tests=select_tests, time_tests=time_tests,
+                                            schemata=schemata, coordinator=coordinator_settings is not None,
+                                            worker_processes=worker_processes)
+    use_cache_file(shard_cache_filename(mutation_test_runner.config.shard))
 
     dict_synonyms = [x.strip() for x in dict_synonyms.split(',')]
 
@@ -194,29 +263,109 @@ def run(argument, paths_to_mutate, disable_mutation_types, enable_mutation_types
     mutation_test_runner.config.coverage_data = coverage_data
     mutation_test_runner.config.tests_dirs = tests_dirs
     mutation_test_runner.config.hash_of_tests = current_hash_of_tests
+    if coverage_data is not None:
+        mutation_test_runner.config.hashes_of_test_files = hashes_of_test_files(tests_dirs)
     mutation_test_runner.config.paths_to_mutate = paths_to_mutate
     mutation_test_runner.config.mutation_types_to_apply = mutation_types_to_apply
 
     mutation_test_runner.setup_environment()
     baseline_time_elapsed = mutation_test_runner.run_baseline_tests()
     mutation_test_runner.config.baseline_time_elapsed = baseline_time_elapsed
+    mutation_test_runner.run_test_timing()
+    mutation_test_runner.config.test_durations = cached_test_durations()
 
     mutations_by_file = mutation_test_runner.generate_mutations(argument, dict_synonyms, paths_to_exclude,
-                                                                paths_to_mutate, tests_dirs)
+                                                                paths_to_mutate, tests_dirs, max_workers=max_workers)
+
+    coordinator = None
+    if coordinator_settings is not None:
+        from mutmut.distributed import Coordinator
+        coordinator = Coordinator(*coordinator_settings)
+        print()
+        print('Waiting for workers on {}:{}'.format(*coordinator.address), flush=True)
 
     print()
     print('2. Checking mutants')
     progress = Progress(total=mutation_test_runner.config.total,
                         output_legend=mutation_test_runner.get_output_legend(simple_output), no_progress=no_progress)
 
-    sys.exit(mutation_test_runner.run_mutation_tests(progress, mutations_by_file, max_workers=max_workers))
+    sys.exit(mutation_test_runner.run_mutation_tests(progress, mutations_by_file, max_workers=max_workers,
+                                                     coordinator=coordinator))
+
+
+@climain.command(context_settings=dict(help_option_names=['-h', '--help'], ignore_unknown_options=True,
+                                       allow_extra_args=True))
+@click.option('--bind', default='localhost:7770', show_default=True,
+              help='HOST:PORT to listen on for workers, port 0 picks a free one')
+@click.option('--authkey', envvar='MUTMUT_AUTHKEY', required=True,
+              help='Secret the workers have to know to connect, defaults to $MUTMUT_AUTHKEY')
+@click.pass_context
+def coordinator(ctx, bind, authkey):
+    """
+    Run mutmut like "mutmut run" does, with the same arguments and options,
+    but let workers started with "mutmut worker" test the mutants.
+
+    The coordinator keeps the cache, the workers test the mutants in their own
+    checkout of the project, which should be at the same revision.
+    """
+    from mutmut.distributed import parse_address
+    try:
+        address = parse_address(bind)
+    except ValueError as e:
+        raise click.BadOptionUsage('--bind', str(e))
+    ctx.meta[COORDINATOR_SETTINGS] = (address, authkey.encode())
+    with run.make_context(ctx.info_name, list(ctx.args), parent=ctx.parent) as run_ctx:
+        run.invoke(run_ctx)
+
+
+@climain.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('--connect', required=True, help='HOST:PORT of the "mutmut coordinator"')
+@click.option('--authkey', envvar='MUTMUT_AUTHKEY', required=True,
+              help='Secret the coordinator was started with, defaults to $MUTMUT_AUTHKEY')
+@click.option('--max-workers', default=2,
+              help='Test this many mutants at the same time, more than 1 is only safe if the coordinator '
+                   'runs with --sandbox')
+def worker(connect, authkey, max_workers):
+    """
+    Test mutants for a "mutmut coordinator", in the project in the current
+    directory, until it has no more mutants to test.
+    """
+    from mutmut.distributed import parse_address, run_worker
+    try:
+        address = parse_address(connect)
+    except ValueError as e:
+        raise click.BadOptionUsage('--connect', str(e))
+    MutationTestRunner.setup_environment()
+    run_worker(address, authkey.encode(), max_workers)
+    sys.exit(0)
+
+
+@climain.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.argument('cache-files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def merge_cache(cache_files):
+    """
+    Merge other cache files, e.g. of "mutmut run --shard" jobs, into the cache.
+
+    If both have a result for a mutant, the one tested last wins.
+    """
+    try:
+        merged = merge_caches(cache_files)
+    except ValueError as e:
+        raise click.BadArgumentUsage(str(e))
+    print('Merged {} mutants from {} cache files'.format(merged, len(cache_files)))
+    sys.exit(0)
 
 
 @climain.command(context_settings=dict(help_option_names=['-h', '--help']))
-def results():
+@click.option('--explain-queries', 'explain', is_flag=True, default=False,
+              help='Print the query plans of the main queries on the cache instead, to debug a slow cache.')
+def results(explain):
     """
     Print the results.
     """
+    if explain:
+        print(explain_queries())
+        sys.exit(0)
     print_result_cache()
     sys.exit(0)
 
@@ -2,29 +2,44 @@
 
 import hashlib
 import os
+import sqlite3
+import threading
 from collections import defaultdict
+from contextlib import contextmanager
 from difflib import SequenceMatcher, unified_diff
 from functools import wraps
 from io import open
 from itertools import groupby, zip_longest
 from os.path import join, dirname
+from time import time
 from typing import Tuple
 
 
 from junit_xml import TestSuite, TestCase, to_xml_report_string
 from pony.orm import Database, Required, db_session, Set, Optional, select, \
-    PrimaryKey, RowNotFound, ERDiagramError, OperationalError
+    PrimaryKey, OperationalError, composite_index
 
 from mutmut import MUTANT_STATUSES, BAD_TIMEOUT, OK_SUSPICIOUS, BAD_SURVIVED, SKIPPED, UNTESTED, \
     OK_KILLED, RelativeMutationID, Context, mutate
+from mutmut.cache_migrations import migrate_cache
+from mutmut.catalog_cache import catalog_of_source
 
 db = Database()
 
-current_db_version = 4
+current_db_version = 7
 
 
 NO_TESTS_FOUND = 'NO TESTS FOUND'
 
+DEFAULT_CACHE_FILENAME = '.mutmut-cache'
+
+cache_filename = DEFAULT_CACHE_FILENAME
+
+# the file pony is bound to, which the connections of _connection() open too
+_db_filename = None
+
+_local = threading.local()
+
 
 class MiscData(db.Entity):
     key = PrimaryKey(str, auto=True)
@@ -32,7 +47,7 @@ class MiscData(db.Entity):
 
 
 class SourceFile(db.Entity):
-    filename = Required(str, autostrip=False)
+    filename = Required(str, autostrip=False, index=True)
     hash = Optional(str)
     lines = Set('Line')
 
@@ -42,53 +57,84 @@ class Line(db.Entity):
     line = Optional(str, autostrip=False)
     line_number = Required(int)
     mutants = Set('Mutant')
+    composite_index(sourcefile, line, line_number)
 
 
 class Mutant(db.Entity):
     line = Required(Line)
     index = Required(int)
     tested_against_hash = Optional(str, autostrip=False)
-    status = Required(str, autostrip=False)  # really an enum of mutant_statuses
+    status = Required(str, autostrip=False, index=True)  # really an enum of mutant_statuses
+    killed_by = Optional(str, autostrip=False)  # pytest node id of the test that failed
+    tested_at = Optional(float)  # time.time() of the result, to tell the newer one when merging caches
+    composite_index(line, index)
+
+
+class Timing(db.Entity):
+    """How long a test took in the baseline run. A test file has a row of its
+    own, with the time all its tests took, so we know it was timed."""
+    test_id = Required(str, autostrip=False)  # pytest node id
+    test_file = Required(str, autostrip=False)
+    test_file_hash = Required(str)
+    duration = Required(float)
+    PrimaryKey(test_id, test_file_hash)
 
 
 def init_db(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
+        global _db_filename
         if db.provider is None:
-            cache_filename = os.path.join(os.getcwd(), '.mutmut-cache')
-            db.bind(provider='sqlite', filename=cache_filename, create_db=True)
+            db_filename = os.path.join(os.getcwd(), cache_filename)
+            _db_filename = db_filename
+            # the cache of an older mutmut is upgraded before pony looks at its tables
+            out_of_date = os.path.exists(db_filename) and not migrate_cache(db_filename, current_db_version)
+            db.bind(provider='sqlite', filename=db_filename, create_db=True)
 
             try:
                 db.generate_mapping(create_tables=True)
             except OperationalError:
                 pass
 
-            if os.path.exists(cache_filename):
-                # If the existing cache file is out of data, delete it and start over
-                with db_session:
-                    try:
-                        v = MiscData.get(key='version')
-                        if v is None:
-                            existing_db_version = 1
-                        else:
-                            existing_db_version = int(v.value)
-                    except (RowNotFound, ERDiagramError, OperationalError):
-                        existing_db_version = 1
-
-                if existing_db_version != current_db_version:
-                    print('mutmut cache is out of date, clearing it...')
-                    db.drop_all_tables(with_all_data=True)
-                    db.schema = None  # Pony otherwise thinks we've already created the tables
-                    db.generate_mapping(create_tables=True)
+            if out_of_date:
+                # If the existing cache file can't be upgraded, delete it and start over
+                print('mutmut cache is out of date, clearing it...')
+                db.drop_all_tables(with_all_data=True)
+                db.schema = None  # Pony otherwise thinks we've already created the tables
+                db.generate_mapping(create_tables=True)
 
             with db_session:
                 v = get_or_create(MiscData, key='version')
                 v.value = str(current_db_version)
 
+            # the results of a run that was killed before it wrote them
+            from mutmut.result_journal import replay_journal
+            replayed = replay_journal(results_journal_filename())
+            if replayed:
+                print('recovered {} results of an interrupted run'.format(replayed))
+
         return f(*args, **kwargs)
     return wrapper
 
 
+def shard_cache_filename(shard):
+    """The cache file of shard ``(i, n)``, or the usual one if ``shard`` is :obj:`None`"""
+    if shard is None:
+        return DEFAULT_CACHE_FILENAME
+    return '{}-shard-{}-of-{}'.format(DEFAULT_CACHE_FILENAME, *shard)
+
+
+def results_journal_filename():
+    """The journal of the results that aren't in the cache yet, see :mod:`mutmut.result_journal`"""
+    return os.path.join(os.getcwd(), cache_filename) + '-results'
+
+
+def use_cache_file(filename):
+    """Keep the cache in ``filename``, from the next time the database is bound"""
+    global cache_filename
+    cache_filename = filename
+
+
 def hash_of(filename):
     with open(filename, 'rb') as f:
         m = hashlib.sha256()
@@ -96,9 +142,8 @@ def hash_of(filename):
         return m.hexdigest()
 
 
-def hash_of_tests(tests_dirs):
-    m = hashlib.sha256()
-    found_something = False
+def hashed_test_files(tests_dirs):
+    """The files that go into :func:`hash_of_tests`, test modules and their helpers"""
     for tests_dir in tests_dirs:
         for root, dirs, files in os.walk(tests_dir):
             for filename in files:
@@ -106,14 +151,26 @@ def hash_of_tests(tests_dirs):
                     continue
                 if not filename.startswith('test') and not filename.endswith('_tests.py') and 'test' not in root:
                     continue
-                with open(os.path.join(root, filename), 'rb') as f:
-                    m.update(f.read())
-                    found_something = True
+                yield os.path.join(root, filename)
+
+
+def hash_of_tests(tests_dirs):
+    m = hashlib.sha256()
+    found_something = False
+    for test_file in hashed_test_files(tests_dirs):
+        with open(test_file, 'rb') as f:
+            m.update(f.read())
+            found_something = True
     if not found_something:
         return NO_TESTS_FOUND
     return m.hexdigest()
 
 
+def hashes_of_test_files(tests_dirs):
+    """The hash of each test file, by its normalized path"""
+    return {os.path.normpath(x): hash_of(x) for x in hashed_test_files(tests_dirs)}
+
+
 def get_apply_line(mutant):
     apply_line = 'mutmut apply {}'.format(mutant.id)
     return apply_line
@@ -173,10 +230,12 @@ def print_result_cache(show_diffs=False, dict_synonyms=None, only_this_file=None
                 if show_diffs:
                     with open(filename) as f:
                         source = f.read()
+                    catalog = catalog_of_source(source, filename, dict_synonyms)
 
                     for x in mutants:
                         print('# mutant {}'.format(x.id))
-                        print(get_unified_diff(x.id, dict_synonyms, update_cache=False, source=source))
+                        print(get_unified_diff(x.id, dict_synonyms, update_cache=False, source=source,
+                                               catalog=catalog))
                 else:
                     print(ranges([x.id for x in mutants]))
 
@@ -194,16 +253,21 @@ def print_result_ids_cache(desired_status):
     print(" ".join(str(mutant.id) for mutant in mutant_query))
 
 
-def get_unified_diff(argument, dict_synonyms, update_cache=True, source=None):
+def get_unified_diff(argument, dict_synonyms, update_cache=True, source=None, catalog=None):
+    """
+    :param catalog: the :func:`mutmut.catalog_cache.catalog_of_source` of
+        ``source``, to show many mutants of a file without looking it up
+        for each of them
+    """
     filename, mutation_id = filename_and_mutation_id_from_pk(argument)
     if source is None:
         with open(filename) as f:
             source = f.read()
 
-    return _get_unified_diff(source, filename, mutation_id, dict_synonyms, update_cache)
+    return _get_unified_diff(source, filename, mutation_id, dict_synonyms, update_cache, catalog)
 
 
-def _get_unified_diff(source, filename, mutation_id, dict_synonyms, update_cache):
+def _get_unified_diff(source, filename, mutation_id, dict_synonyms, update_cache, catalog=None):
 
     if update_cache:
         update_line_numbers(filename)
@@ -211,12 +275,15 @@ def _get_unified_diff(source, filename, mutation_id, dict_synonyms, update_cache
     if source is None:
         with open(filename) as f:
             source = f.read()
+    if catalog is None:
+        catalog = catalog_of_source(source, filename, dict_synonyms)
     context = Context(
         source=source,
         filename=filename,
         mutation_id=mutation_id,
         dict_synonyms=dict_synonyms,
     )
+    context.edit = catalog.get(mutation_id)
     mutated_source, number_of_mutations_performed = mutate(context)
     if not number_of_mutations_performed:
         return ""
@@ -237,20 +304,23 @@ def create_junitxml_report(dict_synonyms, suspicious_policy, untested_policy):
     test_cases = []
     mutant_list = list(select(x for x in Mutant))
     for filename, mutants in groupby(mutant_list, key=lambda x: x.line.sourcefile.filename):
+        with open(filename) as f:
+            source = f.read()
+        catalog = catalog_of_source(source, filename, dict_synonyms)
         for mutant in mutants:
             tc = TestCase("Mutant #{}".format(mutant.id), file=filename, line=mutant.line.line_number + 1, stdout=mutant.line.line)
             if mutant.status == BAD_SURVIVED:
-                tc.add_failure_info(message=mutant.status, output=get_unified_diff(mutant.id, dict_synonyms))
+                tc.add_failure_info(message=mutant.status, output=get_unified_diff(mutant.id, dict_synonyms, source=source, catalog=catalog))
             if mutant.status == BAD_TIMEOUT:
-                tc.add_error_info(message=mutant.status, error_type="timeout", output=get_unified_diff(mutant.id, dict_synonyms))
+                tc.add_error_info(message=mutant.status, error_type="timeout", output=get_unified_diff(mutant.id, dict_synonyms, source=source, catalog=catalog))
             if mutant.status == OK_SUSPICIOUS:
                 if suspicious_policy != 'ignore':
                     func = getattr(tc, 'add_{}_info'.format(suspicious_policy))
-                    func(message=mutant.status, output=get_unified_diff(mutant.id, dict_synonyms))
+                    func(message=mutant.status, output=get_unified_diff(mutant.id, dict_synonyms, source=source, catalog=catalog))
             if mutant.status == UNTESTED:
                 if untested_policy != 'ignore':
                     func = getattr(tc, 'add_{}_info'.format(untested_policy))
-                    func(message=mutant.status, output=get_unified_diff(mutant.id, dict_synonyms))
+                    func(message=mutant.status, output=get_unified_diff(mutant.id, dict_synonyms, source=source, catalog=catalog))
 
             test_cases.append(tc)
 
@@ -279,6 +349,7 @@ def create_html_report(dict_synonyms, directory):
 
             with open(filename) as f:
                 source = f.read()
+            catalog = catalog_of_source(source, filename, dict_synonyms)
 
             os.makedirs(dirname(report_filename), exist_ok=True)
             with open(join(report_filename + '.html'), 'w') as f:
@@ -306,7 +377,7 @@ def create_html_report(dict_synonyms, directory):
                 def print_diffs(status):
                     mutants = mutants_by_status[status]
                     for mutant in sorted(mutants, key=lambda m: m.id):
-                        diff = _get_unified_diff(source, filename, RelativeMutationID(mutant.line.line, mutant.index, mutant.line.line_number), dict_synonyms, update_cache=False)
+                        diff = _get_unified_diff(source, filename, RelativeMutationID(mutant.line.line, mutant.index, mutant.line.line_number), dict_synonyms, update_cache=False, catalog=catalog)
                         f.write('<h3>Mutant %s</h3>' % mutant.id)
                         f.write('<pre>%s</pre>' % diff)
 
@@ -359,136 +430,332 @@ def sequence_ops(a, b):
             yield (tag,) + x
 
 
-@init_db
-@db_session
-def update_line_numbers(filename):
-    hash = hash_of(filename)
-    sourcefile = get_or_create(SourceFile, filename=filename)
-    if hash == sourcefile.hash:
-        return
-    cached_line_objects = list(sourcefile.lines.order_by(Line.line_number))
+@contextmanager
+def _transaction():
+    """A write transaction on this thread's :func:`_connection`"""
+    connection = _connection()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield connection
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+def _connection():
+    """This thread's plain sqlite3 connection to the cache
+
+    The functions that run for every mutant use it instead of pony: an ORM
+    session and a few ``get()`` queries per mutant cost more than testing a
+    fast mutant on a big cache. sqlite3 keeps the statements prepared, and in
+    WAL mode the reads of the worker threads don't wait for the writes.
+    """
+    key = (os.getpid(), _db_filename)
+    connection = getattr(_local, 'connection', None)
+    if connection is not None and _local.key == key:
+        return connection
+    if connection is not None:
+        connection.close()
+    connection = sqlite3.connect(_db_filename, timeout=60, isolation_level=None, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode = WAL')
+    connection.execute('PRAGMA synchronous = NORMAL')
+    connection.execute('PRAGMA foreign_keys = ON')
+    _local.connection, _local.key = connection, key
+    return connection
+
+
+_SOURCEFILE_QUERY = 'SELECT id, hash FROM SourceFile WHERE filename = ?'
+
+_LINES_OF_FILE_QUERY = 'SELECT id, line, line_number FROM Line WHERE sourcefile = ?'
+
+_MUTANTS_OF_FILE_QUERY = '''
+    SELECT l.line, l.line_number, m."index", m.id, m.status, m.tested_against_hash, m.killed_by
+    FROM SourceFile s
+    JOIN Line l ON l.sourcefile = s.id
+    JOIN Mutant m ON m.line = l.id
+    WHERE s.filename = ?
+'''
+
+_MUTANT_QUERY = '''
+    SELECT id, status, tested_against_hash, killed_by FROM Mutant
+    WHERE "index" = ? AND line = (
+        SELECT l.id FROM SourceFile s JOIN Line l ON l.sourcefile = s.id
+        WHERE s.filename = ? AND l.line = ? AND l.line_number = ?
+    )
+'''
 
-    cached_lines = [x.line for x in cached_line_objects]
+_UPDATE_MUTANT_STATUS = '''
+    UPDATE Mutant SET status = ?, tested_against_hash = ?, killed_by = ?, tested_at = ?
+    WHERE "index" = ? AND line = (
+        SELECT l.id FROM SourceFile s JOIN Line l ON l.sourcefile = s.id
+        WHERE s.filename = ? AND l.line = ? AND l.line_number = ?
+    )
+'''
 
-    with open(filename) as f:
-        existing_lines = [x.strip('\n') for x in f.readlines()]
+_INSERT_MUTANT = 'INSERT INTO Mutant (line, "index", tested_against_hash, status, killed_by) VALUES (?, ?, \'\', ?, \'\')'
 
-    if not cached_lines:
-        for i, line in enumerate(existing_lines):
-            Line(sourcefile=sourcefile, line=line, line_number=i)
-        return
+# the queries explain_queries() shows the plans of, the last is what the reports select with pony
+_MAIN_QUERIES = [
+    ('source file', _SOURCEFILE_QUERY),
+    ('lines of a file', _LINES_OF_FILE_QUERY),
+    ('mutants of a file', _MUTANTS_OF_FILE_QUERY),
+    ('mutant', _MUTANT_QUERY),
+    ('update the status of a mutant', _UPDATE_MUTANT_STATUS),
+    ('mutants by status', 'SELECT id FROM Mutant WHERE status = ?'),
+]
 
-    for command, a, a_index, b, b_index in sequence_ops(cached_lines, existing_lines):
-        if command == 'equal':
-            if a_index != b_index:
-                cached_obj = cached_line_objects[a_index]
-                assert cached_obj.line == existing_lines[b_index]
-                cached_obj.line_number = b_index
 
-        elif command == 'delete':
-            cached_line_objects[a_index].delete()
+def _sourcefile(connection, filename, create=False):
+    """The id and hash of the SourceFile row of ``filename``"""
+    row = connection.execute(_SOURCEFILE_QUERY, (filename,)).fetchone()
+    if row is None and create:
+        cursor = connection.execute('INSERT INTO SourceFile (filename, hash) VALUES (?, ?)', (filename, ''))
+        row = (cursor.lastrowid, '')
+    return row
 
-        elif command == 'insert':
-            if b is not None:
-                Line(sourcefile=sourcefile, line=b, line_number=b_index)
 
-        elif command == 'replace':
-            if a_index is not None:
-                cached_line_objects[a_index].delete()
-            if b is not None:
-                Line(sourcefile=sourcefile, line=b, line_number=b_index)
+def _line_ids(connection, sourcefile_id):
+    """The ids of the lines of a file, by line and line number"""
+    return {
+        (line, line_number): id
+        for id, line, line_number in connection.execute(_LINES_OF_FILE_QUERY, (sourcefile_id,))
+    }
+
+
+def _mutants(connection, filename):
+    """The mutant rows of a file as (id, status, tested_against_hash, killed_by), by line, line number and index"""
+    rows = connection.execute(_MUTANTS_OF_FILE_QUERY, (filename,))
+    return {(line, line_number, index): rest for line, line_number, index, *rest in rows}
+
+
+def _mutant(connection, filename, mutation_id):
+    return connection.execute(_MUTANT_QUERY, (mutation_id.index, filename, mutation_id.line, mutation_id.line_number)).fetchone()
 
-        else:
-            raise ValueError('Unknown opcode from SequenceMatcher: {}'.format(command))
 
-    sourcefile.hash = hash
+def _status_of(status, tested_against_hash, hash_of_tests):
+    if status == OK_KILLED:
+        # We assume that if a mutant was killed, a change to the test
+        # suite will mean it's still killed
+        return OK_KILLED
+
+    if tested_against_hash != hash_of_tests or \
+            tested_against_hash == NO_TESTS_FOUND or \
+            hash_of_tests == NO_TESTS_FOUND:
+        return UNTESTED
+
+    return status
+
+
+@init_db
+def update_line_numbers(filename):
+    """Move the cached lines of the file to where they are now
+
+    :return: the (zero based) numbers of the lines that changed since the
+        file was cached, counting the line after removed lines too
+    """
+    hash = hash_of(filename)
+    with open(filename) as f:
+        existing_lines = [x.strip('\n') for x in f.readlines()]
+
+    with _transaction() as connection:
+        sourcefile_id, cached_hash = _sourcefile(connection, filename, create=True)
+        if hash == cached_hash:
+            return []
+
+        cached_line_objects = connection.execute(
+            'SELECT id, line FROM Line WHERE sourcefile = ? ORDER BY line_number', (sourcefile_id,)).fetchall()
+        cached_lines = [x[1] for x in cached_line_objects]
+
+        if not cached_lines:
+            connection.executemany(
+                'INSERT INTO Line (sourcefile, line, line_number) VALUES (?, ?, ?)',
+                [(sourcefile_id, line, i) for i, line in enumerate(existing_lines)])
+            return list(range(len(existing_lines)))
+
+        changed_lines = set()
+        for tag, _, _, j1, j2 in SequenceMatcher(a=cached_lines, b=existing_lines).get_opcodes():
+            if tag != 'equal':
+                # code that was removed changes what the line after it sees
+                changed_lines.update(x for x in range(j1, max(j2, j1 + 1)) if x < len(existing_lines))
+
+        moved, deleted, inserted = [], [], []
+        for command, a, a_index, b, b_index in sequence_ops(cached_lines, existing_lines):
+            if command == 'equal':
+                if a_index != b_index:
+                    assert cached_lines[a_index] == existing_lines[b_index]
+                    moved.append((b_index, cached_line_objects[a_index][0]))
+
+            elif command == 'delete':
+                deleted.append((cached_line_objects[a_index][0],))
+
+            elif command == 'insert':
+                if b is not None:
+                    inserted.append((sourcefile_id, b, b_index))
+
+            elif command == 'replace':
+                if a_index is not None:
+                    deleted.append((cached_line_objects[a_index][0],))
+                if b is not None:
+                    inserted.append((sourcefile_id, b, b_index))
+
+            else:
+                raise ValueError('Unknown opcode from SequenceMatcher: {}'.format(command))
+
+        connection.executemany('DELETE FROM Mutant WHERE line = ?', deleted)
+        connection.executemany('DELETE FROM Line WHERE id = ?', deleted)
+        connection.executemany('UPDATE Line SET line_number = ? WHERE id = ?', moved)
+        connection.executemany('INSERT INTO Line (sourcefile, line, line_number) VALUES (?, ?, ?)', inserted)
+        connection.execute('UPDATE SourceFile SET hash = ? WHERE id = ?', (hash, sourcefile_id))
+    return sorted(changed_lines)
 
 
 @init_db
-@db_session
 def register_mutants(mutations_by_file):
     for filename, mutation_ids in mutations_by_file.items():
         hash = hash_of(filename)
-        sourcefile = get_or_create(SourceFile, filename=filename)
-        if hash == sourcefile.hash:
-            continue
-
-        for mutation_id in mutation_ids:
-            line = Line.get(sourcefile=sourcefile, line=mutation_id.line, line_number=mutation_id.line_number)
-            if line is None:
-                raise ValueError("Obtained null line for mutation_id: {}".format(mutation_id))
-            get_or_create(Mutant, line=line, index=mutation_id.index, defaults=dict(status=UNTESTED))
-
-        sourcefile.hash = hash
+        with _transaction() as connection:
+            sourcefile_id, cached_hash = _sourcefile(connection, filename, create=True)
+            if hash == cached_hash:
+                continue
+
+            line_ids = _line_ids(connection, sourcefile_id)
+            existing = _mutants(connection, filename)
+            new_mutants = []
+            for mutation_id in mutation_ids:
+                line_id = line_ids.get((mutation_id.line, mutation_id.line_number))
+                if line_id is None:
+                    raise ValueError("Obtained null line for mutation_id: {}".format(mutation_id))
+                key = (mutation_id.line, mutation_id.line_number, mutation_id.index)
+                if key not in existing:
+                    existing[key] = None
+                    new_mutants.append((line_id, mutation_id.index, UNTESTED))
+            connection.executemany(_INSERT_MUTANT, new_mutants)
+            connection.execute('UPDATE SourceFile SET hash = ? WHERE id = ?', (hash, sourcefile_id))
+
+
+def update_mutant_status(file_to_mutate, mutation_id, status, tests_hash, killed_by=None):
+    update_mutant_statuses([(file_to_mutate, mutation_id, status, tests_hash, killed_by)])
 
 
 @init_db
-@db_session
-def update_mutant_status(file_to_mutate, mutation_id, status, tests_hash):
-    sourcefile = SourceFile.get(filename=file_to_mutate)
-    line = Line.get(sourcefile=sourcefile, line=mutation_id.line, line_number=mutation_id.line_number)
-    mutant = Mutant.get(line=line, index=mutation_id.index)
-    mutant.status = status
-    mutant.tested_against_hash = tests_hash
+def update_mutant_statuses(results):
+    """Write the results of many mutants in one transaction
+
+    :param results: tuples of the arguments of :func:`update_mutant_status`
+    """
+    tested_at = time()
+    with _transaction() as connection:
+        connection.executemany(_UPDATE_MUTANT_STATUS, [
+            (status, tests_hash, killed_by or '', tested_at,
+             mutation_id.index, filename, mutation_id.line, mutation_id.line_number)
+            for filename, mutation_id, status, tests_hash, killed_by in results
+        ])
 
 
 @init_db
-@db_session
-def get_cached_mutation_statuses(filename, mutations, hash_of_tests):
-    sourcefile = SourceFile.get(filename=filename)
-    assert sourcefile
+def invalidate_mutants(filename, mutation_ids):
+    """Forget the cached results of the mutants, so they're tested again
+
+    :return: how many of them had a result
+    """
+    with _transaction() as connection:
+        mutants = _mutants(connection, filename)
+        invalidated = []
+        for mutation_id in mutation_ids:
+            mutant = mutants.get((mutation_id.line, mutation_id.line_number, mutation_id.index))
+            if mutant is not None and mutant[1] != UNTESTED:
+                invalidated.append((UNTESTED, mutant[0]))
+        # killed_by is kept, so the test that killed it runs first
+        connection.executemany("UPDATE Mutant SET status = ?, tested_against_hash = '' WHERE id = ?", invalidated)
+    return len(invalidated)
 
-    line_obj_by_line = {}
 
-    result = {}
+def get_cached_mutation_statuses(filename, mutations, hashes_of_tests):
+    """
+    :param hashes_of_tests: the hash of the tests each mutation's result
+        must have been tested against, see :func:`mutmut.hash_of_tests_of_mutant`
+    """
+    return {x: status for x, (status, _) in get_cached_mutants(filename, mutations, hashes_of_tests).items()}
 
-    for mutation_id in mutations:
-        if mutation_id.line not in line_obj_by_line:
-            line_obj_by_line[mutation_id.line] = Line.get(sourcefile=sourcefile, line=mutation_id.line, line_number=mutation_id.line_number)
-        line = line_obj_by_line[mutation_id.line]
-        assert line
-        mutant = Mutant.get(line=line, index=mutation_id.index)
-        if mutant is None:
-            mutant = get_or_create(Mutant, line=line, index=mutation_id.index, defaults=dict(status=UNTESTED))
-
-        result[mutation_id] = mutant.status
-        if mutant.status == OK_KILLED:
-            # We assume that if a mutant was killed, a change to the test
-            # suite will mean it's still killed
-            result[mutation_id] = mutant.status
-        else:
-            if mutant.tested_against_hash != hash_of_tests or \
-                    mutant.tested_against_hash == NO_TESTS_FOUND or \
-                    hash_of_tests == NO_TESTS_FOUND:
-                result[mutation_id] = UNTESTED
-            else:
-                result[mutation_id] = mutant.status
 
+@init_db
+def get_cached_mutants(filename, mutations, hashes_of_tests):
+    """Like :func:`get_cached_mutation_statuses`, with the test that killed
+    each mutant the last time, if we know it
+
+    :return: (status, killed_by) by mutation id
+    """
+    with _transaction() as connection:
+        sourcefile = _sourcefile(connection, filename)
+        assert sourcefile
+
+        mutants = _mutants(connection, filename)
+        line_ids = None
+        new_mutants = []
+        result = {}
+
+        for mutation_id in mutations:
+            key = (mutation_id.line, mutation_id.line_number, mutation_id.index)
+            mutant = mutants.get(key)
+            if mutant is None:
+                if line_ids is None:
+                    line_ids = _line_ids(connection, sourcefile[0])
+                line_id = line_ids.get((mutation_id.line, mutation_id.line_number))
+                assert line_id
+                new_mutants.append((line_id, mutation_id.index, UNTESTED))
+                mutants[key] = mutant = (None, UNTESTED, '', '')
+
+            _, status, tested_against_hash, killed_by = mutant
+            result[mutation_id] = (_status_of(status, tested_against_hash, hashes_of_tests[mutation_id]), killed_by or None)
+
+        connection.executemany(_INSERT_MUTANT, new_mutants)
     return result
 
 
 @init_db
-@db_session
 def cached_mutation_status(filename, mutation_id, hash_of_tests):
-    sourcefile = SourceFile.get(filename=filename)
-    assert sourcefile
-    line = Line.get(sourcefile=sourcefile, line=mutation_id.line, line_number=mutation_id.line_number)
-    assert line
-    mutant = Mutant.get(line=line, index=mutation_id.index)
+    connection = _connection()
+    mutant = _mutant(connection, filename, mutation_id)
     if mutant is None:
-        mutant = get_or_create(Mutant, line=line, index=mutation_id.index, defaults=dict(status=UNTESTED))
+        get_cached_mutation_statuses(filename, [mutation_id], {mutation_id: hash_of_tests})
+        return UNTESTED
 
-    if mutant.status == OK_KILLED:
-        # We assume that if a mutant was killed, a change to the test
-        # suite will mean it's still killed
-        return OK_KILLED
+    _, status, tested_against_hash, _ = mutant
+    return _status_of(status, tested_against_hash, hash_of_tests)
+
+
+@init_db
+def cached_killed_by(filename, mutation_id):
+    """The test that killed the mutant the last time it was tested, if we know it"""
+    mutant = _mutant(_connection(), filename, mutation_id)
+    return (mutant[3] or None) if mutant is not None else None
 
-    if mutant.tested_against_hash != hash_of_tests or \
-            mutant.tested_against_hash == NO_TESTS_FOUND or \
-            hash_of_tests == NO_TESTS_FOUND:
-        return UNTESTED
 
-    return mutant.status
+@init_db
+def get_mutant_pks(filename, mutations):
+    connection = _connection()
+    assert _sourcefile(connection, filename)
+    mutants = _mutants(connection, filename)
+    result = {}
+    for mutation_id in mutations:
+        mutant = mutants.get((mutation_id.line, mutation_id.line_number, mutation_id.index))
+        if mutant is not None:
+            result[mutation_id] = mutant[0]
+    return result
+
+
+@init_db
+def explain_queries():
+    """The ``EXPLAIN QUERY PLAN`` of the main queries on the cache, to see
+    they use the indexes instead of scanning the tables"""
+    connection = _connection()
+    result = []
+    for title, query in _MAIN_QUERIES:
+        result.append('{}:'.format(title))
+        for _, _, _, detail in connection.execute('EXPLAIN QUERY PLAN ' + query, [None] * query.count('?')):
+            result.append('    {}'.format(detail))
+    return '\n'.join(result)
 
 
 @init_db
@@ -521,8 +788,200 @@ def set_cached_test_time(baseline_time_elapsed, current_hash_of_tests):
     get_or_create(MiscData, key='hash_of_tests').value = current_hash_of_tests
 
 
+def is_test_module(filename):
+    """If pytest collects tests from ``filename`` by default"""
+    filename = os.path.basename(filename)
+    return filename.endswith('.py') and (filename.startswith('test_') or filename.endswith('_test.py'))
+
+
+def find_test_files(tests_dirs):
+    """The files pytest collects tests from by default"""
+    for tests_dir in tests_dirs:
+        for root, dirs, files in os.walk(tests_dir):
+            for filename in sorted(files):
+                if is_test_module(filename):
+                    yield os.path.normpath(os.path.join(root, filename))
+
+
+@init_db
+@db_session
+def set_cached_test_durations(test_durations, rootdir=None):
+    """Replace the timings of the test files in ``test_durations``, a dict
+    of pytest node id to seconds as written by :mod:`mutmut.pytestplugin`
+
+    :param rootdir: the rootdir of pytest the node ids are relative to,
+        default the current directory. The test files are kept relative to
+        the current directory, like :func:`find_test_files` finds them.
+    """
+    by_file = defaultdict(dict)
+    for test_id, duration in test_durations.items():
+        test_file = _test_file_path(os.path.join(rootdir or os.curdir, test_id.partition('::')[0]))
+        # the row of the file itself is looked up by its path
+        by_file[test_file][test_id if '::' in test_id else test_file] = duration
+
+    for test_file, durations in by_file.items():
+        if not os.path.isfile(test_file):
+            continue
+        test_file_hash = hash_of(test_file)
+        select(x for x in Timing if x.test_file == test_file).delete(bulk=True)
+        for test_id, duration in durations.items():
+            Timing(test_id=test_id, test_file=test_file, test_file_hash=test_file_hash, duration=duration)
+
+
+def _test_file_path(path):
+    return os.path.normpath(os.path.relpath(path))
+
+
+@init_db
+@db_session
+def cached_test_durations():
+    """Seconds each test took in the baseline run, by pytest node id, for the
+    test files that didn't change since
+
+    :return: :obj:`None` if we have no timings
+    """
+    hash_by_file = {}
+    result = {}
+    for timing in select(x for x in Timing):
+        if timing.test_file not in hash_by_file:
+            hash_by_file[timing.test_file] = hash_of(timing.test_file) if os.path.isfile(timing.test_file) else None
+        if '::' in timing.test_id and timing.test_file_hash == hash_by_file[timing.test_file]:
+            result[timing.test_id] = timing.duration
+    return result or None
+
+
+@init_db
+@db_session
+def untimed_test_files(tests_dirs):
+    """Test files that changed since their tests were timed, or never were"""
+    return [
+        test_file
+        for test_file in map(_test_file_path, find_test_files(tests_dirs))
+        if Timing.get(test_id=test_file, test_file_hash=hash_of(test_file)) is None
+    ]
+
+
 @init_db
 @db_session
 def cached_hash_of_tests():
     d = MiscData.get(key='hash_of_tests')
     return d.value if d else None
+
+
+# the statements that merge the attached cache "other" into this one, in order
+_MERGE_STATEMENTS = [
+    '''
+    INSERT INTO SourceFile (filename, hash)
+    SELECT o.filename, o.hash FROM other.SourceFile o
+    WHERE NOT EXISTS (SELECT 1 FROM SourceFile s WHERE s.filename = o.filename)
+    ''',
+    '''
+    INSERT INTO Line (sourcefile, line, line_number)
+    SELECT s.id, o.line, o.line_number
+    FROM other.Line o
+    JOIN other.SourceFile os ON os.id = o.sourcefile
+    JOIN SourceFile s ON s.filename = os.filename
+    WHERE NOT EXISTS (
+        SELECT 1 FROM Line l WHERE l.sourcefile = s.id AND l.line = o.line AND l.line_number = o.line_number
+    )
+    ''',
+    # our id of every line of the other cache, CROSS JOIN keeps sqlite from scanning all our lines for each
+    'CREATE TEMP TABLE line_ids (other_id INTEGER PRIMARY KEY, id INTEGER NOT NULL)',
+    '''
+    INSERT INTO temp.line_ids (other_id, id)
+    SELECT o.id, l.id
+    FROM other.SourceFile os
+    CROSS JOIN SourceFile s ON s.filename = os.filename
+    CROSS JOIN other.Line o ON o.sourcefile = os.id
+    CROSS JOIN Line l ON l.sourcefile = s.id AND l.line_number = o.line_number AND l.line = o.line
+    ''',
+    # the mutants of the other cache, with our line ids
+    '''
+    CREATE TEMP TABLE incoming AS
+    SELECT li.id AS line, o."index", o.tested_against_hash, o.status, o.killed_by, o.tested_at
+    FROM other.Mutant o
+    JOIN temp.line_ids li ON li.other_id = o.line
+    ''',
+    'CREATE INDEX temp.idx_incoming ON incoming (line, "index")',
+    # an incoming result wins if it ranks at least as high: tested at all first, then tested last.
+    # tested_against_hash can't rank them, with --use-coverage each mutant has a hash of its own
+    '''
+    UPDATE Mutant SET (tested_against_hash, status, killed_by, tested_at) = (
+        SELECT i.tested_against_hash, i.status, i.killed_by, i.tested_at FROM temp.incoming i
+        WHERE i.line = Mutant.line AND i."index" = Mutant."index"
+    )
+    WHERE EXISTS (
+        SELECT 1 FROM temp.incoming i
+        WHERE i.line = Mutant.line AND i."index" = Mutant."index"
+        AND (i.status IS NOT :untested, COALESCE(i.tested_at, 0))
+            >= (Mutant.status IS NOT :untested, COALESCE(Mutant.tested_at, 0))
+    )
+    ''',
+    '''
+    INSERT INTO Mutant (line, "index", tested_against_hash, status, killed_by, tested_at)
+    SELECT i.line, i."index", i.tested_against_hash, i.status, i.killed_by, i.tested_at FROM temp.incoming i
+    WHERE NOT EXISTS (SELECT 1 FROM Mutant m WHERE m.line = i.line AND m."index" = i."index")
+    ''',
+    'DROP TABLE temp.incoming',
+    'DROP TABLE temp.line_ids',
+    '''
+    INSERT OR REPLACE INTO Timing (test_id, test_file, test_file_hash, duration)
+    SELECT test_id, test_file, test_file_hash, duration FROM other.Timing
+    ''',
+    # keeps our version, baseline time and hash of tests if we have them
+    'INSERT OR IGNORE INTO MiscData (key, value) SELECT key, value FROM other.MiscData',
+]
+
+
+def _attach_cache(connection, filename):
+    """Attach the cache file ``filename`` as "other", if it's a cache of this version"""
+    expected_version = (str(current_db_version),)
+    try:
+        connection.execute('ATTACH DATABASE ? AS other', (filename,))
+    except sqlite3.DatabaseError:
+        version = None
+    else:
+        try:
+            version = connection.execute("SELECT value FROM other.MiscData WHERE key = 'version'").fetchone()
+        except sqlite3.DatabaseError:  # a database, but not a cache
+            version = None
+        if version != expected_version:
+            connection.execute('DETACH DATABASE other')
+    if version != expected_version:
+        raise ValueError('{} is not a mutmut cache of this version, it can\'t be merged'.format(filename))
+
+
+@init_db
+def merge_caches(filenames):
+    """Merge the cache files ``filenames``, e.g. of the ``--shard`` jobs of a
+    run, into this one
+
+    Rows are matched by file name, line, line number and mutant index, not by
+    primary key. When two caches have a result for the same mutant, one that
+    was tested at all wins, then the one tested last, then the one merged
+    last. This is done in SQL, with the other cache attached, as going
+    through the ORM is slow for big caches.
+
+    :return: the number of mutants merged
+    """
+    params = dict(untested=UNTESTED)
+    merged = 0
+    connection = sqlite3.connect(os.path.join(os.getcwd(), cache_filename), isolation_level=None)
+    try:
+        for filename in filenames:
+            _attach_cache(connection, filename)
+            try:
+                connection.execute('BEGIN')
+                try:
+                    for statement in _MERGE_STATEMENTS:
+                        connection.execute(statement, params)
+                    merged += connection.execute('SELECT COUNT(*) FROM other.Mutant').fetchone()[0]
+                    connection.execute('COMMIT')
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+            finally:
+                connection.execute('DETACH DATABASE other')
+    finally:
+        connection.close()
+    return merged
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Upgrading ``.mutmut-cache`` files of older versions of mutmut.
+
+Each step in :data:`MIGRATIONS` brings a cache from the version before up
+to the version it's stored under, in plain SQL on the tables pony made.
+:func:`migrate_cache` runs the steps a cache needs in one transaction,
+before pony maps the tables, so the results of the mutants survive an
+upgrade of mutmut. A cache that can't be upgraded is cleared instead.
+"""
+
+import sqlite3
+
+
+def _columns(connection, table):
+    return {row[1] for row in connection.execute('PRAGMA table_info("{}")'.format(table))}
+
+
+def _add_line_numbers(connection):
+    """Version 2 knows the line number of each line, to tell apart lines
+    with the same text
+
+    Version 1 stored the lines in the order it found them, so that's their
+    number until the next run moves them to where they are now.
+    """
+    connection.execute('CREATE TABLE IF NOT EXISTS "MiscData" ("key" TEXT NOT NULL PRIMARY KEY, "value" TEXT NOT NULL)')
+    if 'line_number' not in _columns(connection, 'Line'):
+        connection.execute('ALTER TABLE "Line" ADD COLUMN "line_number" INTEGER NOT NULL DEFAULT 0')
+        connection.execute('''
+            UPDATE "Line" SET "line_number" = (
+                SELECT COUNT(*) FROM "Line" l WHERE l."sourcefile" = "Line"."sourcefile" AND l."id" < "Line"."id"
+            )
+        ''')
+
+
+def _add_source_file_hashes(connection):
+    """Version 3 keeps the hash of each source file, to skip unchanged ones
+
+    An empty hash never matches, so the next run looks at every file once.
+    """
+    connection.execute('ALTER TABLE "SourceFile" ADD COLUMN "hash" TEXT NOT NULL DEFAULT \'\'')
+
+
+def _hash_tests_of_baseline(connection):
+    """Version 4 keeps the hash of the tests the baseline was timed with
+
+    There's nothing to change: without that hash the baseline is timed again.
+    """
+
+
+def _add_killed_by(connection):
+    """Version 5 keeps the test that killed each mutant, to run it first"""
+    connection.execute('ALTER TABLE "Mutant" ADD COLUMN "killed_by" TEXT NOT NULL DEFAULT \'\'')
+
+
+def _add_indexes(connection):
+    """Version 6 has the indexes of the lookups of lines and mutants, and of
+    the reports by status, the same pony creates for a new cache"""
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_sourcefile__filename" ON "SourceFile" ("filename")')
+    connection.execute(
+        'CREATE INDEX IF NOT EXISTS "idx_line__sourcefile_line_line_number" ON "Line" ("sourcefile", "line", "line_number")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_mutant__line_index" ON "Mutant" ("line", "index")')
+    connection.execute('CREATE INDEX IF NOT EXISTS "idx_mutant__status" ON "Mutant" ("status")')
+    # merge_caches made this one, the one by line covers what it was for
+    connection.execute('DROP INDEX IF EXISTS "idx_line__sourcefile_line_number"')
+
+
+def _add_tested_at(connection):
+    """Version 7 keeps when each mutant was tested, to tell the newer result
+    when merging caches
+
+    The results from before don't know, they lose to any that do.
+    """
+    if 'tested_at' not in _columns(connection, 'Mutant'):
+        connection.execute('ALTER TABLE "Mutant" ADD COLUMN "tested_at" REAL')
+
+
+# by the version they bring a cache of the version before up to
+MIGRATIONS = {
+    2: _add_line_numbers,
+    3: _add_source_file_hashes,
+    4: _hash_tests_of_baseline,
+    5: _add_killed_by,
+    6: _add_indexes,
+    7: _add_tested_at,
+}
+
+
+def version_of_cache(connection) -> int:
+    """Caches from before version 2 have no version"""
+    try:
+        row = connection.execute("SELECT value FROM MiscData WHERE key = 'version'").fetchone()
+    except sqlite3.DatabaseError:
+        return 1
+    return int(row[0]) if row is not None else 1
+
+
+def migrate_cache(filename: str, version: int) -> bool:
+    """Upgrade the cache file ``filename`` to ``version``, keeping the results
+
+    :return: :obj:`False` if it can't be upgraded, e.g. because it was made
+        by a newer mutmut
+    """
+    connection = sqlite3.connect(filename, isolation_level=None)
+    try:
+        tables = {x for x, in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'Mutant' not in tables:
+            # nothing to keep, pony creates the tables
+            return True
+        from_version = version_of_cache(connection)
+        if from_version == version:
+            return True
+        steps = range(from_version + 1, version + 1)
+        if not steps or not all(x in MIGRATIONS for x in steps):
+            return False
+
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for to_version in steps:
+                MIGRATIONS[to_version](connection)
+            connection.execute(
+                "INSERT OR REPLACE INTO MiscData (key, value) VALUES ('version', ?)", (str(version),))
+        except sqlite3.DatabaseError:
+            connection.execute('ROLLBACK')
+            return False
+        connection.execute('COMMIT')
+    except sqlite3.DatabaseError:
+        # not a cache at all
+        return False
+    finally:
+        connection.close()
+    return True
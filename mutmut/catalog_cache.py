@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Keeps the :func:`mutmut.catalog_mutations` of the files on disk.
+
+Listing the mutations of a file means parsing it with parso, which is most
+of the time ``mutmut show``, ``mutmut html`` and friends spend on a big
+project. The catalogs are stored by the SHA-256 of the source, the same
+hash :func:`mutmut.cache.hash_of` computes for the file, in a directory
+next to ``.mutmut-cache``, so running them again on unchanged files skips
+parso. With them are the mutation ids :func:`mutmut.list_mutations` found
+for each set of mutation types, so ``mutmut run`` doesn't parse unchanged
+files either. The least recently used catalogs are removed when the
+directory grows over :data:`max_size` bytes.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Set
+
+from mutmut import __version__, Context, Edit, RelativeMutationID, catalog_mutations, catalogs_apply
+
+CATALOG_CACHE_DIRNAME = '.mutmut-catalogs'
+
+# the catalogs are removed, least recently used first, when they take more than this
+max_size = 64 * 1024 * 1024
+
+
+def catalog_cache_directory() -> str:
+    return os.path.join(os.getcwd(), CATALOG_CACHE_DIRNAME)
+
+
+def catalog_of_source(
+        source: str,
+        filename: Optional[str],
+        dict_synonyms: Optional[List[str]],
+) -> Dict[RelativeMutationID, Edit]:
+    """The catalog of the mutations of ``source``, from the cache if it's there
+
+    The catalog is made without a config: it has the mutations of every
+    type on every line, so it has the edits of the mutants of any run.
+    It's empty if the ``pre_mutation_ast`` hook has to see each mutant, see
+    :func:`mutmut.catalogs_apply`.
+    """
+    if not catalogs_apply():
+        return {}
+    entry = CatalogEntry(source, filename, dict_synonyms)
+    catalog = entry.catalog()
+    entry.save()
+    return catalog
+
+
+class CatalogEntry:
+    """What the cache knows about one source: its catalog, and the mutation
+    ids :func:`mutmut.list_mutations` found for each set of mutation types"""
+
+    def __init__(self, source: str, filename: Optional[str], dict_synonyms: Optional[List[str]]):
+        self.source = source
+        self.filename = filename
+        self.dict_synonyms = list(dict_synonyms or [])
+        self.path = os.path.join(
+            catalog_cache_directory(), hashlib.sha256(source.encode('utf-8')).hexdigest() + '.json')
+        self.data = self._read()
+        self.changed = False
+        if self.data is None:
+            self.data = dict(version=__version__, dict_synonyms=self.dict_synonyms, mutations=None, mutation_ids={})
+            self.changed = True
+
+    def catalog(self) -> Dict[RelativeMutationID, Edit]:
+        if self.data['mutations'] is None:
+            catalog = catalog_mutations(Context(
+                source=self.source, filename=self.filename, dict_synonyms=self.dict_synonyms))
+            self.data['mutations'] = [
+                [x.line, x.index, x.line_number, edit.offset, edit.length, edit.replacement]
+                for x, edit in catalog.items()
+            ]
+            self.changed = True
+            return catalog
+        return {
+            self._mutation_id(line, index, line_number): Edit(offset=offset, length=length, replacement=replacement)
+            for line, index, line_number, offset, length, replacement in self.data['mutations']
+        }
+
+    def edits_of(self, mutation_ids: List[RelativeMutationID]) -> Dict[RelativeMutationID, Edit]:
+        """The part of the catalog for ``mutation_ids``"""
+        if self.data['mutations'] is None:
+            catalog = self.catalog()
+            return {x: catalog[x] for x in mutation_ids if x in catalog}
+        edits = {(line, index, line_number): x for line, index, line_number, *x in self.data['mutations']}
+        result = {}
+        for mutation_id in mutation_ids:
+            edit = edits.get((mutation_id.line, mutation_id.index, mutation_id.line_number))
+            if edit is not None:
+                result[mutation_id] = Edit(*edit)
+        return result
+
+    def mutation_ids(self, mutation_types: Optional[Set[str]]) -> Optional[List[RelativeMutationID]]:
+        """The mutation ids listed for ``mutation_types`` before, :obj:`None` for all types"""
+        mutation_ids = self.data['mutation_ids'].get(self._key(mutation_types))
+        if mutation_ids is None:
+            return None
+        return [self._mutation_id(*x) for x in mutation_ids]
+
+    def set_mutation_ids(self, mutation_types: Optional[Set[str]], mutation_ids: List[RelativeMutationID]):
+        self.data['mutation_ids'][self._key(mutation_types)] = [[x.line, x.index, x.line_number] for x in mutation_ids]
+        self.changed = True
+
+    def save(self):
+        if self.changed:
+            _write(self.path, self.data)
+            self.changed = False
+
+    def _mutation_id(self, line, index, line_number):
+        return RelativeMutationID(line=line, index=index, line_number=line_number, filename=self.filename)
+
+    @staticmethod
+    def _key(mutation_types):
+        if mutation_types is None:
+            return '*'
+        return ','.join(sorted(mutation_types))
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            if data['version'] != __version__ or data['dict_synonyms'] != self.dict_synonyms:
+                return None
+            if not isinstance(data['mutation_ids'], dict):
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        try:
+            # for the least recently used eviction
+            os.utime(self.path)
+        except OSError:
+            pass
+        return data
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        # other processes may be reading the catalog, so it's replaced in one go
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    except OSError:
+        # the cache is an optimization, not being able to write it is no reason to stop
+        return
+    evict_catalogs(directory)
+
+
+def evict_catalogs(directory: str, size: Optional[int] = None):
+    """Remove the least recently used catalogs until they take at most ``size`` bytes"""
+    if size is None:
+        size = max_size
+    entries = []
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(x[1] for x in entries)
+    for _, entry_size, path in sorted(entries):
+        if total <= size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            # another process got there first
+            pass
+        total -= entry_size
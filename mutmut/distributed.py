@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Testing mutants on other machines.
+
+``mutmut coordinator`` does what ``mutmut run`` does, and owns the cache,
+but instead of testing the mutants it hands them to ``mutmut worker``
+processes that connect to it over TCP. A worker tests them in its own
+checkout of the project and sends back the statuses, which the coordinator
+puts on the results queue just like local workers would.
+
+Connections are authenticated with a shared key, as the coordinator tells
+the workers which test command to run.
+"""
+
+import itertools
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from queue import Empty, Queue
+from time import sleep, time
+from typing import Tuple
+
+# how long a worker keeps trying to reach a coordinator that isn't listening (yet)
+CONNECT_TIMEOUT = 60
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """``HOST:PORT`` as a tuple, the host defaults to localhost"""
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise ValueError('Expected an address like HOST:PORT, got {}'.format(address))
+    return host or 'localhost', int(port)
+
+
+class Coordinator:
+    def __init__(self, address: Tuple[str, int], authkey: bytes):
+        self.listener = Listener(address, authkey=authkey)
+        self._todo = Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._all_queued = False
+        self._done = threading.Event()
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self.listener.address
+
+    def check_mutants(self, mutants_queue, results_queue, max_workers=None):
+        """Like :func:`mutmut.check_mutants`, but the workers that connect
+        test the mutants. ``max_workers`` is up to them."""
+        from mutmut import look_up_mutant
+
+        threading.Thread(target=self._accept, args=(results_queue,), name='coordinator_accept', daemon=True).start()
+        try:
+            while True:
+                command, context = mutants_queue.get()
+                if command == 'end':
+                    break
+                # queue_mutants has left out the mutants with a cached status already
+                look_up_mutant(context)
+                # the workers don't need it, the lines to mutate are in covered_lines_by_filename
+                context.config.coverage_data = None
+                with self._lock:
+                    self._pending += 1
+                self._todo.put(context)
+
+            with self._lock:
+                self._all_queued = True
+                if not self._pending:
+                    self._done.set()
+            self._done.wait()
+        finally:
+            self.listener.close()
+            results_queue.put(('end', None, None, None, None))
+
+    def _finished_one(self):
+        with self._lock:
+            self._pending -= 1
+            if self._all_queued and not self._pending:
+                self._done.set()
+
+    def _accept(self, results_queue):
+        while not self._done.is_set():
+            try:
+                connection = self.listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                # closed, or a client that failed to authenticate
+                if self._done.is_set():
+                    return
+                continue
+            threading.Thread(
+                target=self._serve, args=(connection, results_queue), name='coordinator_serve', daemon=True,
+            ).start()
+
+    def _serve(self, connection, results_queue):
+        in_flight = {}
+        request_ids = itertools.count()
+        try:
+            _, capacity = connection.recv()
+            while not self._done.is_set():
+                while len(in_flight) < capacity:
+                    try:
+                        context = self._todo.get_nowait()
+                    except Empty:
+                        break
+                    request_id = next(request_ids)
+                    in_flight[request_id] = context
+                    connection.send(('mutant', request_id, context))
+
+                if not connection.poll(0.1):
+                    continue
+                message = connection.recv()
+                if message[0] == 'progress':
+                    results_queue.put(('progress', message[1], None, None, None))
+                    continue
+
+                if message[0] == 'status':
+                    _, request_id, status, killed_by = message
+                    context = in_flight.pop(request_id)
+                    results_queue.put(('status', status, context.filename, context.mutation_id, killed_by))
+                else:
+                    assert message[0] == 'error'
+                    _, request_id, error = message
+                    context = in_flight.pop(request_id)
+                    print('Failed to test {} mutant {}:\n{}'.format(context.filename, context.mutation_id, error),
+                          file=sys.stderr)
+                self._finished_one()
+            connection.send(('quit',))
+        except (EOFError, OSError):
+            # the worker is gone, its mutants go to the others
+            for context in in_flight.values():
+                self._todo.put(context)
+        finally:
+            connection.close()
+
+
+def connect(address: Tuple[str, int], authkey: bytes, timeout: float = CONNECT_TIMEOUT):
+    deadline = time() + timeout
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except ConnectionRefusedError:
+            if time() > deadline:
+                raise
+            sleep(1)
+
+
+def run_worker(address: Tuple[str, int], authkey: bytes, max_workers: int):
+    """Test mutants for the coordinator at ``address`` until it has none left,
+    ``max_workers`` at a time"""
+    from mutmut import run_mutation_uncached, shutdown_runners
+
+    connection = connect(address, authkey)
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    def report_status(request_id, context, future):
+        try:
+            status = future.result()
+        except Exception:
+            send(('error', request_id, traceback.format_exc()))
+        else:
+            send(('status', request_id, status, context.killed_by))
+
+    def feedback(line):
+        send(('progress', line))
+
+    config = None
+    send(('hello', max_workers))
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while True:
+                try:
+                    message = connection.recv()
+                except EOFError:
+                    break
+                if message[0] == 'quit':
+                    break
+                _, request_id, context = message
+                config = context.config
+                callback = feedback if not config.swallow_output else (lambda line: None)
+                future = executor.submit(run_mutation_uncached, context, callback)
+                future.add_done_callback(partial(report_status, request_id, context))
+    finally:
+        if config is not None:
+            shutdown_runners(config)
+        connection.close()
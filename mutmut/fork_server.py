@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""mutmut side of the pytest fork server, see :mod:`mutmut.pytestplugin`.
+
+One pytest session is started for the whole run and imports the project
+and the tests once. Every mutant is then tested in a fork of it, so the
+cost of starting the interpreter, loading plugins and collecting is paid
+once instead of per mutant.
+"""
+
+import itertools
+import os
+import shlex
+import subprocess
+import threading
+from concurrent import futures
+from concurrent.futures import Future
+from multiprocessing.connection import Listener
+from typing import Callable, Dict, List, Optional
+
+from mutmut.pytestplugin import FAILED, FORK, NOT_FOUND, PASSED, SERVER_ADDRESS, SERVER_AUTHKEY, SERVER_MODE, TIMEOUT, plugin_env
+from mutmut.utils import SelectedTestsNotFoundException
+
+
+class PytestProcess:
+    """A pytest session running :mod:`mutmut.pytestplugin` in server ``mode``,
+    connected to us once it has collected the tests"""
+
+    def __init__(self, test_command: str, mode: str, swallow_output: bool = True, cwd: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None):
+        authkey = os.urandom(16)
+        self.listener = Listener(authkey=authkey)
+
+        env = plugin_env(env)
+        env[SERVER_ADDRESS] = self.listener.address
+        env[SERVER_AUTHKEY] = authkey.hex()
+        env[SERVER_MODE] = mode
+
+        self.test_command = test_command
+        self.process = subprocess.Popen(
+            shlex.split(test_command, posix=True) + ['-p', 'mutmut.pytestplugin'],
+            cwd=cwd,
+            env=env,
+            stdout=subprocess.DEVNULL if swallow_output else None,
+            stderr=subprocess.STDOUT if swallow_output else None,
+        )
+        self.connection = None
+        self.connection = self._accept()
+
+        message = self.connection.recv()
+        if message[0] != 'ready':
+            self.close()
+            raise RuntimeError('pytest session for {} failed to start: {}'.format(test_command, message[1]))
+
+    def _accept(self):
+        # accept() blocks forever if pytest dies before connecting, so watch the process meanwhile
+        accepted = Future()
+
+        def accept():
+            try:
+                accepted.set_result(self.listener.accept())
+            except Exception as e:
+                accepted.set_exception(e)
+
+        threading.Thread(target=accept, name='pytest_process_accept', daemon=True).start()
+        while True:
+            try:
+                return accepted.result(timeout=0.1)
+            except futures.TimeoutError:
+                pass
+            if self.process.poll() is not None:
+                self.listener.close()
+                raise RuntimeError('pytest session for {} exited with {} before it was ready'.format(
+                    self.test_command, self.process.returncode))
+
+    def close(self, kill: bool = False):
+        if not kill:
+            try:
+                self.connection.send(('quit',))
+            except (AttributeError, OSError):
+                pass
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                kill = True
+        if kill:
+            self.process.kill()
+            self.process.wait()
+        if self.connection is not None:
+            self.connection.close()
+        self.listener.close()
+
+
+class ForkServer:
+    def __init__(self, test_command: str, swallow_output: bool = True, cwd: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None):
+        self.test_command = test_command
+        self.pytest = PytestProcess(test_command, FORK, swallow_output=swallow_output, cwd=cwd, env=env)
+        self.connection = self.pytest.connection
+
+        self._request_ids = itertools.count()
+        self._pending: Dict[int, Future] = {}
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_results, name='fork_server_reader', daemon=True)
+        self._reader.start()
+
+    def _read_results(self):
+        try:
+            while True:
+                _, request_id, result, failed_test = self.connection.recv()
+                self._pending.pop(request_id).set_result((result, failed_test))
+        except (EOFError, OSError):
+            for future in self._pending.values():
+                future.set_exception(RuntimeError('Fork server for {} died'.format(self.test_command)))
+
+    def tests_pass(self, filename: str, mutated_source: Optional[str] = None, mutant_under_test: Optional[str] = None,
+                   timeout: Optional[float] = None, tests: Optional[List[str]] = None,
+                   on_failure: Optional[Callable[[str], None]] = None) -> bool:
+        """Test one mutant in a fork of the server
+
+        :param mutated_source: source to swap in for the module ``filename``
+        :param mutant_under_test: key of the :mod:`mutmut.schemata` mutant to activate instead
+        :param tests: node ids of the tests to run, all of them if :obj:`None`
+        :param on_failure: called with the node id of the test that failed, if any did
+        :raises TimeoutError: if the tests took longer than ``timeout``
+        :raises SelectedTestsNotFoundException: if the session didn't collect some of ``tests``
+        :return: :obj:`True` if the tests pass, otherwise :obj:`False`
+        """
+        future = Future()
+        with self._send_lock:
+            request_id = next(self._request_ids)
+            self._pending[request_id] = future
+            self.connection.send(('run', request_id, filename, mutated_source, mutant_under_test, timeout, tests))
+        result, failed_test = future.result()
+        if failed_test is not None and on_failure is not None:
+            on_failure(failed_test)
+        if result == TIMEOUT:
+            raise TimeoutError('forked tests for {} timed out after {} seconds'.format(filename, timeout))
+        if result == NOT_FOUND:
+            raise SelectedTestsNotFoundException(tests)
+        assert result in (PASSED, FAILED)
+        return result == PASSED
+
+    def close(self):
+        self.pytest.close()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_fork_server(config) -> ForkServer:
+    global _server
+    with _server_lock:
+        if _server is None:
+            cwd = env = None
+            if config.sandbox:
+                from mutmut.sandbox import get_sandbox_pool
+                sandbox = get_sandbox_pool(config.paths_to_mutate, ignore=config.sandbox_ignore).reserve()
+                cwd, env = sandbox.path, sandbox.env()
+            _server = ForkServer(config.default_test_command, swallow_output=config.swallow_output, cwd=cwd, env=env)
+        return _server
+
+
+def shutdown_fork_server():
+    global _server
+    with _server_lock:
+        server, _server = _server, None
+    if server is not None:
+        server.close()
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Serve a mutant to ``import`` from memory, for runners that test in-process.
+
+The finder goes first on ``sys.meta_path`` and only claims the module that
+is loaded from the mutated file, which it compiles from the mutated source
+instead of reading the file (or a ``.pyc`` of the original) from disk.
+"""
+
+import os
+import sys
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+from importlib.machinery import PathFinder, SourceFileLoader
+from types import ModuleType
+from typing import Optional
+
+
+def find_module(filename: str) -> Optional[ModuleType]:
+    """The module in ``sys.modules`` that was loaded from ``filename``"""
+    filename = os.path.realpath(filename)
+    for module in list(sys.modules.values()):
+        module_file = getattr(module, '__file__', None)
+        if module_file and os.path.realpath(module_file) == filename:
+            return module
+    return None
+
+
+def module_name_of(filename: str) -> str:
+    """The name ``filename`` would be imported as, going by ``sys.path``"""
+    filename = os.path.realpath(filename)
+    for entry in sys.path:
+        entry = os.path.realpath(entry or os.curdir)
+        relative = os.path.relpath(filename, entry)
+        if relative.startswith(os.pardir):
+            continue
+        parts = relative[:-len('.py')].split(os.sep)
+        if parts[-1] == '__init__':
+            parts = parts[:-1]
+        return '.'.join(parts)
+    raise ValueError('{} is not importable from sys.path'.format(filename))
+
+
+class MutantLoader(SourceFileLoader):
+    def __init__(self, fullname: str, path: str, source: str):
+        super().__init__(fullname, path)
+        self.source = source
+
+    def get_source(self, fullname):
+        return self.source
+
+    def get_code(self, fullname):
+        # never look at the bytecode cache, it belongs to the original
+        return compile(self.source, self.path, 'exec', dont_inherit=True)
+
+
+class MutantFinder(MetaPathFinder):
+    def __init__(self, filename: str, source: str):
+        self.path = os.path.realpath(filename)
+        self.source = source
+
+    def find_spec(self, fullname, path=None, target=None):
+        spec = PathFinder.find_spec(fullname, path)
+        if spec is None or spec.origin is None or os.path.realpath(spec.origin) != self.path:
+            return None
+        spec.loader = MutantLoader(fullname, spec.origin, self.source)
+        return spec
+
+
+def install_mutant(filename: str, source: str) -> MutantFinder:
+    finder = MutantFinder(filename, source)
+    sys.meta_path.insert(0, finder)
+    return finder
+
+
+def _package_of(module: ModuleType):
+    package_name, _, name = module.__name__.rpartition('.')
+    return sys.modules.get(package_name), name
+
+
+def _unload(module: ModuleType):
+    del sys.modules[module.__name__]
+    # importing a submodule also sets it as an attribute of its package
+    package, name = _package_of(module)
+    if package is not None and getattr(package, name, None) is module:
+        delattr(package, name)
+
+
+def _reload(module: ModuleType):
+    sys.modules[module.__name__] = module
+    package, name = _package_of(module)
+    if package is not None:
+        setattr(package, name, module)
+
+
+@contextmanager
+def mutant_imported(filename: str, source: str):
+    """Make imports of ``filename`` inside the block get ``source`` instead
+
+    A module already imported from ``filename`` is hidden for the duration of
+    the block, and the mutated module is dropped from ``sys.modules`` after
+    it, so the mutant never outlives the block.
+    """
+    previous = find_module(filename)
+    if previous is not None:
+        _unload(previous)
+    finder = install_mutant(filename, source)
+    try:
+        yield finder
+    finally:
+        sys.meta_path.remove(finder)
+        mutant = find_module(filename)
+        if mutant is not None:
+            _unload(mutant)
+        if previous is not None:
+            _reload(previous)
@@ -1,18 +1,52 @@
+import json
 import os
+import shlex
+import tempfile
 import traceback
 from pathlib import Path
 from time import time
+from typing import Dict, Optional, Tuple
 import click
 from glob2 import glob
 from mutmut import run_mutation_tests, compute_exit_code, close_active_queues, guess_paths_to_mutate, \
     python_source_files, add_mutations_by_file, mutations_by_type, read_coverage_data, check_coverage_data_filepaths, \
-    read_patch_data, popen_streaming_output, print_status
-from mutmut.cache import update_line_numbers, filename_and_mutation_id_from_pk, cached_test_time, cached_hash_of_tests, set_cached_test_time
+    read_patch_data, popen_streaming_output, print_status, hammett_prefix, is_pytest_command, list_mutations_of_files, \
+    mutants_depending_on_lines
+from mutmut.cache import update_line_numbers, register_mutants, invalidate_mutants, filename_and_mutation_id_from_pk, cached_test_time, cached_hash_of_tests, set_cached_test_time, \
+    set_cached_test_durations, untimed_test_files
+
+
+def popen_recording_durations(test_command: str, callback) -> Tuple[int, Dict[str, float], Optional[str]]:
+    """Run a pytest command like :func:`mutmut.popen_streaming_output`, with
+    :mod:`mutmut.pytestplugin` recording how long each test took
+
+    :return: the return code, the seconds by pytest node id, and the rootdir
+        of pytest the node ids are relative to
+    """
+    from mutmut.pytestplugin import DURATIONS_FILE, plugin_env
+    fd, durations_file = tempfile.mkstemp(prefix='mutmut-durations-', suffix='.json')
+    os.close(fd)
+    env = plugin_env()
+    env[DURATIONS_FILE] = durations_file
+    try:
+        returncode = popen_streaming_output(test_command + ' -p mutmut.pytestplugin', callback, env=env)
+        test_durations, rootdir = {}, None
+        if os.path.getsize(durations_file):
+            with open(durations_file) as f:
+                recorded = json.load(f)
+            test_durations, rootdir = recorded['durations'], recorded['rootdir']
+    finally:
+        os.unlink(durations_file)
+    return returncode, test_durations, rootdir
 
 
 class MutationTestRunner:
     def __init__(self, config):
         self.config = config
+        # the edits of the mutations found by generate_mutations, by filename
+        self.catalogs = {}
+        # the lines that changed since the files were cached, by filename
+        self.changed_lines = {}
 
     def run_baseline_tests(self):
         return self.time_test_suite(
@@ -21,19 +55,33 @@ class MutationTestRunner:
             using_testmon=self.config.using_testmon,
             current_hash_of_tests=self.config.hash_of_tests,
             no_progress=self.config.no_progress,
+            # the durations are only used to time out the selected tests of a mutant
+            record_durations=is_pytest_command(self.config.test_command) and (
+                self.config.time_tests or self.config.select_tests),
         )
 
-    def generate_mutations(self, argument, dict_synonyms, paths_to_exclude, paths_to_mutate, tests_dirs):
+    def run_test_timing(self):
+        if self.config.time_tests:
+            self.time_tests(
+                test_command=self.config.test_command,
+                tests_dirs=self.config.tests_dirs,
+                swallow_output=not self.config.swallow_output,
+                no_progress=self.config.no_progress,
+            )
+
+    def generate_mutations(self, argument, dict_synonyms, paths_to_exclude, paths_to_mutate, tests_dirs,
+                           max_workers=1):
         mutations_by_file = {}
         self.parse_run_argument(argument, dict_synonyms, mutations_by_file, paths_to_exclude, paths_to_mutate,
-                                tests_dirs)
+                                tests_dirs, max_workers)
+        self.invalidate_mutants_of_changed_code(mutations_by_file)
         self.config.total = sum(len(mutations) for mutations in mutations_by_file.values())
         return mutations_by_file
 
-    def run_mutation_tests(self, progress, mutations_by_file, max_workers):
+    def run_mutation_tests(self, progress, mutations_by_file, max_workers, coordinator=None):
         try:
             run_mutation_tests(config=self.config, progress=progress, mutations_by_file=mutations_by_file,
-                               max_workers=max_workers)
+                               max_workers=max_workers, coordinator=coordinator, catalogs=self.catalogs)
         except Exception as e:
             traceback.print_exc()
             return compute_exit_code(progress, e)
@@ -43,6 +91,23 @@ class MutationTestRunner:
             print()  # make sure we end the output with a newline
             close_active_queues()
 
+    def invalidate_mutants_of_changed_code(self, mutations_by_file):
+        """Test the cached mutants again if their tests run lines that changed
+
+        A mutant on an unchanged line keeps its cached result, but the code it
+        calls may have changed in another file. The coverage contexts tell
+        which tests run the changed lines, so only the mutants those tests
+        cover have to be tested again.
+        """
+        changed_lines = {filename: lines for filename, lines in self.changed_lines.items() if lines}
+        if not self.config.coverage_data or not changed_lines:
+            return
+        count = 0
+        for filename, mutations in mutants_depending_on_lines(self.config, mutations_by_file, changed_lines).items():
+            count += invalidate_mutants(filename, mutations)
+        if count:
+            print('{} cached results are tested again, their tests run code that changed'.format(count))
+
     def get_paths_to_mutate(self, paths_to_mutate):
         if paths_to_mutate is None:
             paths_to_mutate = guess_paths_to_mutate()
@@ -69,27 +134,40 @@ class MutationTestRunner:
         return [p for p in test_paths for p in glob(p, recursive=True)]
 
     def parse_run_argument(self, argument, dict_synonyms, mutations_by_file, paths_to_exclude, paths_to_mutate,
-                           tests_dirs):
+                           tests_dirs, max_workers=1):
         if argument is None:
-            self.handle_no_argument(dict_synonyms, mutations_by_file, paths_to_exclude, paths_to_mutate, tests_dirs)
+            self.handle_no_argument(dict_synonyms, mutations_by_file, paths_to_exclude, paths_to_mutate, tests_dirs,
+                                    max_workers)
         else:
             self.handle_argument(argument, dict_synonyms, mutations_by_file)
 
-    def handle_no_argument(self, dict_synonyms, mutations_by_file, paths_to_exclude, paths_to_mutate, tests_dirs):
+    def handle_no_argument(self, dict_synonyms, mutations_by_file, paths_to_exclude, paths_to_mutate, tests_dirs,
+                           max_workers=1):
+        filenames = []
         for path in paths_to_mutate:
-            self.process_files_in_path(path, tests_dirs, paths_to_exclude, dict_synonyms, mutations_by_file)
+            filenames.extend(self.files_in_path(path, tests_dirs, paths_to_exclude))
 
-    def process_files_in_path(self, path, tests_dirs, paths_to_exclude, dict_synonyms, mutations_by_file):
-        for filename in python_source_files(path, tests_dirs, paths_to_exclude):
-            if not filename.startswith('test_') and not filename.endswith('__tests.py'):
-                update_line_numbers(filename)
-                add_mutations_by_file(mutations_by_file, filename, dict_synonyms, self.config)
+        # the files are parsed in parallel, but only this process writes to the cache
+        mutations_of_files = list_mutations_of_files(filenames, dict_synonyms, self.config, max_workers)
+        for filename, mutations, catalog in mutations_of_files:
+            self.changed_lines[filename] = update_line_numbers(filename)
+            mutations_by_file[filename] = mutations
+            self.catalogs[filename] = catalog
+            register_mutants({filename: mutations})
+
+    @staticmethod
+    def files_in_path(path, tests_dirs, paths_to_exclude):
+        return [
+            filename
+            for filename in python_source_files(path, tests_dirs, paths_to_exclude)
+            if not filename.startswith('test_') and not filename.endswith('__tests.py')
+        ]
 
     def handle_argument(self, argument, dict_synonyms, mutations_by_file):
         try:
             int(argument)  # to check if it's an integer
             filename, mutation_id = filename_and_mutation_id_from_pk(int(argument))
-            update_line_numbers(filename)
+            self.changed_lines[filename] = update_line_numbers(filename)
             mutations_by_file[filename] = [mutation_id]
         except ValueError:
             if not os.path.exists(argument):
@@ -98,21 +176,65 @@ class MutationTestRunner:
             self.process_single_file(argument, dict_synonyms, mutations_by_file)
 
     def process_single_file(self, filename, dict_synonyms, mutations_by_file):
-        update_line_numbers(filename)
-        add_mutations_by_file(mutations_by_file, filename, dict_synonyms, self.config)
+        self.changed_lines[filename] = update_line_numbers(filename)
+        self.catalogs[filename] = {}
+        add_mutations_by_file(mutations_by_file, filename, dict_synonyms, self.config, self.catalogs[filename])
 
     @staticmethod
     def setup_environment():
         os.environ['PYTHONDONTWRITEBYTECODE'] = '1'  # stop python from creating .pyc files
 
     @staticmethod
-    def validate_arguments(use_coverage, use_patch_file, disable_mutation_types, enable_mutation_types):
+    def validate_arguments(use_coverage, use_patch_file, disable_mutation_types, enable_mutation_types,
+                           sandbox=False, runner=None, runner_mode='subprocess', select_tests=False,
+                           time_tests=False, schemata=False, coordinator=False, worker_processes=False):
         if use_coverage and use_patch_file:
             raise click.BadArgumentUsage("You can't combine --use-coverage and --use-patch")
 
         if disable_mutation_types and enable_mutation_types:
             raise click.BadArgumentUsage("You can't combine --disable-mutation-types and --enable-mutation-types")
 
+        if sandbox and runner and runner.startswith(hammett_prefix):
+            raise click.BadArgumentUsage("You can't combine --sandbox or --schemata with hammett, it runs the tests in-process")
+
+        if runner_mode == 'fork' and not hasattr(os, 'fork'):
+            raise click.BadArgumentUsage("--runner-mode=fork needs os.fork, which isn't available on this platform")
+
+        if runner_mode in ('fork', 'pool') and runner and runner.startswith(hammett_prefix):
+            raise click.BadArgumentUsage("--runner-mode={} only works with a pytest runner".format(runner_mode))
+
+        if select_tests and not use_coverage:
+            raise click.BadArgumentUsage("--select-tests needs --use-coverage")
+
+        if select_tests and runner and runner.startswith(hammett_prefix):
+            raise click.BadArgumentUsage("--select-tests passes pytest node ids to the runner, it doesn't work with hammett")
+
+        if time_tests and runner and not is_pytest_command(runner):
+            raise click.BadArgumentUsage("--time-tests needs a pytest runner")
+
+        if coordinator and runner and runner.startswith(hammett_prefix):
+            raise click.BadArgumentUsage("mutmut coordinator doesn't work with hammett, it runs the tests in-process")
+
+        if coordinator and schemata:
+            raise click.BadArgumentUsage("mutmut coordinator can't hand out the --schemata to the workers")
+
+        if coordinator and worker_processes:
+            raise click.BadArgumentUsage("mutmut coordinator hands the mutants to its workers, --worker-processes "
+                                         "doesn't apply")
+
+        if worker_processes and schemata:
+            raise click.BadArgumentUsage("You can't combine --worker-processes and --schemata")
+
+    @staticmethod
+    def parse_shard(shard):
+        """``--shard I/N`` as a tuple ``(i, n)``, or :obj:`None` without it"""
+        if shard is None:
+            return None
+        i, _, n = shard.partition('/')
+        if not (i.isdigit() and n.isdigit() and 1 <= int(i) <= int(n)):
+            raise click.BadOptionUsage('--shard', 'Expected --shard I/N with 1 <= I <= N, got {}'.format(shard))
+        return int(i), int(n)
+
     @staticmethod
     def split_paths(paths):
         for sep in [',', ':']:
@@ -175,6 +297,7 @@ class MutationTestRunner:
             using_testmon: bool,
             current_hash_of_tests,
             no_progress,
+            record_durations: bool = False,
     ) -> float:
         """Execute a test suite specified by ``test_command`` and record
         the time it took to execute the test suite as a floating point number
@@ -185,6 +308,8 @@ class MutationTestRunner:
             accommodate for ``pytest-testmon``
         :param current_hash_of_tests: the current hash of the tests
         :param no_progress: if :obj:`True` the progress indicator will be disabled
+        :param record_durations: if :obj:`True` also record how long each test took,
+            with :mod:`mutmut.pytestplugin`
 
         :return: execution time of the test suite
         """
@@ -205,7 +330,11 @@ class MutationTestRunner:
                 print_status('Running...')
             output.append(line)
 
-        returncode = popen_streaming_output(test_command, feedback)
+        test_durations, rootdir = None, None
+        if record_durations:
+            returncode, test_durations, rootdir = popen_recording_durations(test_command, feedback)
+        else:
+            returncode = popen_streaming_output(test_command, feedback)
 
         if returncode == 0 or (using_testmon and returncode == 5):
             baseline_time_elapsed = time() - start_time
@@ -218,5 +347,31 @@ class MutationTestRunner:
         print('Done')
 
         set_cached_test_time(baseline_time_elapsed, current_hash_of_tests)
+        if test_durations:
+            set_cached_test_durations(test_durations, rootdir)
 
         return baseline_time_elapsed
+
+    @staticmethod
+    def time_tests(test_command: str, tests_dirs, swallow_output: bool, no_progress: bool):
+        """Record how long each test takes, for the test files that changed
+        since they were last timed (see :func:`mutmut.cache.untimed_test_files`)
+
+        Only needed if the baseline run was cached, as it times all the tests.
+        """
+        test_files = untimed_test_files(tests_dirs)
+        if not test_files:
+            return
+
+        print('Timing the tests in {} changed test files'.format(len(test_files)))
+
+        def feedback(line):
+            if not swallow_output:
+                print(line)
+            if not no_progress:
+                print_status('Running...')
+
+        test_command = ' '.join([test_command] + [shlex.quote(x) for x in test_files])
+        _, test_durations, rootdir = popen_recording_durations(test_command, feedback)
+        print('Done')
+        set_cached_test_durations(test_durations, rootdir)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Testing the mutants in worker processes instead of threads.
+
+The worker threads of :func:`mutmut.check_mutants` share one GIL, so
+mutating the source with parso, and in-process runners like hammett, don't
+get faster with more workers. :class:`ProcessPool` starts ``max_workers``
+processes instead, each testing one mutant at a time, and replaces a
+process after it tested ``recycle_after`` mutants so state can't build up.
+
+The cache stays in the main process: mutants are looked up there before
+they're handed to a worker, and the workers put their results on the same
+results queue the threads would. The config, with the coverage data and
+the test durations, is sent once to each process as it starts, not with
+every mutant.
+"""
+
+import sys
+from copy import copy
+from multiprocessing.connection import wait
+from queue import Full
+
+# exit code of a worker process that tested enough mutants and wants to be replaced
+RECYCLE_EXIT_CODE = 75
+
+# how often the pool checks on its processes while it waits
+POLL_INTERVAL = 0.1
+
+# give up when worker processes died this often, rather than start new ones forever
+MAX_CRASHES = 10
+
+
+def _check_mutants_in_process(config, todo, results_queue, recycle_after):
+    from mutmut import run_mutation_uncached, shutdown_runners
+
+    def feedback(line):
+        results_queue.put(('progress', line, None, None, None))
+
+    try:
+        for _ in range(recycle_after):
+            context = todo.get()
+            if context is None:
+                # the others have to see it too
+                todo.put(None)
+                return
+            # like the copy queue_mutants makes for every mutant
+            context.config = copy(config)
+            status = run_mutation_uncached(context, feedback)
+            results_queue.put(('status', status, context.filename, context.mutation_id, context.killed_by))
+    finally:
+        shutdown_runners(config)
+    sys.exit(RECYCLE_EXIT_CODE)
+
+
+class ProcessPool:
+    def __init__(self, mp_ctx, config, recycle_after: int):
+        self.mp_ctx = mp_ctx
+        self.config = config
+        self.recycle_after = recycle_after
+        self.processes = []
+        self.crashes = 0
+        self._todo = None
+        self._results_queue = None
+
+    def check_mutants(self, mutants_queue, results_queue, max_workers):
+        """Like :func:`mutmut.check_mutants`, with ``max_workers`` processes"""
+        from mutmut import look_up_mutant
+
+        self._todo = self.mp_ctx.Queue(maxsize=max_workers)
+        self._results_queue = results_queue
+        try:
+            for _ in range(max_workers):
+                self._start_process()
+
+            while True:
+                command, context = mutants_queue.get()
+                if command == 'end':
+                    break
+                look_up_mutant(context)
+                # the process has its own copy of the config
+                context.config = None
+                self._put(context)
+
+            self._put(None)
+            while self.processes:
+                self._replace_exited(timeout=POLL_INTERVAL)
+        finally:
+            for process in self.processes:
+                process.kill()
+            results_queue.put(('end', None, None, None, None))
+
+    def _start_process(self):
+        process = self.mp_ctx.Process(
+            target=_check_mutants_in_process,
+            args=(self.config, self._todo, self._results_queue, self.recycle_after),
+            name='check_mutants',
+            daemon=True,
+        )
+        process.start()
+        self.processes.append(process)
+
+    def _put(self, context):
+        # the processes may all be gone to be recycled, so don't just block
+        while True:
+            try:
+                self._todo.put(context, timeout=POLL_INTERVAL)
+                return
+            except Full:
+                self._replace_exited()
+
+    def _replace_exited(self, timeout=0.0):
+        """Start a process for every one that was recycled or died, waiting
+        up to ``timeout`` for one to exit"""
+        wait([x.sentinel for x in self.processes], timeout)
+        for process in [x for x in self.processes if x.exitcode is not None]:
+            self.processes.remove(process)
+            if process.exitcode == 0:
+                # it saw the end of the mutants
+                continue
+            if process.exitcode != RECYCLE_EXIT_CODE:
+                self.crashes += 1
+                if self.crashes > MAX_CRASHES:
+                    raise RuntimeError('The worker processes keep dying, last with exit code {}'.format(
+                        process.exitcode))
+                print('A worker process died with exit code {}, its mutant will be tested in the next run'.format(
+                    process.exitcode), file=sys.stderr)
+            self._start_process()
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""pytest plugin that turns a pytest session into a mutmut test server.
+
+The plugin does nothing unless mutmut started pytest with the
+``MUTMUT_SERVER_ADDRESS`` environment variable set. The session then
+collects (and so imports) the tests once, connects back to mutmut and
+tests the mutants it's asked to, depending on ``MUTMUT_SERVER_MODE``:
+
+* ``fork``: every mutant is tested in a fork of the session, which swaps the
+  mutant into the already imported module. The parent only ever waits.
+* ``worker``: mutants are swapped in and out of the session itself, one at a
+  time. mutmut replaces the session after a while, see
+  :mod:`mutmut.worker_pool`.
+
+With ``MUTMUT_DURATIONS_FILE`` set instead, the session runs as usual and
+writes how long each test took to that file, with the rootdir its node ids
+are relative to.
+"""
+
+import builtins
+import json
+import os
+import signal
+import sys
+import traceback
+from multiprocessing.connection import Client
+from time import time
+from types import FunctionType
+from typing import Dict, List, Optional, Tuple
+
+import pytest
+
+from mutmut.import_hook import find_module, install_mutant, mutant_imported
+
+SERVER_ADDRESS = 'MUTMUT_SERVER_ADDRESS'
+SERVER_AUTHKEY = 'MUTMUT_SERVER_AUTHKEY'
+SERVER_MODE = 'MUTMUT_SERVER_MODE'
+DURATIONS_FILE = 'MUTMUT_DURATIONS_FILE'
+
+FORK = 'fork'
+WORKER = 'worker'
+
+PASSED = 'passed'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+NOT_FOUND = 'not found'
+
+
+def plugin_env(env: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """``env`` (default: ours) with this plugin importable by the tests, even
+    if mutmut isn't installed where they run"""
+    env = dict(os.environ if env is None else env)
+    mutmut_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(x for x in [env.get('PYTHONPATH'), mutmut_root] if x)
+    return env
+
+
+_ATTRIBUTES_NOT_TO_SWAP = {'__dict__', '__weakref__', '__module__', '__qualname__', '__doc__'}
+
+
+def _swap_function(old: FunctionType, new: FunctionType) -> bool:
+    """Give ``old`` the behaviour of ``new`` while keeping its identity, so
+    references the tests already hold (``from foo import bar``) see the
+    mutant too"""
+    try:
+        old.__code__ = new.__code__
+    except ValueError:
+        # different closure, can't be swapped in place
+        return False
+    old.__defaults__ = new.__defaults__
+    old.__kwdefaults__ = new.__kwdefaults__
+    return True
+
+
+def _swap_class(old: type, new: type):
+    for name, value in new.__dict__.items():
+        if name in _ATTRIBUTES_NOT_TO_SWAP:
+            continue
+        current = old.__dict__.get(name)
+        if isinstance(current, FunctionType) and isinstance(value, FunctionType) and _swap_function(current, value):
+            continue
+        setattr(old, name, value)
+
+
+def swap_module(filename: str, source: str) -> bool:
+    """Replace the code of the module loaded from ``filename`` with ``source``
+
+    Functions and classes are patched in place, other module globals are
+    replaced, also where another module imported them by name.
+
+    :return: :obj:`False` if the module isn't imported (yet), in which case
+        nothing was done
+    """
+    module = find_module(filename)
+    if module is None:
+        return False
+
+    namespace = {
+        '__name__': module.__name__,
+        '__file__': module.__file__,
+        '__package__': getattr(module, '__package__', None),
+        '__spec__': getattr(module, '__spec__', None),
+        '__builtins__': builtins,
+    }
+    if hasattr(module, '__path__'):
+        namespace['__path__'] = module.__path__
+    exec(compile(source, module.__file__, 'exec'), namespace)
+
+    replaced = {}
+    for name, value in namespace.items():
+        if name in ('__builtins__', '__spec__'):
+            continue
+        current = module.__dict__.get(name)
+        if getattr(current, '__module__', None) == module.__name__:
+            if isinstance(current, FunctionType) and isinstance(value, FunctionType) and _swap_function(current, value):
+                continue
+            if isinstance(current, type) and isinstance(value, type):
+                _swap_class(current, value)
+                continue
+        if name in module.__dict__:
+            replaced[name] = current
+        module.__dict__[name] = value
+
+    for other in list(sys.modules.values()):
+        if other is module or other is None:
+            continue
+        other_dict = getattr(other, '__dict__', {})
+        for name, old_value in replaced.items():
+            if name in other_dict and other_dict[name] is old_value:
+                other_dict[name] = module.__dict__[name]
+    return True
+
+
+class _FailureListener:
+    def __init__(self):
+        self.failed = False
+        self.failed_test = None
+
+    def pytest_runtest_logreport(self, report):
+        if report.failed and not self.failed:
+            self.failed = True
+            self.failed_test = report.nodeid
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        # peak instead of current, in kB on Linux but bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def selected_items(session, tests: Optional[List[str]]) -> Optional[list]:
+    """The items with the node ids ``tests``, all of them if :obj:`None`
+
+    :return: :obj:`None` if the session didn't collect some of the tests,
+        like pytest exits with a usage error for node ids it can't find
+    """
+    if tests is None:
+        return session.items
+    tests = set(tests)
+    items = [x for x in session.items if x.nodeid in tests]
+    if len({x.nodeid for x in items}) < len(tests):
+        return None
+    return items
+
+
+def run_items(session, items, teardown: bool = False) -> Tuple[bool, Optional[str]]:
+    """Run ``items`` like the runtest loop would, stopping at the first failure
+
+    :param teardown: tear down the fixtures that are still set up when
+        stopping early, for sessions that keep running tests
+    :return: whether all of them passed, and the node id of the one that failed
+    """
+    listener = _FailureListener()
+    session.config.pluginmanager.register(listener, 'mutmut-failure-listener')
+    try:
+        for i, item in enumerate(items):
+            next_item = items[i + 1] if i + 1 < len(items) else None
+            item.config.hook.pytest_runtest_protocol(item=item, nextitem=next_item)
+            if listener.failed:
+                if teardown and next_item is not None:
+                    setup_state = session._setupstate
+                    if hasattr(setup_state, 'teardown_exact'):
+                        setup_state.teardown_exact(None)
+                    else:  # pragma: no cover (pytest < 7)
+                        setup_state.teardown_all()
+                break
+    finally:
+        session.config.pluginmanager.unregister(listener)
+    return not listener.failed, listener.failed_test
+
+
+def _run_child(session, filename: str, mutated_source: Optional[str], mutant_under_test: Optional[str],
+               items: list, failed_test_fd: int):
+    code = 2
+    try:
+        if mutant_under_test is not None:
+            from mutmut.schemata import MUTANT_UNDER_TEST
+            os.environ[MUTANT_UNDER_TEST] = mutant_under_test
+        if mutated_source is not None and not swap_module(filename, mutated_source):
+            # imported lazily by the tests, if at all
+            install_mutant(filename, mutated_source)
+        passed, failed_test = run_items(session, items)
+        if failed_test is not None:
+            os.write(failed_test_fd, failed_test.encode())
+        code = 0 if passed else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def serve_forks(session, connection):
+    children: Dict[int, List] = {}
+
+    while True:
+        if connection.poll(0.01 if children else None):
+            command, *args = connection.recv()
+            if command == 'quit':
+                break
+            assert command == 'run'
+            request_id, filename, mutated_source, mutant_under_test, timeout, tests = args
+            items = selected_items(session, tests)
+            if items is None:
+                connection.send(('result', request_id, NOT_FOUND, None))
+                continue
+            # the child tells us which test failed through a pipe, a node id fits in its buffer
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                _run_child(session, filename, mutated_source, mutant_under_test, items, write_fd)
+            os.close(write_fd)
+            children[pid] = [request_id, time() + timeout if timeout else None, False, read_fd]
+
+        now = time()
+        for pid, (request_id, deadline, killed, _) in list(children.items()):
+            if deadline is not None and now > deadline and not killed:
+                os.kill(pid, signal.SIGKILL)
+                children[pid][2] = True
+
+        while children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            request_id, _, killed, read_fd = children.pop(pid)
+            with os.fdopen(read_fd, 'rb') as f:
+                failed_test = f.read().decode() or None
+            if killed:
+                result = TIMEOUT
+            elif os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                result = PASSED
+            else:
+                result = FAILED
+            connection.send(('result', request_id, result, failed_test))
+
+    for pid, (_, _, _, read_fd) in children.items():
+        os.kill(pid, signal.SIGKILL)
+        os.close(read_fd)
+
+
+def run_in_process(session, filename: str, mutated_source: Optional[str], mutant_under_test: Optional[str],
+                   items: list) -> Tuple[bool, Optional[str]]:
+    from mutmut.schemata import MUTANT_UNDER_TEST
+
+    original_source = None
+    if mutant_under_test is not None:
+        os.environ[MUTANT_UNDER_TEST] = mutant_under_test
+    try:
+        if mutated_source is None:
+            return run_items(session, items, teardown=True)
+        if find_module(filename) is None:
+            # imported lazily by the tests, if at all
+            with mutant_imported(filename, mutated_source):
+                return run_items(session, items, teardown=True)
+        with open(filename) as f:
+            original_source = f.read()
+        swap_module(filename, mutated_source)
+        return run_items(session, items, teardown=True)
+    except Exception:
+        traceback.print_exc()
+        return False, None
+    finally:
+        os.environ.pop(MUTANT_UNDER_TEST, None)
+        if original_source is not None:
+            swap_module(filename, original_source)
+
+
+def serve_mutants(session, connection):
+    while True:
+        command, *args = connection.recv()
+        if command == 'quit':
+            break
+        assert command == 'run'
+        request_id, filename, mutated_source, mutant_under_test, _, tests = args
+        items = selected_items(session, tests)
+        if items is None:
+            connection.send(('result', request_id, NOT_FOUND, current_rss(), None))
+            continue
+        passed, failed_test = run_in_process(session, filename, mutated_source, mutant_under_test, items)
+        connection.send(('result', request_id, PASSED if passed else FAILED, current_rss(), failed_test))
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_runtestloop(session):
+    address = os.environ.get(SERVER_ADDRESS)
+    if not address:
+        return None
+
+    connection = Client(address, authkey=bytes.fromhex(os.environ[SERVER_AUTHKEY]))
+    if session.testsfailed:
+        connection.send(('error', '{} errors during collection'.format(session.testsfailed)))
+        connection.close()
+        return True
+
+    connection.send(('ready', len(session.items)))
+    try:
+        if os.environ.get(SERVER_MODE) == WORKER:
+            serve_mutants(session, connection)
+        else:
+            serve_forks(session, connection)
+    finally:
+        connection.close()
+    return True
+
+
+class DurationRecorder:
+    """Sums up the setup, call and teardown time of every test, and of every
+    test file, which is in there even if it has no tests"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.durations: Dict[str, float] = {}
+
+    def pytest_collectreport(self, report):
+        if report.nodeid.endswith('.py'):
+            self.durations.setdefault(report.nodeid, 0.0)
+
+    def pytest_runtest_logreport(self, report):
+        test_file = report.nodeid.partition('::')[0]
+        for node_id in {report.nodeid, test_file}:
+            self.durations[node_id] = self.durations.get(node_id, 0.0) + report.duration
+
+    def pytest_sessionfinish(self, session):
+        with open(self.filename, 'w') as f:
+            json.dump(dict(rootdir=str(session.config.rootpath), durations=self.durations), f)
+
+
+def pytest_configure(config):
+    filename = os.environ.get(DURATIONS_FILE)
+    if filename:
+        config.pluginmanager.register(DurationRecorder(filename), 'mutmut-duration-recorder')
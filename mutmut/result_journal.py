@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Writing the results of the mutants to the cache in batches.
+
+Writing each result to the cache in a transaction of its own makes the
+cache the bottleneck with fast tests. :class:`ResultJournal` appends each
+result to a journal file next to the cache instead, and syncs it to disk,
+then writes the results to the cache together when :data:`FLUSH_EVERY` of
+them are waiting or :data:`FLUSH_INTERVAL` seconds passed. If mutmut is
+killed in between, the results are still in the journal, and
+:func:`replay_journal` writes them to the cache the next time it's opened.
+"""
+
+import json
+import os
+from time import time
+
+from mutmut import RelativeMutationID
+
+# write the results to the cache when this many are waiting
+FLUSH_EVERY = 100
+
+# or when the oldest one waited this many seconds
+FLUSH_INTERVAL = 5.0
+
+
+class ResultJournal:
+    def __init__(self, path: str, flush_every: int = FLUSH_EVERY, flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush = time()
+        self.file = open(path, 'a')
+
+    def record(self, filename, mutation_id, status, tests_hash, killed_by=None):
+        """Like :func:`mutmut.cache.update_mutant_status`, the result is in
+        the journal when this returns and in the cache after the next flush"""
+        self.file.write(json.dumps(
+            [filename, mutation_id.line, mutation_id.index, mutation_id.line_number, status, tests_hash, killed_by]
+        ) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.pending.append((filename, mutation_id, status, tests_hash, killed_by))
+        if len(self.pending) >= self.flush_every or time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        from mutmut.cache import update_mutant_statuses
+        if self.pending:
+            update_mutant_statuses(self.pending)
+            self.pending = []
+        # the cache has them now, writing them again after a crash would do no harm either
+        self.file.truncate(0)
+        os.fsync(self.file.fileno())
+        self.last_flush = time()
+
+    def close(self):
+        """Write the waiting results to the cache and remove the journal"""
+        try:
+            self.flush()
+        finally:
+            self.file.close()
+        os.remove(self.path)
+
+
+def replay_journal(path: str) -> int:
+    """Write the results left in the journal at ``path`` to the cache, and remove it
+
+    :return: the number of results
+    """
+    from mutmut.cache import update_mutant_statuses
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return 0
+
+    results = []
+    for line in lines:
+        try:
+            filename, line, index, line_number, status, tests_hash, killed_by = json.loads(line)
+        except ValueError:
+            # killed while writing the last result
+            break
+        mutation_id = RelativeMutationID(line=line, index=index, line_number=line_number, filename=filename)
+        results.append((filename, mutation_id, status, tests_hash, killed_by))
+
+    if results:
+        update_mutant_statuses(results)
+    os.remove(path)
+    return len(results)
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""Private copies of the project tree, one per worker.
+
+Python sources are hardlinked into the copy so creating a sandbox is cheap,
+everything else is copied so that tests writing to data files can't reach
+the real project. Virtualenvs in the project are symlinked instead, as
+copying them is slow and the tests should import the installed packages
+from where they are. A mutant is applied by replacing the hardlink with a
+private file, and reverted by linking the original back in.
+
+``overrides`` maps files of the project to replacements that are linked
+into every sandbox instead, e.g. the instrumented files of
+:mod:`mutmut.schemata`.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from queue import Empty, SimpleQueue
+from typing import Dict, List, Optional
+
+# what isn't copied into the sandboxes, the --sandbox-ignore patterns come on top
+SANDBOX_IGNORE = (
+    '.git',
+    '.hg',
+    '.svn',
+    '.tox',
+    '.nox',
+    # mutmut's own state: the cache with its shards, journal and sqlite -wal/-shm files, and the catalogs
+    '.mutmut-cache*',
+    '.mutmut-catalogs',
+    '__pycache__',
+    '*.bak',
+    'node_modules',
+)
+
+
+def link_or_copy(src: str, dst: str) -> str:
+    if src.endswith('.py'):
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            # different file system, or hardlinks not supported
+            pass
+    return shutil.copy2(src, dst)
+
+
+def is_virtualenv(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, 'pyvenv.cfg'))
+
+
+def copy_project(root: str, path: str, ignore: List[str]):
+    """Copy the project at ``root`` to ``path``, without the files and
+    directories matching the glob patterns ``ignore``, and with symlinks to
+    its virtualenvs"""
+    ignore_patterns = shutil.ignore_patterns(*ignore)
+    virtualenvs = []
+
+    def ignored(directory, names):
+        result = set(ignore_patterns(directory, names))
+        for name in names:
+            if name not in result and is_virtualenv(os.path.join(directory, name)):
+                virtualenvs.append(os.path.join(directory, name))
+                result.add(name)
+        return result
+
+    shutil.copytree(root, path, symlinks=True, ignore=ignored, copy_function=link_or_copy)
+    for virtualenv in virtualenvs:
+        os.symlink(virtualenv, os.path.join(path, os.path.relpath(virtualenv, root)))
+
+
+def find_import_roots(paths_to_mutate: List[str]) -> List[str]:
+    """Find the directories that have to be on ``sys.path`` to import the
+    code in ``paths_to_mutate``, i.e. the parent of the top-most package."""
+    roots = []
+    for path in paths_to_mutate:
+        path = os.path.abspath(path)
+        if not os.path.isdir(path):
+            path = os.path.dirname(path)
+        while os.path.exists(os.path.join(path, '__init__.py')):
+            path = os.path.dirname(path)
+        if path not in roots:
+            roots.append(path)
+    return roots
+
+
+def sandbox_parent_dir(root: str) -> Optional[str]:
+    """Hardlinks can't cross file systems, so if the temp dir lives on
+    another one we put the sandboxes next to the project instead"""
+    if os.stat(tempfile.gettempdir()).st_dev == os.stat(root).st_dev:
+        return None
+    parent = os.path.dirname(root)
+    return parent if os.access(parent, os.W_OK) else None
+
+
+class Sandbox:
+    def __init__(self, root: str, path: str, import_roots: List[str], overrides: Optional[Dict[str, str]] = None):
+        self.root = root
+        self.path = path
+        self.import_roots = import_roots
+        self.overrides = overrides or {}
+
+    def path_of(self, filename: str) -> str:
+        relative = os.path.relpath(os.path.abspath(filename), self.root)
+        if relative == os.pardir or relative.startswith(os.pardir + os.sep):
+            raise ValueError('{} is outside of the project at {}'.format(filename, self.root))
+        return os.path.normpath(os.path.join(self.path, relative))
+
+    def write(self, filename: str, source: str):
+        """Write ``source`` to the sandboxed copy of ``filename`` without
+        touching the file it was linked from"""
+        target = self.path_of(filename)
+        if os.path.lexists(target):
+            os.unlink(target)
+        with open(target, 'w') as f:
+            f.write(source)
+
+    def restore(self, filename: str):
+        target = self.path_of(filename)
+        if os.path.lexists(target):
+            os.unlink(target)
+        original = os.path.join(self.root, os.path.relpath(target, self.path))
+        link_or_copy(self.overrides.get(original, original), target)
+
+    def env(self, base: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """Environment for a test process running in this sandbox: entries of
+        ``PYTHONPATH`` that point into the project are redirected into the
+        sandbox, and the import roots of the mutated code come first so they
+        shadow e.g. an editable install of the project."""
+        env = dict(os.environ if base is None else base)
+        python_path = []
+        for entry in self.import_roots + env.get('PYTHONPATH', '').split(os.pathsep):
+            if not entry:
+                continue
+            try:
+                entry = self.path_of(entry)
+            except ValueError:
+                pass
+            if entry not in python_path:
+                python_path.append(entry)
+        env['PYTHONPATH'] = os.pathsep.join(python_path)
+        return env
+
+
+class SandboxPool:
+    """Sandboxes are created lazily, so there are never more of them than
+    mutants that were tested at the same time."""
+
+    def __init__(self, root: str, import_roots: List[str], overrides: Optional[Dict[str, str]] = None,
+                 ignore: Optional[List[str]] = None):
+        self.root = root
+        self.import_roots = import_roots
+        self.overrides = overrides or {}
+        self.ignore = list(SANDBOX_IGNORE) + list(ignore or [])
+        self._free = SimpleQueue()
+        self._sandboxes = []
+        self._lock = threading.Lock()
+
+    def _create(self) -> Sandbox:
+        path = os.path.join(tempfile.mkdtemp(prefix='mutmut-sandbox-', dir=sandbox_parent_dir(self.root)), 'project')
+        copy_project(self.root, path, self.ignore)
+        sandbox = Sandbox(root=self.root, path=path, import_roots=self.import_roots, overrides=self.overrides)
+        for filename in self.overrides:
+            sandbox.restore(filename)
+        with self._lock:
+            self._sandboxes.append(sandbox)
+        return sandbox
+
+    def reserve(self) -> Sandbox:
+        """A sandbox that is never handed out by :meth:`acquire`, for
+        processes that live as long as the pool"""
+        return self._create()
+
+    @contextmanager
+    def acquire(self):
+        try:
+            sandbox = self._free.get_nowait()
+        except Empty:
+            sandbox = self._create()
+        try:
+            yield sandbox
+        finally:
+            self._free.put(sandbox)
+
+    def cleanup(self):
+        with self._lock:
+            sandboxes, self._sandboxes = self._sandboxes, []
+        for sandbox in sandboxes:
+            shutil.rmtree(os.path.dirname(sandbox.path), ignore_errors=True)
+        self._free = SimpleQueue()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_sandbox_pool(paths_to_mutate: List[str], overrides: Optional[Dict[str, str]] = None,
+                     ignore: Optional[List[str]] = None) -> SandboxPool:
+    """
+    :param ignore: glob patterns of what not to copy into the sandboxes,
+        besides :data:`SANDBOX_IGNORE`
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool(
+                root=os.getcwd(),
+                import_roots=find_import_roots(paths_to_mutate),
+                overrides=overrides,
+                ignore=ignore,
+            )
+        return _pool
+
+
+def cleanup_sandboxes():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.cleanup()
+
+
+atexit.register(cleanup_sandboxes)
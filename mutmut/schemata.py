@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Mutant schemata: every mutant of a function compiled into one file.
+
+Each function that has mutants is replaced by a trampoline with the same
+name, which calls either the original function or one of its mutated copies
+depending on the ``MUTANT_UNDER_TEST`` environment variable. The
+instrumented file is written once per run, after that testing a mutant only
+means running the tests with a different environment.
+
+Only plain (undecorated, non-async) functions at module level or directly in
+a module level class are instrumented. Mutants anywhere else are tested by
+rewriting the file like before.
+"""
+
+import os
+import re
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from parso import parse
+
+from mutmut.utils import Context, Edit, RelativeMutationID
+
+MUTANT_UNDER_TEST = 'MUTANT_UNDER_TEST'
+
+trampoline_helper = '''import os as _mutmut_os
+
+
+def _mutmut_trampoline(orig, variants, args, kwargs):
+    variant = variants.get(_mutmut_os.environ.get('{}'))
+    if variant is None:
+        return orig(*args, **kwargs)
+    return variant(*args, **kwargs)
+
+
+'''.format(MUTANT_UNDER_TEST)
+
+
+def _is_docstring(node) -> bool:
+    return node.type == 'simple_stmt' and node.children[0].type == 'string'
+
+
+def _is_future_import(node) -> bool:
+    if node.type != 'simple_stmt' or node.children[0].type != 'import_from':
+        return False
+    return [x.value for x in node.children[0].get_from_names()] == ['__future__']
+
+
+def instrumentable_functions(module) -> list:
+    """The function definitions we know how to trampoline, in source order"""
+    result = []
+    for node in module.children:
+        if node.type == 'funcdef':
+            result.append(node)
+        elif node.type == 'classdef' and node.children[-1].type == 'suite':
+            result.extend(x for x in node.children[-1].children if x.type == 'funcdef')
+    return result
+
+
+def _helper_offset(module, offset_of) -> int:
+    """Insert the helper after the module docstring and __future__ imports"""
+    children = [x for x in module.children if x.type != 'endmarker']
+    i = 0
+    if children and _is_docstring(children[0]):
+        i = 1
+    while i < len(children) and _is_future_import(children[i]):
+        i += 1
+    if i == len(children):
+        return len(module.get_code())
+    return offset_of((children[i].start_pos[0], 0))
+
+
+def mangled_name(name: str, key: str) -> str:
+    # never start with a double underscore, or class private name mangling kicks in
+    return 'x_{}__mutmut_{}'.format(name, key)
+
+
+def _renamed(code: str, name: str, new_name: str) -> str:
+    return re.sub(r'^def\s+{}\b'.format(re.escape(name)), 'def ' + new_name, code, count=1)
+
+
+def _trampoline(name: str, variant_keys: List[str], indent: str) -> str:
+    variants = ', '.join("'{}': {}".format(key, mangled_name(name, key)) for key in variant_keys)
+    return (
+        '{indent}def {name}(*args, _mutmut_orig={orig}, _mutmut_variants={{{variants}}}, **kwargs):\n'
+        '{indent}    return _mutmut_trampoline(_mutmut_orig, _mutmut_variants, args, kwargs)\n'
+    ).format(indent=indent, name=name, orig=mangled_name(name, 'orig'), variants=variants)
+
+
+def instrument(
+        source: str,
+        filename: str,
+        mutant_keys: List[Tuple[str, RelativeMutationID]],
+        dict_synonyms: List[str] = None,
+        config=None,
+        catalog: Optional[Dict[RelativeMutationID, Edit]] = None,
+) -> Tuple[Optional[str], Dict[RelativeMutationID, str]]:
+    """Build the schemata version of ``source``
+
+    The mutated copies of the functions are made from the
+    :func:`mutmut.catalog_mutations` edits, so the source is parsed once
+    however many mutants it has. Nothing is instrumented if the
+    ``pre_mutation_ast`` hook has to see each mutant, see
+    :func:`mutmut.catalogs_apply`.
+
+    :param mutant_keys: the mutants to put in the schemata and the value of
+        ``MUTANT_UNDER_TEST`` that should activate each of them
+    :param catalog: the catalog of ``source``, if it's at hand
+    :return: the instrumented source (or :obj:`None` if none of the mutants
+        could be instrumented) and the keys of the mutants that were
+    """
+    from mutmut import catalog_mutations, catalogs_apply
+
+    if not catalogs_apply():
+        return None, {}
+    if source and source[-1] != '\n':
+        source += '\n'
+    if catalog is None:
+        catalog = catalog_mutations(Context(source=source, filename=filename, dict_synonyms=dict_synonyms, config=config))
+    module = parse(source, error_recovery=False)
+    functions = instrumentable_functions(module)
+    original_codes = [x.get_code(include_prefix=False) for x in functions]
+
+    line_offsets = [0]
+    for line in source.splitlines(keepends=True):
+        line_offsets.append(line_offsets[-1] + len(line))
+
+    def offset_of(pos):
+        return line_offsets[pos[0] - 1] + pos[1]
+
+    spans = [(offset_of(x.start_pos), offset_of(x.end_pos)) for x in functions]
+    variants_by_function = {}
+    instrumented_keys = {}
+    for key, mutation_id in mutant_keys:
+        edit = catalog.get(mutation_id)
+        if edit is None:
+            continue
+        i = next((i for i, (start, end) in enumerate(spans) if start <= edit.offset and edit.offset + edit.length <= end), None)
+        if i is None:
+            # the mutant is outside of the functions we can instrument
+            continue
+        name = functions[i].name.value
+        variant_code = Edit(edit.offset - spans[i][0], edit.length, edit.replacement).apply(original_codes[i])
+        if variant_code == original_codes[i] or not re.match(r'def\s+{}\b'.format(re.escape(name)), variant_code):
+            continue
+        variants_by_function.setdefault(i, []).append((key, variant_code))
+        instrumented_keys[mutation_id] = key
+
+    if not variants_by_function:
+        return None, {}
+
+    replacements = []
+    for i, variants in variants_by_function.items():
+        function = functions[i]
+        name = function.name.value
+        indent = source[line_offsets[function.start_pos[0] - 1]:offset_of(function.start_pos)]
+        code = _renamed(original_codes[i], name, mangled_name(name, 'orig'))
+        for key, variant_code in variants:
+            code += indent + _renamed(variant_code, name, mangled_name(name, key))
+        code += _trampoline(name, [key for key, _ in variants], indent)
+        replacements.append((offset_of(function.start_pos), offset_of(function.end_pos), code))
+
+    replacements.append((_helper_offset(module, offset_of),) * 2 + (trampoline_helper,))
+
+    result = source
+    for start, end, code in sorted(replacements, reverse=True):
+        result = result[:start] + code + result[end:]
+    return result, instrumented_keys
+
+
+class Schemata:
+    """The instrumented files of a run, written to a temp dir"""
+
+    def __init__(self):
+        self.directory = tempfile.mkdtemp(prefix='mutmut-schemata-')
+        self.files = {}
+        self.keys = {}
+
+    def add(self, filename: str, source: str, mutant_keys, dict_synonyms=None, config=None, catalog=None):
+        instrumented, keys = instrument(
+            source, filename, mutant_keys, dict_synonyms=dict_synonyms, config=config, catalog=catalog)
+        if instrumented is None:
+            return
+        try:
+            compile(instrumented, filename, 'exec')
+        except SyntaxError:
+            # e.g. a mutant that is only valid where it was, fall back to rewriting the file
+            return
+        path = os.path.join(self.directory, '{}_{}'.format(len(self.files), os.path.basename(filename)))
+        with open(path, 'w') as f:
+            f.write(instrumented)
+        self.files[os.path.abspath(filename)] = path
+        for mutation_id, key in keys.items():
+            self.keys[filename, mutation_id] = key
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def create_schemata(
+        config,
+        mutations_by_file: Dict[str, List[RelativeMutationID]],
+        catalogs: Optional[Dict[str, Dict[RelativeMutationID, Edit]]] = None,
+) -> Schemata:
+    """Instrument every file with mutants that still have to be tested
+
+    :param catalogs: the :func:`mutmut.catalog_mutations` of the files, by filename
+    """
+    from mutmut import hash_of_tests_of_mutant
+    from mutmut.cache import get_cached_mutation_statuses, get_mutant_pks
+    from mutmut.utils import UNTESTED
+
+    schemata = Schemata()
+    for filename, mutations in mutations_by_file.items():
+        statuses = get_cached_mutation_statuses(
+            filename, mutations, {x: hash_of_tests_of_mutant(config, filename, x) for x in mutations})
+        untested = [x for x in mutations if statuses.get(x) == UNTESTED]
+        if not untested:
+            continue
+        pks = get_mutant_pks(filename, untested)
+        with open(filename) as f:
+            source = f.read()
+        schemata.add(
+            filename,
+            source,
+            [(str(pks[x]), x) for x in untested if x in pks],
+            dict_synonyms=config.dict_synonyms,
+            config=config,
+            catalog=(catalogs or {}).get(filename) or None,
+        )
+    return schemata
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Runs the test subprocesses of all workers from one asyncio event loop.
+
+Each worker thread used to babysit its own test process, with a pty, a
+``threading.Timer`` to kill it and a loop around blocking reads. Here the
+loop, in a thread of its own, starts the processes, reads their output as
+it comes and kills the ones that run out of time, so the workers just pass
+on the output and wait for the return code.
+"""
+
+import asyncio
+import os
+import queue
+import shlex
+import threading
+from typing import Callable, Dict, Optional
+
+# how much output is read at a time
+CHUNK_SIZE = 64 * 1024
+
+
+class Supervisor:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='mutmut_supervisor', daemon=True)
+        self.thread.start()
+
+    def run(self, cmd: str, callback: Callable[[str], None], timeout: Optional[float] = None,
+            cwd: Optional[str] = None, env: Optional[Dict[str, str]] = None) -> int:
+        """Run ``cmd`` and wait for it to finish, see :func:`mutmut.popen_streaming_output`
+
+        Safe to call from any number of threads. ``callback`` is called from
+        the calling thread: the loop only queues the lines, so a callback
+        that blocks holds up its own process, not all of them.
+        """
+        lines = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._run(cmd, lines.put_nowait, timeout, cwd, env), self.loop)
+        future.add_done_callback(lambda _: lines.put_nowait(None))
+        while True:
+            line = lines.get()
+            if line is None:
+                break
+            callback(line)
+        return future.result()
+
+    async def _run(self, cmd, callback, timeout, cwd, env):
+        if os.name == 'nt':  # pragma: no cover
+            process = await asyncio.create_subprocess_shell(
+                cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, cwd=cwd, env=env,
+            )
+        else:
+            process = await asyncio.create_subprocess_exec(
+                *shlex.split(cmd, posix=True),
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT, cwd=cwd, env=env,
+            )
+        try:
+            await asyncio.wait_for(self._stream(process, callback), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("subprocess running command '{}' timed out after {} seconds".format(cmd, timeout))
+        finally:
+            if process.returncode is None:
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+        return process.returncode
+
+    @staticmethod
+    async def _stream(process, callback):
+        """Pass the output of ``process`` to ``callback`` line by line, until it exits"""
+        pending = b''
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            *lines, pending = (pending + chunk).split(b'\n')
+            for line in lines:
+                callback((line + b'\n').decode('utf-8', errors='replace'))
+        if pending:
+            callback(pending.decode('utf-8', errors='replace'))
+        await process.wait()
+
+
+_supervisor = None
+_supervisor_lock = threading.Lock()
+
+
+def get_supervisor() -> Supervisor:
+    global _supervisor
+    with _supervisor_lock:
+        if _supervisor is None:
+            _supervisor = Supervisor()
+        return _supervisor
@@ -1,8 +1,10 @@
 from .ast_pattern import ASTPattern, import_from_star_pattern, array_subscript_pattern, function_call_pattern
 from .config import Config
 from .context import Context
+from .edit import Edit
 from .invalid_ast_pattern_exception import InvalidASTPatternException
 from .relative_mutation_id import RelativeMutationID, ALL
 from .progress import Progress, UNTESTED, SKIPPED, BAD_TIMEOUT, OK_SUSPICIOUS, BAD_SURVIVED, OK_KILLED, MUTANT_STATUSES, print_status
 from .skip_exception import SkipException
+from .selected_tests_not_found_exception import SelectedTestsNotFoundException
 from .mutation_iterator import MutationCollection, MutationIterator
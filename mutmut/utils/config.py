@@ -1,13 +1,13 @@
 import os
 from dataclasses import dataclass, field
-from typing import Optional, Dict, List, Set
+from typing import Optional, Dict, List, Set, Tuple
 
 @dataclass
 class Config:
     swallow_output: bool
     test_command: str
     _default_test_command: str = field(init=False)
-    covered_lines_by_filename: Optional[Dict[str, set[Optional[int]]]]
+    covered_lines_by_filename: Optional[Dict[str, Set[Optional[int]]]]
     baseline_time_elapsed: float
     test_time_multiplier: float
     test_time_base: float
@@ -24,6 +24,22 @@ class Config:
     no_progress: bool
     ci: bool
     rerun_all: bool
+    sandbox: bool = False
+    # glob patterns of what isn't copied into the sandboxes, besides mutmut.sandbox.SANDBOX_IGNORE
+    sandbox_ignore: List[str] = field(default_factory=list)
+    schemata: bool = False
+    runner_mode: str = 'subprocess'
+    recycle_after: int = 100
+    max_worker_rss: Optional[int] = None
+    select_tests: bool = False
+    test_durations: Optional[Dict[str, float]] = None
+    timeout_multiplier: float = 10.0
+    timeout_floor: float = 1.0
+    time_tests: bool = False
+    shard: Optional[Tuple[int, int]] = None  # (i, n), only test shard i of n
+    worker_processes: bool = False
+    # by normalized path, with coverage contexts a result only depends on the test files that cover the mutant
+    hashes_of_test_files: Optional[Dict[str, str]] = None
 
     def __post_init__(self):
         self._default_test_command = self.test_command
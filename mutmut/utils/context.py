@@ -1,4 +1,7 @@
 from typing import Optional, List, Dict
+
+from parso import split_lines
+
 from .relative_mutation_id import RelativeMutationID, ALL
 from .config import Config, should_exclude
 
@@ -19,16 +22,28 @@ class Context:
         self._set_source(source)
         self.mutation_id = mutation_id
         self.performed_mutation_ids = []
+        # when listing the mutations, the edit of each of performed_mutation_ids
+        self.edits = None
+        # the edit that makes this mutant, from the catalog of its file; None to find it with parso
+        self.edit = None
+        self.mutated_source = None
         assert isinstance(mutation_id, RelativeMutationID)
         self.current_line_index = 0
         self.filename = filename
         self.stack = []
         self.dict_synonyms = (dict_synonyms or []) + ['dict']
         self._source_by_line_number = None
+        self._line_offsets = None
         self._pragma_no_mutate_lines = None
         self._path_by_line = None
         self.config = config
         self.skip = False
+        # value of MUTANT_UNDER_TEST that activates this mutant, if it's in the schemata
+        self.schemata_key = None
+        # pytest node ids of the tests to run for this mutant, None for all of them
+        self.selected_tests = None
+        # pytest node id of the test that killed this mutant, recorded in the cache for the next run
+        self.killed_by = None
 
     def exclude_line(self):
         return self.current_line_index in self.pragma_no_mutate_lines or should_exclude(context=self, config=self.config)
@@ -52,6 +67,14 @@ class Context:
             self._source_by_line_number = self.source.split('\n')
         return self._source_by_line_number
 
+    def offset_of(self, pos):
+        """The offset in the source of a parso ``(line, column)`` position"""
+        if self._line_offsets is None:
+            self._line_offsets = [0]
+            for line in split_lines(self.source, keepends=True):
+                self._line_offsets.append(self._line_offsets[-1] + len(line))
+        return self._line_offsets[pos[0] - 1] + pos[1]
+
     @property
     def current_source_line(self):
         return self.source_by_line_number[self.current_line_index]
@@ -0,0 +1,15 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Edit:
+    """The change a mutant makes: replace ``length`` characters of the source,
+    from ``offset`` on, with ``replacement``"""
+    offset: int
+    length: int
+    replacement: str
+
+    def apply(self, source: str) -> str:
+        mutated_source = source[:self.offset] + self.replacement + source[self.offset + self.length:]
+        # mutating "is" in "is not" gives "is not not"
+        return mutated_source.replace(' not not ', ' ')
@@ -0,0 +1,4 @@
+class SelectedTestsNotFoundException(Exception):
+    """Raised when the tests selected for a mutant aren't among the ones
+    pytest collects, e.g. when they were renamed since the coverage
+    contexts naming them were recorded"""
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""A pool of long-lived pytest sessions that test mutants in-process.
+
+Lighter than the fork server: a mutant is swapped into a session, tested
+and swapped out again, with no process created per mutant. Since state can
+leak between mutants this way, a session is replaced after it tested
+``recycle_after`` mutants or grew past ``max_rss`` bytes, and after a
+timeout, as the only way to stop a test that hangs is to kill the session.
+"""
+
+import threading
+from contextlib import contextmanager
+from queue import Empty, SimpleQueue
+from typing import Callable, Dict, List, Optional
+
+from mutmut.fork_server import PytestProcess
+from mutmut.pytestplugin import FAILED, NOT_FOUND, PASSED, WORKER
+from mutmut.utils import SelectedTestsNotFoundException
+
+
+class PoolWorker:
+    def __init__(self, test_command: str, swallow_output: bool = True, cwd: Optional[str] = None,
+                 env: Optional[Dict[str, str]] = None, recycle_after: Optional[int] = None,
+                 max_rss: Optional[int] = None):
+        self.test_command = test_command
+        self.swallow_output = swallow_output
+        self.cwd = cwd
+        self.env = env
+        self.recycle_after = recycle_after
+        self.max_rss = max_rss
+        self.pytest: Optional[PytestProcess] = None
+        self.tested = 0
+
+    def start(self):
+        self.pytest = PytestProcess(self.test_command, WORKER, swallow_output=self.swallow_output, cwd=self.cwd,
+                                    env=self.env)
+        self.tested = 0
+
+    def stop(self, kill: bool = False):
+        if self.pytest is not None:
+            pytest, self.pytest = self.pytest, None
+            pytest.close(kill=kill)
+
+    def tests_pass(self, filename: str, mutated_source: Optional[str] = None, mutant_under_test: Optional[str] = None,
+                   timeout: Optional[float] = None, tests: Optional[List[str]] = None,
+                   on_failure: Optional[Callable[[str], None]] = None) -> bool:
+        """Test one mutant in the session, starting a new one if needed
+
+        :param mutated_source: source to swap in for the module ``filename``
+        :param mutant_under_test: key of the :mod:`mutmut.schemata` mutant to activate instead
+        :param tests: node ids of the tests to run, all of them if :obj:`None`
+        :param on_failure: called with the node id of the test that failed, if any did
+        :raises TimeoutError: if the tests took longer than ``timeout``
+        :raises SelectedTestsNotFoundException: if the session didn't collect some of ``tests``
+        :return: :obj:`True` if the tests pass, otherwise :obj:`False`
+        """
+        if self.pytest is None:
+            self.start()
+        connection = self.pytest.connection
+        connection.send(('run', self.tested, filename, mutated_source, mutant_under_test, timeout, tests))
+        if not connection.poll(timeout or None):
+            self.stop(kill=True)
+            raise TimeoutError('tests for {} timed out after {} seconds'.format(filename, timeout))
+        try:
+            _, _, result, rss, failed_test = connection.recv()
+        except EOFError:
+            # the mutant took the whole session down with it
+            self.stop(kill=True)
+            return False
+
+        self.tested += 1
+        if (self.recycle_after and self.tested >= self.recycle_after) or (self.max_rss and rss > self.max_rss):
+            self.stop()
+        if result == NOT_FOUND:
+            raise SelectedTestsNotFoundException(tests)
+        assert result in (PASSED, FAILED)
+        if failed_test is not None and on_failure is not None:
+            on_failure(failed_test)
+        return result == PASSED
+
+
+class WorkerPool:
+    """Workers are created lazily, like :class:`mutmut.sandbox.SandboxPool`"""
+
+    def __init__(self, config):
+        self.config = config
+        self._free = SimpleQueue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def _create(self) -> PoolWorker:
+        config = self.config
+        cwd = env = None
+        if config.sandbox:
+            from mutmut.sandbox import get_sandbox_pool
+            sandbox = get_sandbox_pool(config.paths_to_mutate, ignore=config.sandbox_ignore).reserve()
+            cwd, env = sandbox.path, sandbox.env()
+        worker = PoolWorker(
+            config.default_test_command,
+            swallow_output=config.swallow_output,
+            cwd=cwd,
+            env=env,
+            recycle_after=config.recycle_after,
+            max_rss=config.max_worker_rss * 1024 * 1024 if config.max_worker_rss else None,
+        )
+        with self._lock:
+            self._workers.append(worker)
+        return worker
+
+    @contextmanager
+    def acquire(self):
+        try:
+            worker = self._free.get_nowait()
+        except Empty:
+            worker = self._create()
+        try:
+            yield worker
+        finally:
+            self._free.put(worker)
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.stop()
+        self._free = SimpleQueue()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(config) -> WorkerPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(config)
+        return _pool
+
+
+def shutdown_worker_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
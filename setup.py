@@ -96,7 +96,7 @@ setup(
     license="BSD",
     zip_safe=False,
     keywords='mutmut mutant mutation test testing',
-    python_requires='>=3.7',
+    python_requires='>=3.8',
     install_requires=read_reqs('requirements.txt'),
     extras_require=extras_reqs,
     tests_require=test_reqs,
@@ -106,7 +106,8 @@ setup(
         'License :: OSI Approved :: BSD License',
         'Natural Language :: English',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
     ],
     test_suite='tests',
     cmdclass={
@@ -1,4 +1,13 @@
-from mutmut.cache import sequence_ops
+import sqlite3
+
+import pytest
+
+import mutmut.cache
+from mutmut import RelativeMutationID, UNTESTED, BAD_SURVIVED, OK_KILLED
+from mutmut.cache import sequence_ops, update_line_numbers, register_mutants, get_cached_mutation_statuses, \
+    get_cached_mutants, update_mutant_status, cached_mutation_status, cached_killed_by, get_mutant_pks, \
+    invalidate_mutants, explain_queries, merge_caches, current_db_version, set_cached_test_durations, \
+    cached_test_durations, untimed_test_files
 
 
 def test_sequence_ops():
@@ -38,3 +47,103 @@ def test_sequence_ops():
         ('equal', 'f', 5, 'f', 6),
         ('delete', 'g', 6, None, None),
     ]
+
+
+@pytest.fixture
+def cache_in_tmpdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    yield tmpdir
+    mutmut.cache.db.provider = None
+    mutmut.cache.db.schema = None
+
+
+def test_mutant_statuses_round_trip(cache_in_tmpdir):
+    cache_in_tmpdir.join('foo.py').write('a = 1\nb = 2\n')
+    ids = [RelativeMutationID(line='a = 1', index=0, line_number=0), RelativeMutationID(line='b = 2', index=0, line_number=1)]
+    assert update_line_numbers('foo.py') == [0, 1]
+    register_mutants({'foo.py': ids})
+    assert get_cached_mutation_statuses('foo.py', ids, {x: 'h' for x in ids}) == {x: UNTESTED for x in ids}
+
+    update_mutant_status('foo.py', ids[0], BAD_SURVIVED, 'h')
+    update_mutant_status('foo.py', ids[1], OK_KILLED, 'old', killed_by='tests/test_foo.py::test_b')
+    assert cached_mutation_status('foo.py', ids[0], 'h') == BAD_SURVIVED
+    assert cached_mutation_status('foo.py', ids[0], 'changed') == UNTESTED
+    assert cached_mutation_status('foo.py', ids[1], 'h') == OK_KILLED
+    assert cached_killed_by('foo.py', ids[1]) == 'tests/test_foo.py::test_b'
+    assert sorted(get_mutant_pks('foo.py', ids).values()) == [1, 2]
+
+    # a line inserted above moves the cached results with their lines
+    cache_in_tmpdir.join('foo.py').write('c = 3\na = 1\nb = 2\n')
+    assert update_line_numbers('foo.py') == [0]
+    moved = [RelativeMutationID(line=x.line, index=x.index, line_number=x.line_number + 1) for x in ids]
+    assert get_cached_mutation_statuses('foo.py', moved, {x: 'h' for x in moved}) == {
+        moved[0]: BAD_SURVIVED, moved[1]: OK_KILLED}
+    assert get_cached_mutants('foo.py', moved, {x: 'h' for x in moved}) == {
+        moved[0]: (BAD_SURVIVED, None), moved[1]: (OK_KILLED, 'tests/test_foo.py::test_b')}
+
+    assert invalidate_mutants('foo.py', moved) == 2
+    assert cached_mutation_status('foo.py', moved[1], 'h') == UNTESTED
+    assert cached_killed_by('foo.py', moved[1]) == 'tests/test_foo.py::test_b'
+
+    with sqlite3.connect('.mutmut-cache') as connection:
+        assert connection.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+
+
+def test_version_5_cache_is_migrated(cache_in_tmpdir):
+    cache_in_tmpdir.join('foo.py').write('a = 1\n')
+    mutation_id = RelativeMutationID(line='a = 1', index=0, line_number=0)
+    update_line_numbers('foo.py')
+    register_mutants({'foo.py': [mutation_id]})
+    update_mutant_status('foo.py', mutation_id, BAD_SURVIVED, 'h')
+
+    # what a cache of version 5 looked like
+    with sqlite3.connect('.mutmut-cache') as connection:
+        for index in ['idx_sourcefile__filename', 'idx_line__sourcefile_line_line_number', 'idx_mutant__line_index',
+                      'idx_mutant__status']:
+            connection.execute('DROP INDEX {}'.format(index))
+        connection.execute("UPDATE MiscData SET value = '5' WHERE key = 'version'")
+    mutmut.cache.db.provider = None
+    mutmut.cache.db.schema = None
+
+    assert cached_mutation_status('foo.py', mutation_id, 'h') == BAD_SURVIVED
+    with sqlite3.connect('.mutmut-cache') as connection:
+        assert connection.execute("SELECT value FROM MiscData WHERE key = 'version'").fetchone() == (
+            str(current_db_version),)
+        assert 'idx_mutant__line_index' in {x for x, in connection.execute("SELECT name FROM sqlite_master")}
+
+
+def test_main_queries_use_indexes(cache_in_tmpdir):
+    plans = explain_queries()
+    assert 'USING INDEX' in plans
+    assert 'SCAN' not in plans
+
+
+def test_merged_result_tested_last_wins(cache_in_tmpdir):
+    cache_in_tmpdir.join('foo.py').write('a = 1\nb = 2\n')
+    ids = [RelativeMutationID(line='a = 1', index=0, line_number=0), RelativeMutationID(line='b = 2', index=0, line_number=1)]
+    update_line_numbers('foo.py')
+    register_mutants({'foo.py': ids})
+    update_mutant_status('foo.py', ids[0], BAD_SURVIVED, 'all tests')
+    update_mutant_status('foo.py', ids[1], OK_KILLED, 'tests of b')
+
+    # with --use-coverage each mutant is tested against the hash of the tests that cover it
+    with sqlite3.connect('.mutmut-cache') as connection, sqlite3.connect('other-cache') as other:
+        connection.backup(other)
+        connection.execute("UPDATE Mutant SET tested_at = 1 WHERE id = 1")
+        other.execute("UPDATE Mutant SET status = ?, tested_against_hash = 'tests of a', tested_at = 2 WHERE id = 1",
+                      (OK_KILLED,))
+        other.execute("UPDATE Mutant SET status = ?, tested_against_hash = 'all tests', tested_at = 1 WHERE id = 2",
+                      (BAD_SURVIVED,))
+
+    assert merge_caches(['other-cache']) == 2
+    assert cached_mutation_status('foo.py', ids[0], 'tests of a') == OK_KILLED
+    assert cached_mutation_status('foo.py', ids[1], 'tests of b') == OK_KILLED
+
+
+def test_test_durations_relative_to_another_rootdir(cache_in_tmpdir):
+    cache_in_tmpdir.mkdir('tests').join('test_foo.py').write('def test_foo():\n    pass\n')
+    # pytest found its rootdir above the current directory
+    node_id = cache_in_tmpdir.basename + '/tests/test_foo.py'
+    set_cached_test_durations({node_id: 1.0, node_id + '::test_foo': 1.0}, rootdir=str(cache_in_tmpdir.dirpath()))
+    assert untimed_test_files(['tests']) == []
+    assert cached_test_durations() == {node_id + '::test_foo': 1.0}
@@ -0,0 +1,93 @@
+import sqlite3
+
+import pytest
+
+import mutmut.cache
+from mutmut import RelativeMutationID, BAD_SURVIVED, OK_KILLED, UNTESTED
+from mutmut.cache import current_db_version, get_cached_mutants, update_line_numbers
+from mutmut.cache_migrations import migrate_cache, version_of_cache
+
+SOURCE = 'a = 1\nb = 2\n'
+
+
+def create_old_cache(filename, version):
+    """A cache like the mutmut of ``version`` left it, with a survivor on the first line and a killed mutant on
+    the second"""
+    line_number = ', "line_number" INTEGER NOT NULL' if version >= 2 else ''
+    hash = ', "hash" TEXT NOT NULL' if version >= 3 else ''
+    killed_by = ', "killed_by" TEXT NOT NULL' if version >= 5 else ''
+    with sqlite3.connect(filename) as connection:
+        connection.executescript('''
+            CREATE TABLE "SourceFile" ("id" INTEGER PRIMARY KEY AUTOINCREMENT, "filename" TEXT NOT NULL{hash});
+            CREATE TABLE "Line" (
+              "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+              "sourcefile" INTEGER NOT NULL REFERENCES "SourceFile" ("id") ON DELETE CASCADE,
+              "line" TEXT NOT NULL{line_number}
+            );
+            CREATE INDEX "idx_line__sourcefile" ON "Line" ("sourcefile");
+            CREATE TABLE "Mutant" (
+              "id" INTEGER PRIMARY KEY AUTOINCREMENT,
+              "line" INTEGER NOT NULL REFERENCES "Line" ("id") ON DELETE CASCADE,
+              "index" INTEGER NOT NULL,
+              "tested_against_hash" TEXT NOT NULL,
+              "status" TEXT NOT NULL{killed_by}
+            );
+            CREATE INDEX "idx_mutant__line" ON "Mutant" ("line");
+        '''.format(line_number=line_number, hash=hash, killed_by=killed_by))
+        if version >= 6:
+            connection.executescript('''
+                CREATE INDEX "idx_sourcefile__filename" ON "SourceFile" ("filename");
+                CREATE INDEX "idx_line__sourcefile_line_line_number" ON "Line" ("sourcefile", "line", "line_number");
+                CREATE INDEX "idx_mutant__line_index" ON "Mutant" ("line", "index");
+                CREATE INDEX "idx_mutant__status" ON "Mutant" ("status");
+            ''')
+        if version >= 2:
+            connection.execute('CREATE TABLE "MiscData" ("key" TEXT NOT NULL PRIMARY KEY, "value" TEXT NOT NULL)')
+            connection.execute("INSERT INTO MiscData (key, value) VALUES ('version', ?)", (str(version),))
+
+        connection.execute('INSERT INTO SourceFile (filename{}) VALUES (?{})'.format(
+            ', hash' if version >= 3 else '', ', ?' if version >= 3 else ''),
+            ('foo.py', 'stale') if version >= 3 else ('foo.py',))
+        for i, line in enumerate(SOURCE.splitlines()):
+            if version >= 2:
+                connection.execute('INSERT INTO Line (sourcefile, line, line_number) VALUES (1, ?, ?)', (line, i))
+            else:
+                connection.execute('INSERT INTO Line (sourcefile, line) VALUES (1, ?)', (line,))
+        for line, status in [(1, BAD_SURVIVED), (2, OK_KILLED)]:
+            connection.execute(
+                'INSERT INTO Mutant (line, "index", tested_against_hash, status{}) VALUES (?, 0, ?, ?{})'.format(
+                    ', killed_by' if version >= 5 else '', ', \'\'' if version >= 5 else ''),
+                (line, 'hash of tests', status))
+
+
+@pytest.fixture
+def in_tmpdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('foo.py').write(SOURCE)
+    yield tmpdir
+    mutmut.cache.db.provider = None
+    mutmut.cache.db.schema = None
+
+
+@pytest.mark.parametrize('version', range(1, current_db_version))
+def test_old_caches_keep_their_results(in_tmpdir, version):
+    create_old_cache('.mutmut-cache', version)
+
+    update_line_numbers('foo.py')
+    ids = [RelativeMutationID(line=line, index=0, line_number=i) for i, line in enumerate(SOURCE.splitlines())]
+    assert get_cached_mutants('foo.py', ids, {x: 'hash of tests' for x in ids}) == {
+        ids[0]: (BAD_SURVIVED, None),
+        ids[1]: (OK_KILLED, None),
+    }
+    # tested against other tests
+    assert get_cached_mutants('foo.py', ids, {x: 'other' for x in ids})[ids[0]] == (UNTESTED, None)
+
+    with sqlite3.connect('.mutmut-cache') as connection:
+        assert version_of_cache(connection) == current_db_version
+
+
+def test_caches_of_newer_versions_are_not_migrated(in_tmpdir):
+    create_old_cache('cache', 5)
+    with sqlite3.connect('cache') as connection:
+        connection.execute("UPDATE MiscData SET value = ? WHERE key = 'version'", (str(current_db_version + 1),))
+    assert not migrate_cache('cache', current_db_version)
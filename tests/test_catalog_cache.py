@@ -0,0 +1,67 @@
+import hashlib
+import os
+
+import pytest
+
+import mutmut
+from mutmut import catalog_cache, list_mutations_of_file
+from mutmut.catalog_cache import catalog_of_source, evict_catalogs, catalog_cache_directory
+
+SOURCE = 'def foo(a, b):\n    return a < b\n'
+
+
+@pytest.fixture
+def in_tmpdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    yield tmpdir
+
+
+def test_catalog_is_read_back_without_parsing(in_tmpdir, monkeypatch):
+    catalog = catalog_of_source(SOURCE, 'foo.py', [])
+    assert catalog
+
+    def fail(context):
+        assert False, 'parsed again'
+
+    monkeypatch.setattr(catalog_cache, 'catalog_mutations', fail)
+    cached = catalog_of_source(SOURCE, 'foo.py', [])
+    assert cached == catalog
+    assert {x.filename for x in cached} == {'foo.py'}
+
+    # the cached catalog was made for other dict synonyms
+    with pytest.raises(AssertionError):
+        catalog_of_source(SOURCE, 'foo.py', ['Struct'])
+
+
+def test_least_recently_used_catalogs_are_evicted(in_tmpdir):
+    sources = ['x = {}\n'.format(i) for i in range(3)]
+    paths = []
+    for i, source in enumerate(sources):
+        catalog_of_source(source, 'foo.py', [])
+        paths.append(os.path.join(catalog_cache_directory(), hashlib.sha256(source.encode()).hexdigest() + '.json'))
+        os.utime(paths[-1], (i, i))
+
+    # reading the oldest makes it the most recently used
+    catalog_of_source(sources[0], 'foo.py', [])
+    evict_catalogs(catalog_cache_directory(), size=sum(os.path.getsize(x) for x in paths) - 1)
+    assert [os.path.exists(x) for x in paths] == [True, False, True]
+
+
+def test_mutations_of_unchanged_files_are_not_listed_again(in_tmpdir, monkeypatch):
+    in_tmpdir.join('foo.py').write(SOURCE)
+    catalog = {}
+    mutations = list_mutations_of_file('foo.py', [], None, catalog)
+    assert mutations and set(catalog) == set(mutations)
+
+    def fail(context):
+        assert False, 'parsed again'
+
+    monkeypatch.setattr(mutmut, 'list_mutations', fail)
+    monkeypatch.setattr(catalog_cache, 'catalog_mutations', fail)
+    cached_catalog = {}
+    assert list_mutations_of_file('foo.py', [], None, cached_catalog) == mutations
+    assert cached_catalog == catalog
+
+    in_tmpdir.join('foo.py').write(SOURCE.replace('<', '>'))
+    with pytest.raises(RuntimeError):
+        list_mutations_of_file('foo.py', [], None)
@@ -0,0 +1,42 @@
+from multiprocessing.connection import Client
+from queue import Queue
+from threading import Thread
+from types import SimpleNamespace
+
+import pytest
+
+from mutmut.distributed import Coordinator, parse_address
+
+
+def test_parse_address():
+    assert parse_address('example.com:7770') == ('example.com', 7770)
+    assert parse_address(':7770') == ('localhost', 7770)
+    with pytest.raises(ValueError):
+        parse_address('example.com')
+
+
+def test_mutants_of_a_lost_worker_go_to_the_next_one():
+    coordinator = Coordinator(('localhost', 0), authkey=b'secret')
+    results_queue = Queue()
+    Thread(target=coordinator._accept, args=(results_queue,), daemon=True).start()
+    context = SimpleNamespace(filename='foo.py', mutation_id='foo-0')
+    coordinator._todo.put(context)
+    coordinator._pending = 1
+    coordinator._all_queued = True
+
+    try:
+        lost = Client(coordinator.address, authkey=b'secret')
+        lost.send(('hello', 1))
+        assert lost.recv() == ('mutant', 0, context)
+        lost.close()
+
+        worker = Client(coordinator.address, authkey=b'secret')
+        worker.send(('hello', 1))
+        assert worker.recv() == ('mutant', 0, context)
+        worker.send(('status', 0, 'ok_killed', 'tests/test_foo.py::test_foo'))
+        assert worker.recv() == ('quit',)
+        worker.close()
+    finally:
+        coordinator.listener.close()
+
+    assert results_queue.get() == ('status', 'ok_killed', 'foo.py', 'foo-0', 'tests/test_foo.py::test_foo')
@@ -0,0 +1,44 @@
+import sys
+
+import pytest
+
+from mutmut.import_hook import find_module, mutant_imported
+
+
+@pytest.fixture
+def package(tmpdir, monkeypatch):
+    (tmpdir / 'hooked_package').mkdir()
+    (tmpdir / 'hooked_package' / '__init__.py').write('')
+    (tmpdir / 'hooked_package' / 'foo.py').write('value = 1\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    yield str(tmpdir / 'hooked_package' / 'foo.py')
+    for name in ['hooked_package.foo', 'hooked_package']:
+        sys.modules.pop(name, None)
+
+
+def test_mutant_imported(package):
+    with mutant_imported(package, 'value = 2\n'):
+        from hooked_package import foo
+        assert foo.value == 2
+        assert find_module(package) is foo
+
+    with open(package) as f:
+        assert f.read() == 'value = 1\n'
+    assert find_module(package) is None
+    import hooked_package
+    assert not hasattr(hooked_package, 'foo')
+
+    from hooked_package import foo
+    assert foo.value == 1
+
+
+def test_mutant_imported_hides_module_that_was_already_imported(package):
+    from hooked_package import foo as original
+
+    with mutant_imported(package, 'value = 2\n'):
+        from hooked_package import foo
+        assert foo is not original
+        assert foo.value == 2
+
+    from hooked_package import foo
+    assert foo is original
@@ -2,6 +2,7 @@
 import os
 from pathlib import Path
 from time import sleep
+import pytest
 from pytest import raises, fixture
 from unittest.mock import MagicMock, patch
 from shutil import move
@@ -16,7 +17,15 @@ from mutmut import (
     read_patch_data,
     OK_KILLED,
     Context,
-    mutate)
+    RelativeMutationID,
+    mutate,
+    select_tests_for_mutant,
+    failed_test_in,
+    mutant_timeout,
+    shard_of,
+    list_mutations_of_files,
+    hash_of_tests_of_mutant,
+    mutants_depending_on_lines)
 
 
 def test_mutate_file_backup():
@@ -74,12 +83,17 @@ def check_mutants_stub(**kwargs):
 
 class ConfigStub:
     hash_of_tests = None
+    test_command = 'python -m pytest'
+    schemata = False
+    runner_mode = 'subprocess'
+    worker_processes = False
+    hashes_of_test_files = None
 config_stub = ConfigStub()
 
-def test_run_mutation_tests_thread_synchronization(monkeypatch):
+def test_run_mutation_tests_thread_synchronization(monkeypatch, tmpdir):
     # arrange
+    monkeypatch.chdir(tmpdir)
     total_mutants = 3
-    cycle_process_after = 1
     max_workers = 2
 
     def queue_mutants_stub(**kwargs):
@@ -88,12 +102,11 @@ def test_run_mutation_tests_thread_synchronization(monkeypatch):
         kwargs['mutants_queue'].put(('end', None))
     monkeypatch.setattr('mutmut.queue_mutants', queue_mutants_stub)
 
-    def update_mutant_status_stub(**_):
+    def update_mutant_statuses_stub(_):
         sleep(0.1)
 
     monkeypatch.setattr('mutmut.check_mutants', check_mutants_stub)
-    monkeypatch.setattr('mutmut.cache.update_mutant_status', update_mutant_status_stub)
-    monkeypatch.setattr('mutmut.CYCLE_PROCESS_AFTER', cycle_process_after)
+    monkeypatch.setattr('mutmut.cache.update_mutant_statuses', update_mutant_statuses_stub)
 
     progress_mock = MagicMock()
     progress_mock.registered_mutants = 0
@@ -212,3 +225,139 @@ def test_read_patch_data_mutliple_files(testpatches_path: Path):
 
     # assert
     assert actual_changes == expected_changes
+
+
+class SelectTestsConfigStub:
+    select_tests = True
+
+    def __init__(self, contexts):
+        self.coverage_data = {os.path.abspath('foo.py'): {2: contexts}}
+
+
+@pytest.mark.parametrize('contexts, expected', [
+    (['tests/test_foo.py::test_b|run', 'tests/test_foo.py::test_a|setup', 'tests/test_foo.py::test_a|run'],
+     ['tests/test_foo.py::test_a', 'tests/test_foo.py::test_b']),
+    # executed outside of a test, e.g. at import time
+    (['', 'tests/test_foo.py::test_a|run'], None),
+    # not pytest node ids
+    (['tests.test_foo.test_a'], None),
+    ([], None),
+])
+def test_tests_for_mutant(contexts, expected):
+    context = Context(filename='foo.py', mutation_id=RelativeMutationID(line='    return a < b', index=0, line_number=1))
+    assert select_tests_for_mutant(SelectTestsConfigStub(contexts), context) == expected
+
+
+def test_mutants_depending_on_lines():
+    config = SelectTestsConfigStub(['tests/test_foo.py::test_a|run'])
+    config.coverage_data[os.path.abspath('foo.py')].update({
+        4: ['tests/test_foo.py::test_b|run'],
+        6: ['tests/test_foo.py::test_a|run', 'tests/test_foo.py::test_b|run'],
+        8: ['', 'tests/test_foo.py::test_a|run'],
+    })
+    a, b = [RelativeMutationID(line='    return a < b', index=0, line_number=x) for x in (1, 3)]
+    mutations_by_file = {'foo.py': [a, b]}
+
+    assert mutants_depending_on_lines(config, mutations_by_file, {'foo.py': [5]}) == {'foo.py': [a, b]}
+    assert mutants_depending_on_lines(config, mutations_by_file, {'foo.py': [3]}) == {'foo.py': [b]}
+    # no test runs it
+    assert mutants_depending_on_lines(config, mutations_by_file, {'foo.py': [9]}) == {}
+    # code outside of tests ran it, so any test may depend on it
+    assert mutants_depending_on_lines(config, mutations_by_file, {'foo.py': [7]}) == {'foo.py': [a, b]}
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('FAILED tests/test_foo.py::test_foo - assert 1 == 2\r\n', 'tests/test_foo.py::test_foo'),
+    ('\x1b[31mFAILED\x1b[0m tests/test_foo.py::test_foo[a-b] - assert False\n', 'tests/test_foo.py::test_foo[a-b]'),
+    ('FAILED tests/test_foo.py::test_foo\n', 'tests/test_foo.py::test_foo'),
+    ('tests/test_foo.py F                                  [100%]\n', None),
+    ('FAILED (failures=1)\n', None),
+])
+def test_failed_test_in(line, expected):
+    assert failed_test_in(line) == expected
+
+
+class TimeoutConfigStub:
+    baseline_time_elapsed = 3.0
+    timeout_multiplier = 10.0
+    timeout_floor = 1.0
+
+    def __init__(self, test_durations=None, runner_mode='subprocess'):
+        self.test_durations = test_durations
+        self.runner_mode = runner_mode
+
+
+@pytest.mark.parametrize('config, tests, expected', [
+    (TimeoutConfigStub(), None, 30.0),
+    (TimeoutConfigStub(), ['test_a'], 30.0),
+    # 2 seconds of the baseline run were starting up
+    (TimeoutConfigStub({'test_a': 0.5, 'test_b': 0.5}), ['test_a'], 25.0),
+    (TimeoutConfigStub({'test_a': 0.5, 'test_b': 0.5}), None, 30.0),
+    # no duration for test_c, so expect all the tests
+    (TimeoutConfigStub({'test_a': 0.5, 'test_b': 0.5}), ['test_a', 'test_c'], 30.0),
+    # a session that's already running doesn't start up again
+    (TimeoutConfigStub({'test_a': 0.5, 'test_b': 0.5}, runner_mode='fork'), ['test_a'], 5.0),
+    (TimeoutConfigStub({'test_a': 0.01, 'test_b': 0.5}, runner_mode='pool'), ['test_a'], 1.0),
+])
+def test_mutant_timeout(config, tests, expected):
+    assert mutant_timeout(config, tests) == pytest.approx(expected)
+
+
+def test_shard_of():
+    mutation_ids = [RelativeMutationID(line='    return a < b', index=i, line_number=1) for i in range(4)]
+    # must not change between runs or versions, or shards would overlap
+    assert [shard_of('foo.py', x, 4) for x in mutation_ids] == [2, 3, 1, 2]
+    assert shard_of('foo.py', mutation_ids[0], 1) == 1
+    # the primary key plays no part
+    assert shard_of('foo.py', RelativeMutationID(line='    return a < b', index=0, line_number=1, filename='x'), 4) == 2
+
+
+def test_list_mutations_of_files_in_processes(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    filenames = []
+    for i in range(3):
+        filename = str(tmpdir.join('foo{}.py'.format(i)))
+        with open(filename, 'w') as f:
+            f.write('def foo(a, b):\n    return a < b + {}\n'.format(i))
+        filenames.append(filename)
+
+    import concurrent.futures
+    start_methods = []
+    process_pool_executor = concurrent.futures.ProcessPoolExecutor
+
+    def recording_executor(*args, mp_context, **kwargs):
+        start_methods.append(mp_context.get_start_method())
+        return process_pool_executor(*args, mp_context=mp_context, **kwargs)
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', recording_executor)
+
+    in_processes = list(list_mutations_of_files(filenames, [], None, max_workers=2))
+    assert start_methods == ['spawn']
+    assert [filename for filename, _, _ in in_processes] == filenames
+    assert in_processes == list(list_mutations_of_files(filenames, [], None))
+    assert all(mutations and list(catalog) == mutations for _, mutations, catalog in in_processes)
+
+
+def test_hash_of_tests_of_mutant_only_depends_on_covering_test_files():
+    config = SelectTestsConfigStub(['tests/test_foo.py::test_a|run'])
+    config.hash_of_tests = 'all'
+    config.hashes_of_test_files = {
+        os.path.normpath('tests/test_foo.py'): 'foo',
+        os.path.normpath('tests/test_bar.py'): 'bar',
+        os.path.normpath('tests/helpers.py'): 'helpers',
+    }
+    mutation_id = RelativeMutationID(line='    return a < b', index=0, line_number=1)
+    before = hash_of_tests_of_mutant(config, 'foo.py', mutation_id)
+    assert before != 'all'
+
+    config.hashes_of_test_files[os.path.normpath('tests/test_bar.py')] = 'changed'
+    assert hash_of_tests_of_mutant(config, 'foo.py', mutation_id) == before
+
+    for changed in ['tests/test_foo.py', 'tests/helpers.py']:
+        hashes = dict(config.hashes_of_test_files)
+        config.hashes_of_test_files[os.path.normpath(changed)] = 'changed'
+        assert hash_of_tests_of_mutant(config, 'foo.py', mutation_id) != before
+        config.hashes_of_test_files = hashes
+
+    # a line no test covers depends on all of them
+    other_line = RelativeMutationID(line='    return a', index=0, line_number=5)
+    assert hash_of_tests_of_mutant(config, 'foo.py', other_line) == 'all'
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 
 import os
+import shutil
+import sqlite3
 import subprocess
 import sys
+import tempfile
 import xml.etree.ElementTree as ET
+from types import SimpleNamespace
 from os import (
     mkdir,
 )
@@ -28,6 +32,7 @@ from mutmut import (
     __version__,
 )
 from mutmut.__main__ import climain
+from mutmut.mutation_test_runner import MutationTestRunner
 
 file_to_mutate_lines = [
     "def foo(a, b):",
@@ -385,6 +390,22 @@ Survived 🙁 (14)
 """.strip()
 
 
+def test_pre_mutation_ast_hook_sees_the_mutant_under_test(filesystem, monkeypatch):
+    def pre_mutation_ast(context):
+        # skips the node when testing its mutant, not when listing the mutants
+        if context.mutation_id == context.mutation_id_of_current_index and \
+                context.current_source_line == '    return a < b':
+            context.config.mutation_types_to_apply = set()
+
+    monkeypatch.setattr('mutmut.mutmut_config', SimpleNamespace(pre_mutation_ast=pre_mutation_ast))
+    CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--max-workers=1"],
+                       catch_exceptions=False)
+
+    # the tests pass on the code the hook left as it was
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert result.output.split() == ['1']
+
+
 def test_full_run_one_surviving_mutant(filesystem):
     with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
         f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
@@ -414,6 +435,434 @@ def test_full_run_one_surviving_mutant_multiworkers(filesystem):
     assert "To apply a mutant on disk" in result.output.strip()
 
 
+def test_full_run_one_surviving_mutant_sandbox(filesystem):
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--max-workers=3",
+                                          "--sandbox", "--runner=python -m pytest -x"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 2
+    with open(os.path.join(str(filesystem), 'foo.py')) as f:
+        assert f.read() == file_to_mutate_contents
+    assert not glob.glob(os.path.join(str(filesystem), 'foo.py.*.bak'))
+
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert result.output.strip() == '1'
+
+
+def test_full_run_one_surviving_mutant_schemata(filesystem):
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--max-workers=3",
+                                          "--schemata", "--runner=python -m pytest -x"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 2
+    with open(os.path.join(str(filesystem), 'foo.py')) as f:
+        assert f.read() == file_to_mutate_contents
+    assert not glob.glob(os.path.join(tempfile.gettempdir(), 'mutmut-schemata-*', '*_foo.py'))
+
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert result.output.strip() == '1'
+
+
+def test_full_run_fork_server(filesystem):
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--max-workers=3",
+                                          "--runner-mode=fork", "--runner=python -m pytest -x"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 2
+    with open(os.path.join(str(filesystem), 'foo.py')) as f:
+        assert f.read() == file_to_mutate_contents
+    assert not glob.glob(os.path.join(str(filesystem), 'foo.py.*.bak'))
+
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert result.output.strip() == '1'
+
+
+def test_full_run_worker_pool(filesystem):
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--max-workers=2",
+                                          "--runner-mode=pool", "--recycle-after=3", "--runner=python -m pytest -x"],
+                                catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 2
+    with open(os.path.join(str(filesystem), 'foo.py')) as f:
+        assert f.read() == file_to_mutate_contents
+
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert result.output.strip() == '1'
+
+
+def test_full_run_select_tests(filesystem):
+    with open(os.path.join(str(filesystem), "foo.py"), 'w') as f:
+        f.write("def foo(a, b):\n    return a < b\n")
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write("""
+from foo import foo
+
+def test_foo():
+    assert foo(1, 2) is True
+    assert foo(2, 2) is False
+
+def test_unrelated():
+    with open('unrelated_ran', 'a') as f:
+        f.write('x')
+""")
+    subprocess.run([sys.executable, "-m", "pytest", "--cov=.", "--cov-context=test", "-p", "no:cacheprovider"],
+                   stdout=subprocess.DEVNULL)
+    assert os.path.isfile('.coverage')
+    os.unlink('unrelated_ran')
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--use-coverage",
+                                          "--select-tests", "--runner=python -m pytest -x"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 0
+    # only the baseline ran test_unrelated, the mutant only ran test_foo
+    with open('unrelated_ran') as f:
+        assert f.read() == 'x'
+
+
+@pytest.mark.parametrize('runner_mode', ['subprocess', 'fork', 'pool'])
+def test_full_run_select_tests_renamed_since_coverage(filesystem, runner_mode):
+    with open(os.path.join(str(filesystem), "foo.py"), 'w') as f:
+        f.write("def foo(a, b):\n    return a < b\n")
+    test_foo = os.path.join(str(filesystem), "tests", "test_foo.py")
+    with open(test_foo, 'w') as f:
+        f.write("from foo import foo\n\ndef test_old():\n    assert foo(1, 2) is True\n    assert foo(2, 2) is False\n")
+    subprocess.run([sys.executable, "-m", "pytest", "--cov=.", "--cov-context=test", "-p", "no:cacheprovider"],
+                   stdout=subprocess.DEVNULL)
+    with open(test_foo) as f:
+        renamed = f.read().replace('test_old', 'test_new')
+    with open(test_foo, 'w') as f:
+        f.write(renamed)
+
+    # the coverage contexts only know test_old, so the mutant is tested by all the tests instead
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--use-coverage",
+                                          "--select-tests", "--runner-mode=" + runner_mode,
+                                          "--runner=python -m pytest -x"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 0
+    result = CliRunner().invoke(climain, ['result-ids', 'killed'], catch_exceptions=False)
+    assert result.output.strip() == '1'
+
+
+def test_full_run_retests_mutants_whose_tests_run_changed_code(filesystem):
+    with open(os.path.join(str(filesystem), "foo.py"), 'w') as f:
+        f.write("from bar import bar\n\ndef foo(a, b):\n    return bar(a) < b\n\ndef baz(a):\n    return a + 1\n")
+    with open(os.path.join(str(filesystem), "bar.py"), 'w') as f:
+        f.write("def bar(a):\n    return a\n")
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write("""
+from foo import foo, baz
+
+def test_foo():
+    assert foo(1, 2) is True
+    assert foo(2, 2) is False
+
+def test_baz():
+    assert baz(1) == 2
+""")
+
+    def run():
+        subprocess.run([sys.executable, "-m", "pytest", "--cov=.", "--cov-context=test", "-p", "no:cacheprovider"],
+                       stdout=subprocess.DEVNULL)
+        result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py,bar.py', "--test-time-base=15.0",
+                                              "--use-coverage"], catch_exceptions=False)
+        print(repr(result.output))
+        assert result.exit_code == 0
+        return result.output
+
+    assert 'tested again' not in run()
+
+    # only test_foo runs the changed lines of bar, so the mutants of baz keep their results
+    with open(os.path.join(str(filesystem), "bar.py"), 'w') as f:
+        f.write("def bar(a):\n    b = a\n    return b\n")
+    assert '1 cached results are tested again' in run()
+
+
+@pytest.mark.parametrize('runner_mode', ['subprocess', 'fork', 'pool'])
+def test_full_run_replays_killer_first(filesystem, runner_mode):
+    with open(os.path.join(str(filesystem), "foo.py"), 'w') as f:
+        f.write("def foo(a, b):\n    return a < b\n")
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write("""
+from foo import foo
+
+def test_unrelated():
+    with open('unrelated_ran', 'a') as f:
+        f.write('x')
+
+def test_foo():
+    assert foo(1, 2) is True
+    assert foo(2, 2) is False
+""")
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0",
+                                          "--runner-mode=" + runner_mode,
+                                          "--runner=python -m pytest -x -p no:cacheprovider"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 0
+
+    from mutmut.cache import cached_killed_by, filename_and_mutation_id_from_pk
+    filename, mutation_id = filename_and_mutation_id_from_pk(1)
+    assert cached_killed_by(filename, mutation_id) == 'tests/test_foo.py::test_foo'
+
+    os.unlink('unrelated_ran')
+    result = CliRunner().invoke(climain, ['run', '1', '--paths-to-mutate=foo.py', "--test-time-base=15.0",
+                                          "--runner-mode=" + runner_mode,
+                                          "--runner=python -m pytest -x -p no:cacheprovider"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 0
+    # the baseline time was cached, and the mutant was killed by test_foo alone
+    assert not os.path.exists('unrelated_ran')
+
+
+def test_full_run_records_test_durations(filesystem):
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0",
+                                          "--max-workers=1", "--runner=python -m pytest -x"], catch_exceptions=False)
+    assert result.exit_code == 0
+    from mutmut.cache import cached_test_durations
+    # nothing uses them
+    assert cached_test_durations() is None
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", '--time-tests',
+                                          "--max-workers=1", "--runner=python -m pytest -x"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 0
+
+    durations = cached_test_durations()
+    assert list(durations) == ['tests/test_foo.py::test_foo']
+    assert durations['tests/test_foo.py::test_foo'] >= 0
+
+
+def test_test_durations_are_invalidated_per_test_file(filesystem):
+    with open(os.path.join(str(filesystem), "tests", "test_bar.py"), 'w') as f:
+        f.write("def test_bar():\n    pass\n")
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", '--time-tests',
+                                          "--runner=python -m pytest -x"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 0
+
+    from mutmut.cache import cached_test_durations, untimed_test_files
+    with open(os.path.join(str(filesystem), "tests", "test_bar.py"), 'a') as f:
+        f.write("\ndef test_baz():\n    pass\n")
+    assert untimed_test_files(['tests/']) == [os.path.join('tests', 'test_bar.py')]
+    assert list(cached_test_durations()) == ['tests/test_foo.py::test_foo']
+
+    MutationTestRunner.time_tests('python -m pytest -x', ['tests/'], swallow_output=True, no_progress=True)
+    assert untimed_test_files(['tests/']) == []
+    assert sorted(cached_test_durations()) == [
+        'tests/test_bar.py::test_bar', 'tests/test_bar.py::test_baz', 'tests/test_foo.py::test_foo']
+
+
+def test_time_tests_needs_pytest(filesystem):
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', '--time-tests',
+                                          '--runner=python -m hammett -x'])
+    assert result.exit_code == 2
+    assert "--time-tests needs a pytest runner" in result.output
+
+
+def test_full_run_shards(filesystem):
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+
+    import mutmut.cache
+    killed, survived = 0, 0
+    try:
+        for shard in ['1/3', '2/3', '3/3']:
+            result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0",
+                                                  "--max-workers=1", '--shard', shard], catch_exceptions=False)
+            print(repr(result.output))
+            assert result.exit_code in (0, 2)
+            killed += len(CliRunner().invoke(climain, ['result-ids', 'killed']).output.split())
+            survived += len(CliRunner().invoke(climain, ['result-ids', 'survived']).output.split())
+            assert os.path.exists('.mutmut-cache-shard-{}-of-3'.format(shard[0]))
+            # the next shard binds its own cache file
+            mutmut.cache.db.provider = None
+            mutmut.cache.db.schema = None
+    finally:
+        mutmut.cache.use_cache_file(mutmut.cache.DEFAULT_CACHE_FILENAME)
+
+    assert not os.path.exists('.mutmut-cache')
+    assert (killed, survived) == (EXPECTED_MUTANTS - 1, 1)
+
+
+def test_merge_shard_caches(filesystem):
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+
+    import mutmut.cache
+    try:
+        for shard in ['1/2', '2/2']:
+            CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0",
+                                         "--max-workers=1", '--shard', shard], catch_exceptions=False)
+            mutmut.cache.db.provider = None
+            mutmut.cache.db.schema = None
+    finally:
+        mutmut.cache.use_cache_file(mutmut.cache.DEFAULT_CACHE_FILENAME)
+
+    # a stale result for every mutant of shard 1, which must not win over the current ones
+    stale = sqlite3.connect('stale-cache')
+    with sqlite3.connect('.mutmut-cache-shard-1-of-2') as shard:
+        shard.backup(stale)
+    with stale:
+        stale.execute("UPDATE Mutant SET status = 'bad_survived', tested_against_hash = 'old tests', tested_at = 1")
+    shard_1_mutants, = stale.execute('SELECT COUNT(*) FROM Mutant').fetchone()
+    stale.close()
+
+    result = CliRunner().invoke(climain, ['merge-cache', '.mutmut-cache-shard-1-of-2', '.mutmut-cache-shard-2-of-2',
+                                          'stale-cache'], catch_exceptions=False)
+    assert result.exit_code == 0
+    assert result.output.strip().splitlines()[-1] == 'Merged {} mutants from 3 cache files'.format(EXPECTED_MUTANTS + shard_1_mutants)
+
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert len(result.output.split()) == 1
+    result = CliRunner().invoke(climain, ['result-ids', 'killed'], catch_exceptions=False)
+    assert len(result.output.split()) == EXPECTED_MUTANTS - 1
+
+    # merging is idempotent
+    CliRunner().invoke(climain, ['merge-cache', '.mutmut-cache-shard-2-of-2'], catch_exceptions=False)
+    result = CliRunner().invoke(climain, ['result-ids', 'killed'], catch_exceptions=False)
+    assert len(result.output.split()) == EXPECTED_MUTANTS - 1
+
+
+def test_merge_cache_needs_a_cache_file(filesystem):
+    with open('not-a-cache', 'w') as f:
+        f.write('hello')
+    result = CliRunner().invoke(climain, ['merge-cache', 'not-a-cache'])
+    assert result.exit_code == 2
+    assert "not-a-cache is not a mutmut cache of this version, it can't be merged" in result.output
+
+
+def test_bad_shard(filesystem):
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', '--shard', '4/3'])
+    assert result.exit_code == 2
+    assert 'Expected --shard I/N with 1 <= I <= N, got 4/3' in result.output
+
+
+# hammett tests the mutants in memory, pytest needs a sandbox per worker
+@pytest.mark.parametrize('extra_args', [[], ['--runner=python -m pytest -x', '--sandbox']])
+def test_full_run_worker_processes(filesystem, extra_args):
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--max-workers=2",
+                                          "--worker-processes", "--recycle-after=3"] + extra_args,
+                                catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 2
+    with open(os.path.join(str(filesystem), 'foo.py')) as f:
+        assert f.read() == file_to_mutate_contents
+
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert result.output.strip() == '1'
+    result = CliRunner().invoke(climain, ['result-ids', 'killed'], catch_exceptions=False)
+    assert len(result.output.split()) == EXPECTED_MUTANTS - 1
+
+
+def test_full_run_worker_processes_select_tests(filesystem, monkeypatch):
+    from mutmut.process_pool import ProcessPool
+
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+    subprocess.run([sys.executable, "-m", "pytest", "--cov=.", "--cov-context=test", "-p", "no:cacheprovider"],
+                   stdout=subprocess.DEVNULL)
+
+    sent = []
+    put = ProcessPool._put
+
+    def record_put(self, context):
+        sent.append(context)
+        put(self, context)
+    monkeypatch.setattr(ProcessPool, '_put', record_put)
+
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', "--test-time-base=15.0", "--max-workers=2",
+                                          "--worker-processes", "--use-coverage", "--select-tests",
+                                          "--runner=python -m pytest -x", "--sandbox"], catch_exceptions=False)
+    print(repr(result.output))
+    assert result.exit_code == 2
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert result.output.strip() == '1'
+    # the coverage data and the test durations went to each process once, not with every mutant
+    contexts = [x for x in sent if x is not None]
+    assert contexts and all(x.config is None for x in contexts)
+    assert ['tests/test_foo.py::test_foo'] in [x.selected_tests for x in contexts]
+
+
+def test_full_run_coordinator_with_workers(filesystem, tmpdir_factory):
+    with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
+        f.write(test_file_contents.replace('assert foo(2, 2) is False', ''))
+    # the workers test the mutants in checkouts of their own
+    checkouts = []
+    for name in ['checkout1', 'checkout2']:
+        checkout = str(tmpdir_factory.mktemp(name))
+        shutil.copy(os.path.join(str(filesystem), 'foo.py'), checkout)
+        shutil.copytree(os.path.join(str(filesystem), 'tests'), os.path.join(checkout, 'tests'))
+        checkouts.append(checkout)
+
+    mutmut_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, MUTMUT_AUTHKEY='secret', PYTHONPATH=mutmut_root)
+    coordinator = subprocess.Popen(
+        [sys.executable, '-m', 'mutmut', 'coordinator', '--bind=localhost:0', '--paths-to-mutate=foo.py',
+         '--test-time-base=15.0', '--runner=python -m pytest -x'],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=env, universal_newlines=True,
+    )
+    workers = []
+    try:
+        output = []
+        for line in coordinator.stdout:
+            if line.startswith('Waiting for workers on '):
+                address = line.strip().rpartition(' ')[2]
+                break
+            output.append(line)
+        else:
+            assert False, 'The coordinator exited before listening:\n' + ''.join(output)
+
+        workers = [
+            subprocess.Popen([sys.executable, '-m', 'mutmut', 'worker', '--connect', address, '--max-workers=1'], cwd=checkout, env=env)
+            for checkout in checkouts
+        ]
+        coordinator.stdout.read()
+        assert coordinator.wait(timeout=120) == 2
+        for worker in workers:
+            assert worker.wait(timeout=30) == 0
+    finally:
+        for process in [coordinator] + workers:
+            if process.poll() is None:
+                process.kill()
+
+    with open(os.path.join(str(filesystem), 'foo.py')) as f:
+        assert f.read() == file_to_mutate_contents
+    result = CliRunner().invoke(climain, ['result-ids', 'survived'], catch_exceptions=False)
+    assert result.output.strip() == '1'
+    result = CliRunner().invoke(climain, ['result-ids', 'killed'], catch_exceptions=False)
+    assert len(result.output.split()) == EXPECTED_MUTANTS - 1
+
+
+def test_coordinator_with_hammett_is_rejected(filesystem):
+    result = CliRunner().invoke(climain, ['coordinator', '--authkey=secret', '--paths-to-mutate=foo.py'])
+    assert result.exit_code == 2
+    assert "mutmut coordinator doesn't work with hammett" in result.output
+
+
+def test_select_tests_needs_coverage(filesystem):
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', '--select-tests', '--runner=python -m pytest'])
+    assert result.exit_code == 2
+    assert "--select-tests needs --use-coverage" in result.output
+
+
+def test_sandbox_with_hammett_is_rejected(filesystem):
+    result = CliRunner().invoke(climain, ['run', '--paths-to-mutate=foo.py', '--sandbox'])
+    assert result.exit_code == 2
+    assert "You can't combine --sandbox or --schemata with hammett" in result.output
+
+
 def test_full_run_one_surviving_mutant_junit(filesystem):
     with open(os.path.join(str(filesystem), "tests", "test_foo.py"), 'w') as f:
         f.write(test_file_contents.replace('assert foo(2, 2) is False\n', ''))
@@ -4,7 +4,7 @@ import pytest
 from parso import parse
 
 from mutmut import mutate, ALL, Context, list_mutations, RelativeMutationID, \
-    array_subscript_pattern, function_call_pattern, ASTPattern
+    array_subscript_pattern, function_call_pattern, ASTPattern, catalog_mutations
 
 
 def test_matches_py3():
@@ -391,3 +391,22 @@ def test_bad_mutation_str_type_definition():
 foo: 'SomeType'
     """
     assert mutate(Context(source=source)) == (source, 0)
+
+
+def test_catalog_makes_the_same_mutants_as_mutate():
+    source = """@decorator
+def foo(a, b):
+    x = a + b  # comment
+    if a is not b and not a:
+        return lambda: x
+    y = dict(a=1,
+             b=2)
+    return x"""
+    catalog = catalog_mutations(Context(source=source))
+    mutation_ids = list_mutations(Context(source=source))
+    # list_mutations leaves "dict" mutated to "list", so it misses the mutations of the dict arguments
+    assert set(mutation_ids) < set(catalog)
+    for mutation_id in mutation_ids:
+        context = Context(source=source, mutation_id=mutation_id)
+        context.edit = catalog[mutation_id]
+        assert mutate(context) == mutate(Context(source=source, mutation_id=mutation_id))
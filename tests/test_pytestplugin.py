@@ -0,0 +1,56 @@
+import sys
+
+import pytest
+
+from mutmut.pytestplugin import find_module, swap_module
+
+original = '''
+LIMIT = 10
+
+
+def below_limit(x):
+    return x < LIMIT
+
+
+class Counter:
+    def __init__(self):
+        self.count = 0
+
+    def increment(self):
+        self.count += 1
+        return super().__repr__() and self.count
+'''
+
+
+@pytest.fixture
+def module(tmpdir, monkeypatch):
+    (tmpdir / 'swapped_module.py').write(original)
+    monkeypatch.syspath_prepend(str(tmpdir))
+    import swapped_module
+    yield swapped_module
+    del sys.modules['swapped_module']
+
+
+def test_swap_module_keeps_identities(module):
+    below_limit, Counter, LIMIT = module.below_limit, module.Counter, module.LIMIT
+    counter = Counter()
+    assert find_module(module.__file__) is module
+
+    swap_module(module.__file__, original.replace('LIMIT = 10', 'LIMIT = 11').replace('self.count += 1', 'self.count += 2'))
+
+    # references taken before the swap see the mutant
+    assert below_limit is module.below_limit
+    assert below_limit(10) is True
+    assert Counter is module.Counter
+    assert counter.increment() == 2
+    assert LIMIT == 10 and module.LIMIT == 11
+
+
+def test_swap_module_rebinds_imported_names(module, tmpdir):
+    (tmpdir / 'importer_module.py').write('from swapped_module import LIMIT\n')
+    import importer_module
+    try:
+        swap_module(module.__file__, original.replace('LIMIT = 10', 'LIMIT = 3'))
+        assert importer_module.LIMIT == 3
+    finally:
+        del sys.modules['importer_module']
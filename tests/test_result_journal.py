@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+import mutmut.cache
+from mutmut import RelativeMutationID, UNTESTED, BAD_SURVIVED, OK_KILLED
+from mutmut.cache import update_line_numbers, register_mutants, cached_mutation_status, cached_killed_by, \
+    results_journal_filename
+from mutmut.result_journal import ResultJournal
+
+IDS = [RelativeMutationID(line='a = 1', index=0, line_number=0), RelativeMutationID(line='b = 2', index=0, line_number=1)]
+
+
+def forget_binding():
+    mutmut.cache.db.provider = None
+    mutmut.cache.db.schema = None
+
+
+@pytest.fixture
+def cache_in_tmpdir(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('foo.py').write('a = 1\nb = 2\n')
+    update_line_numbers('foo.py')
+    register_mutants({'foo.py': IDS})
+    yield tmpdir
+    forget_binding()
+
+
+def test_results_are_written_in_batches(cache_in_tmpdir):
+    journal = ResultJournal(results_journal_filename(), flush_every=2, flush_interval=60)
+    journal.record('foo.py', IDS[0], BAD_SURVIVED, 'h')
+    assert cached_mutation_status('foo.py', IDS[0], 'h') == UNTESTED
+    assert os.path.getsize(journal.path)
+
+    journal.record('foo.py', IDS[1], OK_KILLED, 'h', killed_by='tests/test_foo.py::test_b')
+    assert cached_mutation_status('foo.py', IDS[0], 'h') == BAD_SURVIVED
+    assert cached_killed_by('foo.py', IDS[1]) == 'tests/test_foo.py::test_b'
+    assert not os.path.getsize(journal.path)
+
+    journal.close()
+    assert not os.path.exists(journal.path)
+
+
+def test_journal_of_a_killed_run_is_replayed(cache_in_tmpdir):
+    journal = ResultJournal(results_journal_filename(), flush_every=100, flush_interval=60)
+    journal.record('foo.py', IDS[0], BAD_SURVIVED, 'h')
+    journal.record('foo.py', IDS[1], OK_KILLED, 'h')
+    # killed while writing the next result, without closing the journal
+    journal.file.write('["foo.py", "a = 1", 0')
+    journal.file.flush()
+
+    forget_binding()
+    assert cached_mutation_status('foo.py', IDS[0], 'h') == BAD_SURVIVED
+    assert cached_mutation_status('foo.py', IDS[1], 'h') == OK_KILLED
+    assert not os.path.exists(journal.path)
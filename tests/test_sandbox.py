@@ -0,0 +1,107 @@
+import os
+
+import pytest
+
+from mutmut.sandbox import SandboxPool, find_import_roots
+
+
+@pytest.fixture
+def project(tmpdir):
+    (tmpdir / "src").mkdir()
+    (tmpdir / "src" / "pkg").mkdir()
+    (tmpdir / "src" / "pkg" / "__init__.py").write("")
+    (tmpdir / "src" / "pkg" / "foo.py").write("a = 1\n")
+    (tmpdir / "data.txt").write("data")
+    (tmpdir / ".git").mkdir()
+    (tmpdir / ".git" / "HEAD").write("ref")
+    yield str(tmpdir)
+
+
+def test_find_import_roots(project):
+    assert find_import_roots([os.path.join(project, 'src', 'pkg')]) == [os.path.join(project, 'src')]
+    assert find_import_roots([os.path.join(project, 'src', 'pkg', 'foo.py')]) == [os.path.join(project, 'src')]
+
+
+def test_sandbox_write_and_restore(project):
+    pool = SandboxPool(root=project, import_roots=[os.path.join(project, 'src')])
+    filename = os.path.join(project, 'src', 'pkg', 'foo.py')
+    try:
+        with pool.acquire() as sandbox:
+            sandboxed = sandbox.path_of(filename)
+            assert os.path.samefile(sandboxed, filename)
+            assert not os.path.samefile(sandbox.path_of(os.path.join(project, 'data.txt')), os.path.join(project, 'data.txt'))
+            assert not os.path.exists(os.path.join(sandbox.path, '.git'))
+
+            sandbox.write(filename, "a = 2\n")
+            with open(sandboxed) as f:
+                assert f.read() == "a = 2\n"
+            with open(filename) as f:
+                assert f.read() == "a = 1\n"
+
+            sandbox.restore(filename)
+            with open(sandboxed) as f:
+                assert f.read() == "a = 1\n"
+
+            assert sandbox.env({'PYTHONPATH': project})['PYTHONPATH'] == os.pathsep.join([
+                os.path.join(sandbox.path, 'src'),
+                sandbox.path,
+            ])
+
+        # sandboxes are reused once released
+        with pool.acquire() as again:
+            assert again is sandbox
+            with pool.acquire() as other:
+                assert other is not sandbox
+    finally:
+        pool.cleanup()
+
+    assert not os.path.exists(sandbox.path)
+
+
+def test_sandbox_refuses_files_outside_the_project(project, tmpdir_factory):
+    pool = SandboxPool(root=project, import_roots=[])
+    try:
+        with pool.acquire() as sandbox:
+            with pytest.raises(ValueError):
+                sandbox.path_of(str(tmpdir_factory.mktemp('elsewhere') / 'foo.py'))
+    finally:
+        pool.cleanup()
+
+
+def test_sandbox_links_virtualenvs_and_leaves_out_ignored_files(project, tmpdir):
+    (tmpdir / ".venv").mkdir()
+    (tmpdir / ".venv" / "pyvenv.cfg").write("home = /usr/bin\n")
+    (tmpdir / ".venv" / "installed.py").write("b = 1\n")
+    (tmpdir / "node_modules").mkdir()
+    (tmpdir / "node_modules" / "package.json").write("{}")
+    (tmpdir / "build.log").write("log")
+
+    pool = SandboxPool(root=project, import_roots=[], ignore=['*.log'])
+    try:
+        with pool.acquire() as sandbox:
+            venv = os.path.join(sandbox.path, '.venv')
+            assert os.path.islink(venv)
+            assert os.path.samefile(venv, os.path.join(project, '.venv'))
+            assert not os.path.exists(os.path.join(sandbox.path, 'node_modules'))
+            assert not os.path.exists(os.path.join(sandbox.path, 'build.log'))
+            assert os.path.exists(os.path.join(sandbox.path, 'data.txt'))
+    finally:
+        pool.cleanup()
+    # the virtualenv itself is left alone
+    assert os.path.exists(os.path.join(project, '.venv', 'installed.py'))
+
+
+def test_sandbox_leaves_out_the_state_of_mutmut(project, tmpdir):
+    for name in ['.mutmut-cache', '.mutmut-cache-wal', '.mutmut-cache-shm', '.mutmut-cache-results',
+                 '.mutmut-cache-shard-1-of-2']:
+        (tmpdir / name).write("")
+    (tmpdir / ".mutmut-catalogs").mkdir()
+    (tmpdir / ".mutmut-catalogs" / "0123456789abcdef").write("")
+
+    pool = SandboxPool(root=project, import_roots=[])
+    try:
+        with pool.acquire() as sandbox:
+            assert not [x for x in os.listdir(sandbox.path) if x.startswith('.mutmut')]
+            assert os.path.exists(os.path.join(sandbox.path, 'data.txt'))
+    finally:
+        pool.cleanup()
@@ -0,0 +1,93 @@
+import pytest
+
+from mutmut import Context, list_mutations
+from mutmut.schemata import MUTANT_UNDER_TEST, instrument
+
+source = '''"""docstring"""
+from __future__ import annotations
+
+
+def foo(a, b):
+    return a < b
+
+
+class A:
+    def bar(self, x):
+        return x + 1
+
+    @property
+    def baz(self):
+        return 3
+
+
+c = 1
+'''
+
+
+def instrumented():
+    mutations = list_mutations(Context(source=source))
+    result, keys = instrument(source, 'foo.py', [(str(i), x) for i, x in enumerate(mutations)])
+    return mutations, result, keys
+
+
+def test_instrument_only_plain_functions():
+    mutations, result, keys = instrumented()
+    assert sorted(keys.values()) == ['0', '1', '2']
+    assert {x.line.strip() for x in keys} == {'return a < b', 'return x + 1'}
+    # the helper goes after the docstring and __future__ imports
+    assert result.startswith('"""docstring"""\nfrom __future__ import annotations\n\n\nimport os as _mutmut_os\n')
+    assert '    @property\n    def baz(self):\n        return 3\n' in result
+    assert result.endswith('c = 1\n')
+
+
+def test_instrumented_code_selects_mutant_from_environment(monkeypatch):
+    _, result, _ = instrumented()
+    namespace = {}
+    exec(compile(result, 'foo.py', 'exec'), namespace)
+    foo, A = namespace['foo'], namespace['A']
+
+    monkeypatch.delenv(MUTANT_UNDER_TEST, raising=False)
+    assert foo(2, 2) is False
+    assert A().bar(1) == 2
+
+    monkeypatch.setenv(MUTANT_UNDER_TEST, '0')
+    assert foo(2, 2) is True
+    assert A().bar(1) == 2
+
+    monkeypatch.setenv(MUTANT_UNDER_TEST, '2')
+    assert foo(2, 2) is False
+    assert A().bar(1) == 3
+    assert A().baz == 3
+
+
+@pytest.mark.parametrize('module_level_only', ['c = 1\n', '@decorator\ndef foo():\n    return 1\n'])
+def test_instrument_nothing(module_level_only):
+    mutations = list_mutations(Context(source=module_level_only))
+    assert mutations
+    assert instrument(module_level_only, 'foo.py', [(str(i), x) for i, x in enumerate(mutations)]) == (None, {})
+
+
+def test_instrument_parses_the_source_once(monkeypatch):
+    import mutmut
+    import mutmut.schemata
+
+    mutations = list_mutations(Context(source=source))
+
+    def fail(context):
+        assert False, 'mutated one by one'
+
+    parses = []
+
+    def counting(parse):
+        def counted(*args, **kwargs):
+            parses.append(args)
+            return parse(*args, **kwargs)
+        return counted
+
+    monkeypatch.setattr(mutmut, 'mutate', fail)
+    monkeypatch.setattr(mutmut, 'parse', counting(mutmut.parse))
+    monkeypatch.setattr(mutmut.schemata, 'parse', counting(mutmut.schemata.parse))
+    result, keys = instrument(source, 'foo.py', [(str(i), x) for i, x in enumerate(mutations)])
+    # for the catalog, and to find the functions
+    assert len(parses) == 2
+    assert sorted(keys.values()) == ['0', '1', '2']
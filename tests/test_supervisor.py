@@ -0,0 +1,66 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from time import time
+
+import pytest
+
+from mutmut import popen_streaming_output
+from mutmut.supervisor import Supervisor
+
+PYTHON = '"{}"'.format(sys.executable)
+
+
+def test_supervisor_runs_processes_concurrently():
+    supervisor = Supervisor()
+    cmd = PYTHON + ' -c "import sys, time; time.sleep(0.5); print(\'done\'); sys.exit(3)"'
+    output = []
+    start = time()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        returncodes = list(executor.map(lambda _: supervisor.run(cmd, output.append), range(8)))
+    assert time() - start < 3
+    assert returncodes == [3] * 8
+    assert output == ['done\n'] * 8
+
+
+def test_supervisor_kills_processes_that_time_out():
+    supervisor = Supervisor()
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        slow = executor.submit(supervisor.run, PYTHON + ' -c "import time; time.sleep(10)"', print, timeout=0.5)
+        fast = executor.submit(supervisor.run, PYTHON + ' -c "pass"', print, timeout=5)
+        assert fast.result() == 0
+        start = time()
+        with pytest.raises(TimeoutError):
+            slow.result()
+        assert time() - start < 3
+
+
+def test_supervisor_passes_on_long_lines():
+    output = []
+    Supervisor().run(PYTHON + ' -c "print(\'x\' * 100000, end=\'\')"', output.append)
+    assert output == ['x' * 100000]
+
+
+def test_blocking_callback_holds_up_only_its_own_process():
+    supervisor = Supervisor()
+    release = Event()
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        blocked = executor.submit(supervisor.run, PYTHON + ' -c "print(1)"', lambda line: release.wait())
+        fast = executor.submit(supervisor.run, PYTHON + ' -c "pass"', print, timeout=5)
+        slow = executor.submit(supervisor.run, PYTHON + ' -c "import time; time.sleep(10)"', print, timeout=0.5)
+        try:
+            assert fast.result(timeout=5) == 0
+            with pytest.raises(TimeoutError):
+                slow.result(timeout=5)
+            assert not blocked.done()
+        finally:
+            release.set()
+        assert blocked.result(timeout=5) == 0
+
+
+def test_popen_streaming_output_off_the_main_thread():
+    output = []
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        returncode = executor.submit(popen_streaming_output, PYTHON + ' -c "print(\'hi\')"', output.append).result()
+    assert returncode == 0
+    assert output == ['hi\n']
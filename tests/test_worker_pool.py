@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+from mutmut.worker_pool import PoolWorker
+
+
+@pytest.fixture
+def project(tmpdir):
+    (tmpdir / 'foo.py').write('def foo():\n    return 1\n')
+    (tmpdir / 'test_foo.py').write('from foo import foo\n\n\ndef test_foo():\n    assert foo() == 1\n')
+    yield str(tmpdir)
+
+
+def test_pool_worker_swaps_mutants_in_and_out(project):
+    worker = PoolWorker('python -m pytest -x', cwd=project, env=dict(os.environ, PYTHONPATH=project), recycle_after=3)
+    try:
+        filename = os.path.join(project, 'foo.py')
+        assert worker.tests_pass(filename) is True
+        session = worker.pytest
+        assert worker.tests_pass(filename, mutated_source='def foo():\n    return 2\n') is False
+        assert worker.pytest is session
+        # the mutant is gone again
+        assert worker.tests_pass(filename) is True
+        # and after three mutants the session is recycled
+        assert worker.pytest is None
+    finally:
+        worker.stop()
+
+
+def test_pool_worker_timeout_kills_session(project):
+    worker = PoolWorker('python -m pytest -x', cwd=project, env=dict(os.environ, PYTHONPATH=project))
+    try:
+        filename = os.path.join(project, 'foo.py')
+        with pytest.raises(TimeoutError):
+            worker.tests_pass(filename, mutated_source='def foo():\n    while True:\n        pass\n', timeout=1)
+        assert worker.pytest is None
+        assert worker.tests_pass(filename) is True
+    finally:
+        worker.stop()
+
+
+def test_pool_worker_reports_failed_test(project):
+    worker = PoolWorker('python -m pytest -x', cwd=project, env=dict(os.environ, PYTHONPATH=project))
+    failed = []
+    try:
+        filename = os.path.join(project, 'foo.py')
+        assert worker.tests_pass(filename, mutated_source='def foo():\n    return 2\n', on_failure=failed.append) is False
+        assert failed == ['test_foo.py::test_foo']
+    finally:
+        worker.stop()